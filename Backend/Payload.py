@@ -1,5 +1,9 @@
 import wave
 import contextlib
+from typing import Dict, Any, Union, BinaryIO, Optional
+from PIL import Image
+from stego_rev import (HEADER_BIT_LENGTH, DENSITY_MODES, DEFAULT_DENSITY, COMPRESSION_CODECS, MIN_FRAME_RATE,
+                       MAX_FRAME_RATE, MAX_AUDIO_DURATION, SUPPORTED_SAMPLE_WIDTHS, available_body_bits)
 
 def calculate_audio_payload_bits(file_path):
     with contextlib.closing(wave.open(file_path, 'rb')) as audio:
@@ -14,8 +18,122 @@ def calculate_audio_payload_bits(file_path):
         payload_bits = frame_rate * bit_depth * channels * duration
         return int(payload_bits), duration
 
-# Example usage
-audio_path = 'shreya.wav'
-payload_bits, duration = calculate_audio_payload_bits(audio_path)
-print(f"Payload: {payload_bits} bits")
-print(f"Duration: {duration:.2f} seconds")
+
+def plan_capacity(audio_file: Union[str, BinaryIO], image_file: Union[str, BinaryIO],
+                  legacy_layout: bool = False, payload_mode: str = 'scaled') -> Dict[str, Any]:
+    """
+    Compare the payload an audio file needs with the room an image offers.
+
+    Only the WAV header (wave params) and the image header (PIL size, without
+    loading pixels) are read, so this is cheap enough to run before any other
+    /embed work.
+
+    Args:
+        audio_file: Path to the WAV file or file-like object
+        image_file: Path to the carrier image or file-like object
+        legacy_layout: Plan the uncompressed default-density mode for the legacy layout
+        payload_mode: 'scaled' (16-bit mono) or 'pcm' (native frames, always versioned)
+
+    Returns:
+        Dict with "audio", "image" and "modes". Each mode entry reports the
+        required and available payload bits for one density/compression choice.
+        For compressed modes the required bits are the uncompressed size, and
+        "fits" is None when the result depends on the achieved compression ratio.
+
+    Raises:
+        ValueError: If either file header is invalid or unsupported
+    """
+    try:
+        if hasattr(audio_file, 'seek'):
+            audio_file.seek(0)
+        with contextlib.closing(wave.open(audio_file, 'rb')) as audio:
+            channels = audio.getnchannels()
+            sample_width = audio.getsampwidth()
+            frame_rate = audio.getframerate()
+            num_frames = audio.getnframes()
+    except (wave.Error, EOFError) as e:
+        raise ValueError(f"Wave file error: {str(e)}")
+    finally:
+        if hasattr(audio_file, 'seek'):
+            audio_file.seek(0)
+
+    if channels not in (1, 2):
+        raise ValueError(f"Unsupported number of channels: {channels}. Only mono and stereo are supported.")
+    if sample_width not in SUPPORTED_SAMPLE_WIDTHS:
+        raise ValueError(f"Unsupported sample width: {sample_width} bytes")
+    if not MIN_FRAME_RATE <= frame_rate <= MAX_FRAME_RATE:
+        raise ValueError(f"Frame rate {frame_rate} Hz is not supported. Must be between {MIN_FRAME_RATE} and {MAX_FRAME_RATE} Hz")
+    duration = num_frames / frame_rate
+    if duration > MAX_AUDIO_DURATION:
+        raise ValueError(f"Audio duration {duration:.1f} seconds exceeds maximum allowed duration of {MAX_AUDIO_DURATION} seconds")
+
+    try:
+        if hasattr(image_file, 'seek'):
+            image_file.seek(0)
+        with Image.open(image_file) as image:
+            width, height = image.size
+    except Exception as e:
+        raise ValueError(f"Invalid image file: {str(e)}")
+    finally:
+        if hasattr(image_file, 'seek'):
+            image_file.seek(0)
+
+    if payload_mode == 'pcm':
+        # audio_to_pcm stores the frames as they are
+        payload_bits = num_frames * channels * sample_width * 8
+        legacy_layout = False
+    else:
+        # audio_to_binary stores one 16-bit value per frame (stereo channels are averaged)
+        payload_bits = num_frames * 16
+    pixels = width * height
+
+    modes = []
+    for density in sorted(DENSITY_MODES):
+        for compression in [None] + sorted(COMPRESSION_CODECS):
+            versioned = not (legacy_layout and compression is None and density == DEFAULT_DENSITY)
+            required_bits = -(-payload_bits // 8) * 8 if versioned else payload_bits
+            available_bits = available_body_bits(pixels, density, versioned)
+            fits: Optional[bool] = required_bits <= available_bits
+            if compression is not None and not fits:
+                fits = None
+            modes.append({
+                "density": density,
+                "compression": compression,
+                "required_bits": required_bits,
+                "available_bits": available_bits,
+                "fits": fits,
+            })
+
+    return {
+        "audio": {
+            "channels": channels,
+            "sample_width": sample_width,
+            "frame_rate": frame_rate,
+            "frames": num_frames,
+            "duration": round(duration, 3),
+            "payload_mode": payload_mode,
+            "payload_bits": payload_bits,
+        },
+        "image": {
+            "width": width,
+            "height": height,
+            "pixels": pixels,
+        },
+        "modes": modes,
+    }
+
+
+def find_capacity_mode(plan: Dict[str, Any], density: int, compression: Optional[str]) -> Dict[str, Any]:
+    """Return the entry of plan["modes"] for the given density and compression."""
+    for mode in plan["modes"]:
+        if mode["density"] == density and mode["compression"] == compression:
+            return mode
+    raise ValueError(f"No capacity mode for density={density}, compression={compression}")
+
+
+if __name__ == "__main__":
+    # Example usage
+    audio_path = 'shreya.wav'
+    payload_bits, duration = calculate_audio_payload_bits(audio_path)
+    print(f"Payload: {payload_bits} bits")
+    print(f"Duration: {duration:.2f} seconds")
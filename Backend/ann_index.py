@@ -0,0 +1,446 @@
+import os
+import time
+import atexit
+import struct
+import tempfile
+import threading
+import itertools
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from logger import logger
+from config import config
+from fingerprint_index import EMBEDDING_DIM, fingerprint_embedding
+
+# File layout: header, centroids (n_lists x dim float32), list offsets
+# (n_lists + 1 int64), ids (n int64), vectors (n x dim float32), all little-endian
+INDEX_MAGIC = b'IVF1'
+INDEX_HEADER = struct.Struct('<4sIIQ')  # magic, dim, n_lists, n_vectors
+HEADER_BYTES = 64  # header padded so the arrays are 8-byte aligned
+KMEANS_CHUNK_ROWS = 65536
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def train_centroids(embeddings: np.ndarray, n_lists: int, iterations: int = 20,
+                    sample_size: Optional[int] = None, seed: int = 0) -> np.ndarray:
+    """
+    Spherical k-means over unit-norm embeddings (assignment by cosine similarity).
+
+    Args:
+        embeddings: (n, dim) float32 embeddings
+        n_lists: Number of centroids
+        iterations: Lloyd iterations
+        sample_size: Train on a random sample of this many rows (default 256 per centroid)
+        seed: Random seed
+
+    Returns:
+        np.ndarray: (n_lists, dim) float32 unit-norm centroids
+    """
+    rng = np.random.default_rng(seed)
+    n = len(embeddings)
+    if n < n_lists:
+        raise ValueError(f"Need at least {n_lists} embeddings to train {n_lists} lists, got {n}")
+    sample_size = min(n, sample_size or 256 * n_lists)
+    sample = embeddings[rng.choice(n, sample_size, replace=False)] if sample_size < n else embeddings
+    sample = np.ascontiguousarray(sample, dtype=np.float32)
+    centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = assign_lists(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=n_lists)
+        # Re-seed empty lists with random points
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        centroids = _normalize_rows(sums).astype(np.float32)
+    return centroids
+
+
+def assign_lists(embeddings: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """Index of the most similar centroid for each row, computed in chunks to bound memory."""
+    assignment = np.empty(len(embeddings), dtype=np.int64)
+    for start in range(0, len(embeddings), KMEANS_CHUNK_ROWS):
+        chunk = embeddings[start:start + KMEANS_CHUNK_ROWS]
+        assignment[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignment
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class IVFIndex:
+    """
+    Inverted-file (IVF) approximate nearest-neighbour index over fingerprint embeddings.
+
+    A k-means coarse quantizer splits the embeddings into n_lists lists; a
+    query is only scored against the nprobe lists whose centroids are most
+    similar to it, so search cost grows with n / n_lists * nprobe instead of n.
+    The index is saved as one file that is memory-mapped on load: lists are
+    read straight from the page cache and only copied into memory once they
+    are modified by add()/remove(). Updates find an entry through an
+    id -> (list, slot) map, built on the first update so loading stays cheap.
+    """
+
+    def __init__(self, centroids: np.ndarray, nprobe: Optional[int] = None, path: Optional[str] = None):
+        """
+        Initialize an empty index with trained centroids.
+
+        Args:
+            centroids: (n_lists, dim) unit-norm centroids (see train_centroids)
+            nprobe: Lists scanned per query
+            path: File used by save() (and autosaves)
+        """
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.n_lists, self.dim = self.centroids.shape
+        self.nprobe = config['ANN_NPROBE'] if nprobe is None else nprobe
+        self.path = path
+        # Per list: [vectors, ids, size, owned]; vectors/ids may be views into the mmap until owned
+        self._lists: List[list] = [
+            [np.zeros((0, self.dim), dtype=np.float32), np.zeros(0, dtype=np.int64), 0, True]
+            for _ in range(self.n_lists)
+        ]
+        # unique_id -> (list, slot); None until the first add()/remove()
+        self._locations: Optional[Dict[int, Tuple[int, int]]] = None
+        self._size = 0
+        self._changes = 0
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @classmethod
+    def build(cls, ids: np.ndarray, embeddings: np.ndarray, n_lists: Optional[int] = None,
+              nprobe: Optional[int] = None, path: Optional[str] = None, iterations: int = 20) -> "IVFIndex":
+        """
+        Train the quantizer on embeddings and index them.
+
+        Args:
+            ids: (n,) unique IDs
+            embeddings: (n, dim) unit-norm embeddings
+            n_lists: Number of lists (default: config ANN_N_LISTS, or sqrt(n) when 0)
+            nprobe: Lists scanned per query
+            path: File used by save()
+            iterations: k-means iterations
+
+        Returns:
+            IVFIndex: The populated index
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        ids = np.asarray(ids, dtype=np.int64)
+        if n_lists is None:
+            n_lists = config['ANN_N_LISTS']
+        if not n_lists:
+            n_lists = max(1, int(np.sqrt(len(embeddings))))
+        started = time.time()
+        index = cls(train_centroids(embeddings, n_lists, iterations), nprobe, path)
+        assignment = assign_lists(embeddings, index.centroids)
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(n_lists + 1))
+        for i in range(n_lists):
+            rows = order[bounds[i]:bounds[i + 1]]
+            index._lists[i] = [embeddings[rows], ids[rows], len(rows), True]
+        index._size = len(ids)
+        logger.info(f"Built IVF index: {len(ids)} embeddings, {n_lists} lists in {time.time() - started:.1f}s")
+        return index
+
+    def add(self, unique_id: int, embedding: np.ndarray) -> None:
+        """Insert an embedding into the list of its nearest centroid (existing entries are replaced)."""
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        if embedding.size != self.dim:
+            raise ValueError(f"Embedding has {embedding.size} values, expected {self.dim}")
+        with self._lock:
+            self._remove(unique_id)
+            i = int(np.argmax(self.centroids @ embedding))
+            entry = self._own(i, extra=1)
+            vectors, ids, size, _ = entry
+            vectors[size] = embedding
+            ids[size] = unique_id
+            entry[2] = size + 1
+            self._locations[unique_id] = (i, size)
+            self._size += 1
+            self._changed()
+
+    def add_fingerprint(self, unique_id: int, fingerprint: Any, original_filename: Optional[str] = None) -> None:
+        """Embed a fingerprint and add it (signature of the "store" database event)."""
+        self.add(unique_id, fingerprint_embedding(fingerprint))
+
+    def remove(self, unique_id: int) -> bool:
+        """
+        Remove an embedding (signature of the "delete" database event).
+
+        The owning list and slot are looked up in the location map, so this
+        takes constant time.
+
+        Returns:
+            bool: True if it was indexed
+        """
+        with self._lock:
+            removed = self._remove(unique_id)
+            if removed:
+                self._changed()
+            return removed
+
+    def search(self, embedding: np.ndarray, k: int = 5, nprobe: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Approximate top-k cosine search.
+
+        Args:
+            embedding: Unit-norm query embedding
+            k: Number of results
+            nprobe: Lists scanned (defaults to the index setting)
+
+        Returns:
+            List of (unique_id, cosine similarity), best first
+        """
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+        nprobe = min(self.nprobe if nprobe is None else nprobe, self.n_lists)
+        with self._lock:
+            probes = _top_k(self.centroids @ query, nprobe)
+            scores, ids = [], []
+            for i in probes:
+                vectors, list_ids, size, _ = self._lists[i]
+                if size:
+                    scores.append(vectors[:size] @ query)
+                    ids.append(list_ids[:size])
+            if not scores:
+                return []
+            scores = np.concatenate(scores)
+            ids = np.concatenate(ids)
+            top = _top_k(scores, k)
+            return [(int(ids[i]), float(scores[i])) for i in top]
+
+    def save(self, path: Optional[str] = None) -> None:
+        """
+        Write the index to one file (atomically, via a temporary file).
+
+        Only the list sizes and arrays are snapshotted under the lock; the
+        lists are marked copy-on-write, so searches and updates carry on
+        while the snapshot is written one list at a time. Memory-mapped
+        readers of a previous version keep their mapping.
+        """
+        path = path or self.path
+        if not path:
+            raise ValueError("No index path configured")
+        with self._save_lock:
+            with self._lock:
+                snapshot = [(entry[0], entry[1], entry[2]) for entry in self._lists]
+                for entry in self._lists:
+                    # The next update of a list copies it instead of changing the snapshot
+                    entry[3] = False
+                self._changes = 0
+            sizes = [size for _, _, size in snapshot]
+            offsets = np.concatenate([[0], np.cumsum(sizes)]).astype('<i8')
+            n = int(offsets[-1])
+            directory = os.path.dirname(os.path.abspath(path))
+            fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(INDEX_HEADER.pack(INDEX_MAGIC, self.dim, self.n_lists, n).ljust(HEADER_BYTES, b'\0'))
+                    f.write(self.centroids.astype('<f4').tobytes())
+                    f.write(offsets.tobytes())
+                    for _, ids, size in snapshot:
+                        f.write(ids[:size].astype('<i8').tobytes())
+                    for vectors, _, size in snapshot:
+                        f.write(vectors[:size].astype('<f4').tobytes())
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        logger.info(f"Saved IVF index with {n} embeddings to {path}")
+
+    @classmethod
+    def load(cls, path: str, nprobe: Optional[int] = None) -> "IVFIndex":
+        """
+        Memory-map an index written by save().
+
+        Raises:
+            ValueError: If the file is not a valid index
+        """
+        mapped = np.memmap(path, dtype=np.uint8, mode='r')
+        magic, dim, n_lists, n = INDEX_HEADER.unpack_from(mapped[:INDEX_HEADER.size].tobytes())
+        if magic != INDEX_MAGIC:
+            raise ValueError(f"Not an IVF index file: {path}")
+        position = HEADER_BYTES
+
+        def take(dtype: str, count: int) -> np.ndarray:
+            nonlocal position
+            size = np.dtype(dtype).itemsize * count
+            if position + size > len(mapped):
+                raise ValueError(f"Truncated IVF index file: {path}")
+            array = mapped[position:position + size].view(dtype)
+            position += size
+            return array
+
+        centroids = take('<f4', n_lists * dim).reshape(n_lists, dim)
+        offsets = take('<i8', n_lists + 1)
+        ids = take('<i8', n)
+        vectors = take('<f4', n * dim).reshape(n, dim)
+        index = cls(np.array(centroids), nprobe, path)
+        for i in range(n_lists):
+            start, end = int(offsets[i]), int(offsets[i + 1])
+            index._lists[i] = [vectors[start:end], ids[start:end], end - start, False]
+        index._size = n
+        logger.info(f"Loaded IVF index with {n} embeddings and {n_lists} lists from {path}")
+        return index
+
+    def _own(self, i: int, extra: int = 0) -> list:
+        """Make list i writable in memory with room for extra more rows. Caller holds the lock."""
+        entry = self._lists[i]
+        vectors, ids, size, owned = entry
+        if owned and size + extra <= len(ids):
+            return entry
+        capacity = max(size + extra, 2 * size, 16) if size + extra > len(ids) else len(ids)
+        new_vectors = np.empty((capacity, self.dim), dtype=np.float32)
+        new_ids = np.empty(capacity, dtype=np.int64)
+        new_vectors[:size] = vectors[:size]
+        new_ids[:size] = ids[:size]
+        entry[:] = [new_vectors, new_ids, size, True]
+        return entry
+
+    def _index_locations(self) -> Dict[int, Tuple[int, int]]:
+        """Build the id -> (list, slot) map on first use. Caller holds the lock."""
+        if self._locations is None:
+            locations = {}
+            for i, (_, ids, size, _) in enumerate(self._lists):
+                locations.update(zip(ids[:size].tolist(), zip(itertools.repeat(i), range(size))))
+            self._locations = locations
+        return self._locations
+
+    def _remove(self, unique_id: int) -> bool:
+        """Remove an ID from whichever list holds it. Caller holds the lock."""
+        locations = self._index_locations()
+        location = locations.pop(unique_id, None)
+        if location is None:
+            return False
+        i, position = location
+        entry = self._own(i)
+        vectors, ids, size, _ = entry
+        last = size - 1
+        if position != last:
+            # Move the last row into the hole
+            vectors[position] = vectors[last]
+            ids[position] = ids[last]
+            locations[int(ids[position])] = (i, position)
+        entry[2] = last
+        self._size -= 1
+        return True
+
+    def _changed(self) -> None:
+        """Count a change and save in the background every ANN_SAVE_EVERY changes. Caller holds the lock."""
+        self._changes += 1
+        if self.path and config['ANN_SAVE_EVERY'] and self._changes >= config['ANN_SAVE_EVERY']:
+            self._changes = 0
+            threading.Thread(target=self._save_quietly, name="ann-index-save", daemon=True).start()
+
+    def _save_quietly(self) -> None:
+        try:
+            self.save()
+        except Exception as e:
+            logger.error(f"Error saving IVF index: {str(e)}")
+
+
+def load_ann_index() -> Optional[IVFIndex]:
+    """
+    Load the index at ANN_INDEX_PATH if one has been built.
+
+    Unsaved changes are written back at interpreter exit.
+
+    Returns:
+        IVFIndex, or None when ANN search is not configured or not built yet
+    """
+    path = config['ANN_INDEX_PATH']
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        index = IVFIndex.load(path)
+    except Exception as e:
+        logger.error(f"Failed to load IVF index from {path}: {str(e)}")
+        return None
+    atexit.register(lambda: index._changes and index._save_quietly())
+    return index
+
+
+def benchmark(index: IVFIndex, ids: np.ndarray, embeddings: np.ndarray, queries: np.ndarray,
+              k: int = 10, nprobes: Iterable[int] = (1, 4, 8, 16, 32)) -> List[Dict[str, float]]:
+    """
+    Compare the index with exact search over the same embeddings.
+
+    Args:
+        index: Index to evaluate
+        ids: (n,) IDs of the indexed embeddings
+        embeddings: (n, dim) indexed embeddings (exact search runs over these)
+        queries: (q, dim) query embeddings
+        k: Neighbours per query
+        nprobes: nprobe values to evaluate
+
+    Returns:
+        One dict per nprobe with recall@k and mean latency in milliseconds,
+        plus a first entry for exact search
+    """
+    exact, started = [], time.perf_counter()
+    for query in queries:
+        exact.append(set(ids[_top_k(embeddings @ query, k)].tolist()))
+    results = [{"nprobe": 0, "recall": 1.0, "latency_ms": (time.perf_counter() - started) / len(queries) * 1000}]
+    for nprobe in nprobes:
+        hits, started = 0, time.perf_counter()
+        for query, expected in zip(queries, exact):
+            hits += len(expected.intersection(uid for uid, _ in index.search(query, k, nprobe)))
+        results.append({
+            "nprobe": nprobe,
+            "recall": hits / (k * len(queries)),
+            "latency_ms": (time.perf_counter() - started) / len(queries) * 1000,
+        })
+    return results
+
+
+def _synthetic_embeddings(n: int, clusters: int, seed: int = 0) -> np.ndarray:
+    """Unit-norm embeddings drawn around random cluster centres (stand-in for real fingerprints)."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, EMBEDDING_DIM)).astype(np.float32)
+    points = centres[rng.integers(0, clusters, n)] + 0.35 * rng.normal(size=(n, EMBEDDING_DIM)).astype(np.float32)
+    return _normalize_rows(points).astype(np.float32)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or benchmark the IVF fingerprint index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Build ANN_INDEX_PATH from the stored fingerprints")
+    build_parser.add_argument("--lists", type=int, default=None, help="Number of lists (default: sqrt(n))")
+    bench_parser = subparsers.add_parser("benchmark", help="Recall/latency against exact search on synthetic data")
+    bench_parser.add_argument("--n", type=int, default=200000)
+    bench_parser.add_argument("--lists", type=int, default=None)
+    bench_parser.add_argument("--queries", type=int, default=200)
+    bench_parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        from database import db_manager
+        if not config['ANN_INDEX_PATH']:
+            raise SystemExit("Set STEGO_ANN_INDEX_PATH to the index file to build")
+        rows = list(db_manager.iter_embeddings())
+        if not rows:
+            raise SystemExit("No fingerprints stored")
+        all_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        all_embeddings = np.stack([row[1] for row in rows]).astype(np.float32)
+        IVFIndex.build(all_ids, all_embeddings, args.lists, path=config['ANN_INDEX_PATH']).save()
+    else:
+        data = _synthetic_embeddings(args.n + args.queries, clusters=max(16, args.n // 500))
+        all_ids = np.arange(args.n, dtype=np.int64)
+        ivf = IVFIndex.build(all_ids, data[:args.n], args.lists)
+        for row in benchmark(ivf, all_ids, data[:args.n], data[args.n:], args.k):
+            label = "exact" if row["nprobe"] == 0 else f"nprobe={row['nprobe']}"
+            print(f"{label:>12}  recall@{args.k}={row['recall']:.3f}  {row['latency_ms']:.2f} ms/query")
@@ -1,28 +1,31 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, send_file, url_for
 from io import BytesIO
-from stego_rev import embed_data_rgb, extract_data_from_image, audio_to_binary, binary_to_audio
-from unique_id import unique_id_generator
-from fingetprint import generate_fingerprint, match_audio
+from stego_rev import COMPRESSION_CODECS, DENSITY_MODES, DEFAULT_DENSITY, PAYLOAD_MODES, InsufficientCapacityError
+from Payload import plan_capacity, find_capacity_mode
+from fingetprint import match_audio
 from database import db_manager
 from logger import logger
 from config import config
+from workers import worker_pool, fingerprint_task, embed_task, extract_audio_task, voice_features_task
+from jobs import job_manager
+from output_store import output_store
+from cache import extract_cache, fingerprint_cache, comparison_cache
+from spectrum_plot import render_spectrum_png
+from audio_io import AudioDecodeError
+from fingerprint_index import fingerprint_index, fingerprint_embedding
+from ann_index import load_ann_index
+from concurrent.futures import TimeoutError as WorkerTimeoutError
 import numpy as np
 import base64
-from typing import Dict, Any
+import hashlib
+import uuid
+from typing import Dict, Any, Optional, Tuple
+import queue
 import os
 from werkzeug.utils import secure_filename
-import librosa
 from scipy.spatial.distance import cosine
 from sklearn.metrics.pairwise import cosine_similarity
 from flask_cors import CORS
-from scipy.io import wavfile
-import io
-from pydub import AudioSegment
-import tempfile
-import matplotlib
-matplotlib.use('Agg')  # Set the backend to non-interactive 'Agg'
-import matplotlib.pyplot as plt
-from scipy.signal import find_peaks
 
 app = Flask(__name__)
 
@@ -32,7 +35,9 @@ CORS(app,
          "origins": ["http://localhost:3000"],  # Your React app's URL
          "methods": ["GET", "POST", "OPTIONS"],
          "allow_headers": ["Content-Type", "Authorization"],
-         "expose_headers": ["Content-Type", "Authorization"],
+         "expose_headers": ["Content-Type", "Authorization", "X-Unique-Id", "X-Saved-Image-Path",
+                            "X-Output-Key", "X-Payload-Density", "X-Payload-Compression", "X-Payload-Mode",
+                            "X-Match-Result", "X-Original-Filename"],
          "supports_credentials": True
      }},
      supports_credentials=True)
@@ -41,6 +46,19 @@ CORS(app,
 app.config['MAX_CONTENT_LENGTH'] = config['MAX_FILE_SIZE']
 app.config['SECRET_KEY'] = config['SECRET_KEY']
 
+OUTPUT_MIMETYPES = {"png": "image/png", "wav": "audio/wav"}
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# Cached extraction results are only valid while their fingerprint exists
+db_manager.add_listener("delete", extract_cache.invalidate_tag)
+# Keep the identification index in sync with the stored fingerprints. With a
+# built IVF index (ANN_INDEX_PATH) /identify searches it instead of the exact
+# in-memory matrix, which is then never loaded.
+ann_index = load_ann_index()
+identify_index = ann_index if ann_index is not None else fingerprint_index
+db_manager.add_listener("store", identify_index.add_fingerprint)
+db_manager.add_listener("delete", identify_index.remove)
+
 # Ensure upload directory exists
 UPLOAD_FOLDER = 'uploads'
 if not os.path.exists(UPLOAD_FOLDER):
@@ -57,26 +75,35 @@ def validate_file_size(file) -> bool:
     file.seek(0)
     return size <= config['MAX_FILE_SIZE']
 
-@app.route('/embed', methods=['POST'])
-def embed() -> Dict[str, Any]:
+def output_url(key: str) -> str:
+    """URL path serving a file from the output store."""
+    return f"/outputs/{key}"
+
+def discard_fingerprint(unique_id) -> None:
+    """Remove the fingerprint (or reserved placeholder) of an embed request that did not complete."""
+    if unique_id is not None and db_manager.delete_fingerprint(unique_id):
+        logger.info(f"Removed fingerprint for failed embed: {unique_id}")
+
+@app.route('/capacity', methods=['POST'])
+def capacity() -> Dict[str, Any]:
     """
-    Embed audio data into an image using steganography.
+    Report whether an audio file fits into an image for each density/compression mode.
+    Only the file headers are read.
     Expected request:
     - image: Image file (PNG/JPG)
     - audio: Audio file (WAV)
+    - payload_mode: Optional form field, "scaled" or "pcm"
     Returns:
-    - JSON response with stego image and status
+    - JSON response with the audio/image parameters and a per-mode capacity plan
     """
     try:
-        # Validate request
         if 'image' not in request.files or 'audio' not in request.files:
-            logger.warning("Missing required files in embed request")
+            logger.warning("Missing required files in capacity request")
             return jsonify({"error": "Missing required files"}), 400
 
         image_file = request.files['image']
         audio_file = request.files['audio']
 
-        # Validate file types
         if not allowed_file(image_file.filename, config['ALLOWED_IMAGE_EXTENSIONS']):
             logger.warning(f"Invalid image file type: {image_file.filename}")
             return jsonify({"error": "Invalid image file type"}), 400
@@ -84,77 +111,444 @@ def embed() -> Dict[str, Any]:
             logger.warning(f"Invalid audio file type: {audio_file.filename}")
             return jsonify({"error": "Invalid audio file type"}), 400
 
-        # Validate file sizes
-        if not validate_file_size(image_file) or not validate_file_size(audio_file):
-            logger.warning("File size exceeds limit")
-            return jsonify({"error": "File size exceeds limit"}), 413
-
-        # Secure filenames
-        image_filename = secure_filename(image_file.filename)
-        audio_filename = secure_filename(audio_file.filename)
-
-        logger.info(f"Processing files: {image_filename}, {audio_filename}")
+        payload_mode = request.form.get('payload_mode', config['PAYLOAD_MODE'])
+        if payload_mode not in PAYLOAD_MODES:
+            return jsonify({"error": f"Invalid payload mode. Allowed: {list(PAYLOAD_MODES)}"}), 400
 
-        # Read files into memory
-        image_data = BytesIO(image_file.read())
-        audio_data = BytesIO(audio_file.read())
-
-        # Generate fingerprint and unique ID
         try:
-            generated_fp = generate_fingerprint(audio_data)
-            unique_id = unique_id_generator()
-            
-            # Store in database using the new database manager
-            db_result = db_manager.store_fingerprint(unique_id, generated_fp, audio_filename)
-            logger.info(f"Fingerprint stored with unique_id: {unique_id}")
-            
-            unique_id = format(unique_id, '032b')
-            
-            # Reset audio_data pointer for audio_to_binary
-            audio_data.seek(0)
-            binary_data, frame_rate = audio_to_binary(audio_data)
-            
+            plan = plan_capacity(audio_file.stream, image_file.stream, bool(config['PAYLOAD_LEGACY_LAYOUT']),
+                                 payload_mode)
         except ValueError as e:
-            logger.error(f"Error processing audio: {str(e)}")
-            return jsonify({"error": str(e)}), 400
-        except IOError as e:
-            logger.error(f"Error processing audio: {str(e)}")
+            logger.warning(f"Capacity planning failed: {str(e)}")
             return jsonify({"error": str(e)}), 400
-        except Exception as e:
-            logger.error(f"Error processing audio: {str(e)}")
-            return jsonify({"error": "Error processing audio file"}), 400
 
-        # Embed data into image
+        return jsonify(plan), 200
+
+    except Exception as e:
+        logger.error(f"Unexpected error in capacity endpoint: {str(e)}")
+        return jsonify({"error": "An unexpected error occurred"}), 500
+
+def parse_embed_request() -> Tuple[Optional[Dict[str, Any]], Optional[Tuple[Dict[str, Any], int]]]:
+    """
+    Validate an embed request and read its uploads into memory.
+
+    Returns:
+        Tuple of (process_embed keyword arguments, None) or (None, (error body, HTTP status))
+    """
+    if 'image' not in request.files or 'audio' not in request.files:
+        logger.warning("Missing required files in embed request")
+        return None, ({"error": "Missing required files"}, 400)
+
+    image_file = request.files['image']
+    audio_file = request.files['audio']
+
+    # Validate file types
+    if not allowed_file(image_file.filename, config['ALLOWED_IMAGE_EXTENSIONS']):
+        logger.warning(f"Invalid image file type: {image_file.filename}")
+        return None, ({"error": "Invalid image file type"}, 400)
+    if not allowed_file(audio_file.filename, config['ALLOWED_AUDIO_EXTENSIONS']):
+        logger.warning(f"Invalid audio file type: {audio_file.filename}")
+        return None, ({"error": "Invalid audio file type"}, 400)
+
+    # Validate file sizes
+    if not validate_file_size(image_file) or not validate_file_size(audio_file):
+        logger.warning("File size exceeds limit")
+        return None, ({"error": "File size exceeds limit"}, 413)
+
+    # Validate payload compression options
+    compression = request.form.get('compression', config['PAYLOAD_COMPRESSION']) or None
+    if compression is not None and compression not in COMPRESSION_CODECS:
+        logger.warning(f"Invalid compression codec: {compression}")
+        return None, ({"error": f"Invalid compression codec. Allowed: {sorted(COMPRESSION_CODECS)}"}, 400)
+    try:
+        compression_level = int(request.form.get('compression_level', config['PAYLOAD_COMPRESSION_LEVEL']))
+    except ValueError:
+        return None, ({"error": "Invalid compression level"}, 400)
+    if not 0 <= compression_level <= 9:
+        return None, ({"error": "Compression level must be between 0 and 9"}, 400)
+    try:
+        density = int(request.form.get('density', config['PAYLOAD_DENSITY']))
+    except ValueError:
+        return None, ({"error": "Invalid density"}, 400)
+    if density not in DENSITY_MODES:
+        return None, ({"error": f"Invalid density. Allowed: {sorted(DENSITY_MODES)}"}, 400)
+    try:
+        png_compress_level = int(request.form.get('png_compress_level', config['PNG_COMPRESS_LEVEL']))
+    except ValueError:
+        return None, ({"error": "Invalid PNG compress level"}, 400)
+    if not 0 <= png_compress_level <= 9:
+        return None, ({"error": "PNG compress level must be between 0 and 9"}, 400)
+    payload_mode = request.form.get('payload_mode', config['PAYLOAD_MODE'])
+    if payload_mode not in PAYLOAD_MODES:
+        logger.warning(f"Invalid payload mode: {payload_mode}")
+        return None, ({"error": f"Invalid payload mode. Allowed: {list(PAYLOAD_MODES)}"}, 400)
+
+    # Secure filenames
+    image_filename = secure_filename(image_file.filename)
+    audio_filename = secure_filename(audio_file.filename)
+
+    logger.info(f"Processing files: {image_filename}, {audio_filename}")
+
+    # Read files into memory
+    return {
+        "image_bytes": image_file.read(),
+        "audio_bytes": audio_file.read(),
+        "audio_filename": audio_filename,
+        "compression": compression,
+        "compression_level": compression_level,
+        "density": density,
+        "png_compress_level": png_compress_level,
+        "payload_mode": payload_mode,
+    }, None
+
+
+def insufficient_space(required_bits: int, available_bits: int, plan: Dict[str, Any]) -> Dict[str, Any]:
+    """Body of the 413 response for a payload that does not fit into the image."""
+    return {
+        "error": "Insufficient space in the image",
+        "required_bits": required_bits,
+        "available_bits": available_bits,
+        "modes": plan["modes"]
+    }
+
+
+def process_embed(image_bytes: bytes, audio_bytes: bytes, audio_filename: str, compression: Optional[str],
+                  compression_level: int, density: int, png_compress_level: int,
+                  payload_mode: str = 'scaled') -> Tuple[Dict[str, Any], int]:
+    """
+    Fingerprint the audio, embed it into the image and encode the result.
+
+    Shared by POST /embed and embed jobs. Runs outside the request context.
+
+    Returns:
+        Tuple of (response body, HTTP status). On success the body holds the
+        encoded PNG as raw bytes under "stego_image"; see embed_json_body().
+    """
+    image_data = BytesIO(image_bytes)
+    audio_data = BytesIO(audio_bytes)
+    legacy_layout = (bool(config['PAYLOAD_LEGACY_LAYOUT']) and payload_mode == 'scaled'
+                     and compression is None and density == DEFAULT_DENSITY)
+
+    # Check capacity from the file headers before doing any expensive work
+    try:
+        plan = plan_capacity(audio_data, image_data, legacy_layout, payload_mode)
+    except ValueError as e:
+        logger.warning(f"Capacity planning failed: {str(e)}")
+        return {"error": str(e)}, 400
+    mode = find_capacity_mode(plan, density, compression)
+    if mode["fits"] is False:
+        logger.warning(f"Insufficient space in the image: {mode}")
+        return insufficient_space(mode["required_bits"], mode["available_bits"], plan), 413
+
+    # Reserve the unique ID that is embedded into the image. The reservation
+    # is atomic, so concurrent embeds never embed the same ID.
+    unique_id = db_manager.reserve_unique_id(audio_filename)
+    if unique_id is None:
+        return {"error": "Error reserving unique ID"}, 500
+
+    # Decode the audio once in a worker process: fingerprint it, embed it into
+    # the image and encode the PNG
+    try:
+        png_bytes, generated_fp = worker_pool.run(
+            embed_task,
+            image_bytes,
+            audio_bytes,
+            format(unique_id, '032b'),
+            compression,
+            compression_level,
+            density,
+            png_compress_level,
+            legacy_layout,
+            payload_mode
+        )
+    except WorkerTimeoutError:
+        logger.error("Timed out embedding data")
+        discard_fingerprint(unique_id)
+        return {"error": "Processing timed out"}, 504
+    except InsufficientCapacityError as e:
+        # Compressed payloads only turn out too large once compressed
+        logger.warning(f"Insufficient space in the image: {str(e)}")
+        discard_fingerprint(unique_id)
+        return insufficient_space(e.required_bits, e.available_bits, plan), 413
+    except ValueError as e:
+        logger.error(f"Error processing audio: {str(e)}")
+        discard_fingerprint(unique_id)
+        return {"error": str(e)}, 400
+    except Exception as e:
+        logger.error(f"Error embedding data: {str(e)}")
+        discard_fingerprint(unique_id)
+        return {"error": "Error embedding data into image"}, 500
+
+    # Fill in the reserved ID with the fingerprint
+    if not db_manager.store_fingerprint(unique_id, generated_fp, audio_filename):
+        logger.error(f"Error storing fingerprint with unique_id: {unique_id}")
+        discard_fingerprint(unique_id)
+        return {"error": "Error storing fingerprint"}, 500
+    logger.info(f"Fingerprint stored with unique_id: {unique_id}")
+
+    # Keep a copy in the output store (written in the background)
+    try:
+        output_key = output_store.put(png_bytes, 'png')
+    except Exception as e:
+        logger.error(f"Error storing stego image: {str(e)}")
+        discard_fingerprint(unique_id)
+        return {"error": "Error saving stego image"}, 500
+
+    logger.info("Embedding completed successfully")
+    return {
+        "saved_image_path": output_store.path(output_key),
+        "output_key": output_key,
+        "output_url": output_url(output_key),
+        "stego_image": png_bytes,
+        "message": "Embedding completed successfully",
+        "unique_id": format(unique_id, '032b'),
+        "density": density,
+        "compression": compression,
+        "payload_mode": payload_mode
+    }, 200
+
+
+def embed_json_body(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace the raw PNG of a process_embed() body with its base64 encoding."""
+    if "stego_image" not in body:
+        return body
+    body = dict(body)
+    body["stego_image_base64"] = base64.b64encode(body.pop("stego_image")).decode('utf-8')
+    return body
+
+
+def process_embed_json(**params) -> Tuple[Dict[str, Any], int]:
+    """
+    process_embed() with a JSON-serializable body, used by embed jobs.
+
+    The PNG is dropped rather than base64-encoded: like the WAV of extract
+    jobs it is served from output_url, so finished jobs stay small.
+    """
+    body, status = process_embed(**params)
+    return {key: value for key, value in body.items() if key != "stego_image"}, status
+
+
+def wants(*mimetypes: str) -> bool:
+    """Whether the client's Accept header prefers one of mimetypes over JSON."""
+    return request.accept_mimetypes.best_match(['application/json', *mimetypes]) in mimetypes
+
+
+def png_response(body: Dict[str, Any]) -> Response:
+    """Send the stego PNG as the response body with the embed metadata in headers."""
+    return Response(
+        body["stego_image"],
+        mimetype='image/png',
+        headers={
+            "X-Unique-Id": body["unique_id"],
+            "X-Saved-Image-Path": body["saved_image_path"],
+            "X-Output-Key": body["output_key"],
+            "X-Payload-Density": str(body["density"]),
+            "X-Payload-Compression": body["compression"] or "none",
+            "X-Payload-Mode": body["payload_mode"],
+        }
+    )
+
+
+def parse_extract_request() -> Tuple[Optional[Dict[str, Any]], Optional[Tuple[Dict[str, Any], int]]]:
+    """
+    Validate an extract request and read the stego image into memory.
+
+    Returns:
+        Tuple of (process_extract keyword arguments, None) or (None, (error body, HTTP status))
+    """
+    if 'image' not in request.files:
+        logger.warning("No image file provided in extract request")
+        return None, ({"error": "No image file provided"}, 400)
+
+    image_file = request.files['image']
+    
+    if not allowed_file(image_file.filename, config['ALLOWED_IMAGE_EXTENSIONS']):
+        logger.warning(f"Invalid image file type: {image_file.filename}")
+        return None, ({"error": "Invalid image file type"}, 400)
+
+    if not validate_file_size(image_file):
+        logger.warning("File size exceeds limit")
+        return None, ({"error": "File size exceeds limit"}, 413)
+
+    # Optional time window
+    unit = request.values.get('unit', 'seconds')
+    if unit not in ('seconds', 'samples'):
+        return None, ({"error": "Invalid unit. Allowed: ['samples', 'seconds']"}, 400)
+    window = {}
+    for name in ('start', 'end'):
+        value = request.values.get(name)
+        if value in (None, ''):
+            continue
         try:
-            output_image_path = os.path.join(config['OUTPUT_FOLDER'], 'stego_image_rev_flask.png')
-            stego_image = embed_data_rgb(
-                image_data,
-                frame_rate,
-                unique_id,
-                binary_data,
-                output_image_path
-            )
-        except Exception as e:
-            logger.error(f"Error embedding data: {str(e)}")
-            return jsonify({"error": "Error embedding data into image"}), 500
+            window[name] = int(value) if unit == 'samples' else float(value)
+        except ValueError:
+            return None, ({"error": f"Invalid {name}"}, 400)
+        if not 0 <= window[name] < float('inf'):
+            return None, ({"error": f"{name.capitalize()} must not be negative"}, 400)
+    if 'start' in window and 'end' in window and window['end'] <= window['start']:
+        return None, ({"error": "End must be after start"}, 400)
+
+    image_filename = secure_filename(image_file.filename)
+    logger.info(f"Processing extraction for: {image_filename}")
+
+    # Read image into memory
+    return {"image_bytes": image_file.read(), "start": window.get('start'), "end": window.get('end'), "unit": unit}, None
+
 
-        # Convert to base64
+def process_extract(image_bytes: bytes, start: Optional[float] = None, end: Optional[float] = None,
+                    unit: str = 'seconds') -> Tuple[Dict[str, Any], int]:
+    """
+    Extract the embedded audio and match it against the stored fingerprint.
+
+    With start and/or end only that window of the clip is extracted. A
+    window cannot be matched against the fingerprint of the whole clip, so
+    ranged requests return the audio without a match result.
+
+    Shared by POST /extract and extract jobs. Runs outside the request context.
+
+    Returns:
+        Tuple of (response body, HTTP status). On success the body holds the
+        WAV bytes under "extracted_audio"; see extract_json_body().
+    """
+    ranged = start is not None or end is not None
+
+    # Repeat uploads of the same image are answered from the extraction cache
+    image_digest = hashlib.sha256(image_bytes).hexdigest()
+    cache_key = image_digest
+    if ranged:
+        cache_key = hashlib.sha256(f"{image_digest}:{unit}:{start}:{end}".encode()).hexdigest()
+    cached = extract_cache.get(cache_key)
+    if cached is not None:
+        if output_store.get(cached["response"]["extracted_audio_key"]) is None:
+            output_store.put(cached["wav_bytes"], 'wav')
+        logger.info(f"Extraction cache hit for unique_id: {cached['unique_id']}")
+        return dict(cached["response"], extracted_audio=cached["wav_bytes"]), 200
+
+    # Extract data and convert it to audio in a worker process
+    try:
+        unique_id, frame_rate, wav_bytes, extracted_fp = worker_pool.run(
+            extract_audio_task, image_bytes, start, end, unit, not ranged
+        )
+        audio_key = output_store.put(wav_bytes, 'wav')
+        logger.info(f"Data extracted successfully: unique_id={unique_id}, frame_rate={frame_rate}")
+        logger.info("Audio data generated successfully")
+    except WorkerTimeoutError:
+        logger.error("Timed out extracting data")
+        return {"error": "Processing timed out"}, 504
+    except Exception as e:
+        logger.error(f"Error extracting data: {str(e)}")
+        return {"error": "Error extracting data from image"}, 400
+
+    # Fetch stored fingerprint using the new database manager
+    try:
+        stored_fp_data = db_manager.get_fingerprint(unique_id)
+        if not stored_fp_data:
+            logger.warning(f"Fingerprint not found for unique_id: {unique_id}")
+            return {"error": "Fingerprint not found"}, 404
+        stored_fp = stored_fp_data["fingerprint"]
+    except Exception as e:
+        logger.error(f"Error fetching fingerprint: {str(e)}")
+        return {"error": "Error fetching fingerprint"}, 500
+
+    # Match the fingerprint computed from the extracted samples
+    match_result = None
+    if not ranged:
         try:
-            image_buffer = BytesIO()
-            stego_image.save(image_buffer, format="PNG")
-            image_buffer.seek(0)
-            encoded_image = base64.b64encode(image_buffer.read()).decode('utf-8')
+            match_result = match_audio(extracted_fp, stored_fp)
+            logger.info(f"Audio match result: {match_result}")
         except Exception as e:
-            logger.error(f"Error encoding image: {str(e)}")
-            return jsonify({"error": "Error encoding image"}), 500
+            logger.error(f"Error matching fingerprints: {str(e)}")
+            return {"error": "Error matching fingerprints"}, 500
+
+    logger.info("Extraction completed successfully")
+    response = {
+        "message": "Audio extracted and processed successfully",
+        "unique_id": unique_id,
+        "match_result": match_result,
+        "original_filename": stored_fp_data.get("original_filename", "unknown"),
+        "extracted_audio_key": audio_key,
+        "extracted_audio_url": output_url(audio_key)
+    }
+    if ranged:
+        response["window"] = {"start": start, "end": end, "unit": unit, "frame_rate": frame_rate}
+    extract_cache.put(
+        cache_key,
+        {"unique_id": unique_id, "frame_rate": frame_rate, "wav_bytes": wav_bytes, "response": response},
+        size=len(wav_bytes) + 1024,
+        tag=unique_id
+    )
+    return dict(response, extracted_audio=wav_bytes), 200
 
-        logger.info("Embedding completed successfully")
-        return jsonify({
-            "saved_image_path": output_image_path,
-            "stego_image_base64": encoded_image,
-            "message": "Embedding completed successfully",
-            "unique_id": unique_id
-        }), 200
+
+def extract_json_body(body: Dict[str, Any]) -> Dict[str, Any]:
+    """Drop the raw WAV of a process_extract() body (it is served from extracted_audio_url)."""
+    return {key: value for key, value in body.items() if key != "extracted_audio"}
+
+
+def process_extract_json(**params) -> Tuple[Dict[str, Any], int]:
+    """process_extract() with a JSON-serializable body, used by extract jobs."""
+    body, status = process_extract(**params)
+    return extract_json_body(body), status
+
+
+def wav_response(body: Dict[str, Any]) -> Response:
+    """Stream the extracted WAV from memory in chunks, with the extraction results in headers."""
+    audio = memoryview(body["extracted_audio"])
+
+    def generate():
+        for offset in range(0, len(audio), STREAM_CHUNK_BYTES):
+            yield audio[offset:offset + STREAM_CHUNK_BYTES].tobytes()
+
+    headers = {
+        "X-Unique-Id": str(body["unique_id"]),
+        "X-Original-Filename": body["original_filename"],
+        "X-Output-Key": body["extracted_audio_key"],
+    }
+    if body["match_result"] is not None:
+        headers["X-Match-Result"] = str(body["match_result"])
+    return Response(generate(), mimetype='audio/wav', headers=headers)
+
+
+def submit_job(kind: str, fn, params: Dict[str, Any]):
+    """Queue a job and build the 202 response pointing at its status URL."""
+    try:
+        job = job_manager.submit(kind, fn, **params)
+    except queue.Full:
+        logger.warning(f"Job queue full, rejecting {kind} job")
+        return jsonify({"error": "Too many queued jobs, try again later"}), 503
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": url_for('get_job', job_id=job.id)
+    }), 202, {"Location": url_for('get_job', job_id=job.id)}
+
+
+@app.route('/embed', methods=['POST'])
+def embed() -> Dict[str, Any]:
+    """
+    Embed audio data into an image using steganography.
+    Expected request:
+    - image: Image file (PNG/JPG)
+    - audio: Audio file (WAV)
+    - compression: Optional form field, payload compression codec ("zlib" or "lzma")
+    - compression_level: Optional form field, compression level (0-9)
+    - density: Optional form field, bits stored per pixel (1, 3, 6 or 9)
+    - png_compress_level: Optional form field, zlib level of the stego PNG (0-9)
+    - payload_mode: Optional form field, "scaled" (16-bit mono) or "pcm" (original
+      WAV frames, extracted bit-exact)
+    Returns:
+    - JSON response with stego image (base64) and status, or with
+      "Accept: image/png" the PNG itself with the unique ID and payload
+      settings in X-Unique-Id/X-Payload-* headers
+    """
+    try:
+        params, error = parse_embed_request()
+        if error:
+            return jsonify(error[0]), error[1]
+        body, status = process_embed(**params)
+        if status == 200 and wants('image/png'):
+            return png_response(body)
+        return jsonify(embed_json_body(body)), status
 
     except Exception as e:
         logger.error(f"Unexpected error in embed endpoint: {str(e)}")
@@ -168,114 +562,199 @@ def extract() -> Dict[str, Any]:
     
     Expected request:
     - image: Stego image file
+    - start, end: Optional window of the clip to extract (form or query fields)
+    - unit: Optional unit of start/end, "seconds" (default) or "samples"
     
     Returns:
     - JSON response with extraction status and match result
+      (ranged requests skip the fingerprint match), or with
+      "Accept: audio/wav" the extracted WAV streamed in chunks, with the
+      results in X-Unique-Id/X-Match-Result/X-Original-Filename headers
     """
     try:
-        if 'image' not in request.files:
-            logger.warning("No image file provided in extract request")
-            return jsonify({"error": "No image file provided"}), 400
-
-        image_file = request.files['image']
-        
-        if not allowed_file(image_file.filename, config['ALLOWED_IMAGE_EXTENSIONS']):
-            logger.warning(f"Invalid image file type: {image_file.filename}")
-            return jsonify({"error": "Invalid image file type"}), 400
+        params, error = parse_extract_request()
+        if error:
+            return jsonify(error[0]), error[1]
+        body, status = process_extract(**params)
+        if status == 200 and wants('audio/wav', 'audio/x-wav'):
+            return wav_response(body)
+        return jsonify(extract_json_body(body)), status
 
-        if not validate_file_size(image_file):
-            logger.warning("File size exceeds limit")
-            return jsonify({"error": "File size exceeds limit"}), 413
-
-        image_filename = secure_filename(image_file.filename)
-        logger.info(f"Processing extraction for: {image_filename}")
+    except Exception as e:
+        logger.error(f"Unexpected error in extract endpoint: {str(e)}")
+        return jsonify({"error": "An unexpected error occurred"}), 500
 
-        # Read image into memory
-        image_data = BytesIO(image_file.read())
 
-        # Extract data
-        try:
-            extracted_binary, frame_rate, unique_id = extract_data_from_image(image_data)
-            logger.info(f"Data extracted successfully: unique_id={unique_id}, frame_rate={frame_rate}")
-        except Exception as e:
-            logger.error(f"Error extracting data: {str(e)}")
-            return jsonify({"error": "Error extracting data from image"}), 400
+@app.route('/identify', methods=['POST'])
+def identify() -> Dict[str, Any]:
+    """
+    Find the stored recordings most similar to an audio clip (1:N search).
+    
+    Expected request:
+    - audio: Audio file (WAV)
+    - top_k: Optional form or query field, number of matches to return
+    
+    Returns:
+    - JSON response with the best matches (unique ID, similarity percentage,
+      original filename), best first
+    """
+    try:
+        if 'audio' not in request.files:
+            logger.warning("No audio file in identify request")
+            return jsonify({"error": "No audio file provided"}), 400
 
-        # Convert to audio
-        try:
-            extracted_audio_file = os.path.join(config['OUTPUT_FOLDER'], 'extracted_audio_flask.wav')
-            binary_to_audio(extracted_binary, frame_rate, extracted_audio_file)
-            logger.info("Audio data generated successfully")
-        except Exception as e:
-            logger.error(f"Error converting binary to audio: {str(e)}")
-            return jsonify({"error": "Error converting binary to audio"}), 400
+        audio_file = request.files['audio']
+        if not allowed_file(audio_file.filename, config['ALLOWED_AUDIO_EXTENSIONS']):
+            logger.warning(f"Invalid audio file type: {audio_file.filename}")
+            return jsonify({"error": "Invalid audio file type"}), 400
+        if not validate_file_size(audio_file):
+            logger.warning("File size exceeds limit")
+            return jsonify({"error": "File size exceeds limit"}), 413
 
-        # Fetch stored fingerprint using the new database manager
         try:
-            stored_fp_data = db_manager.get_fingerprint(unique_id)
-            if not stored_fp_data:
-                logger.warning(f"Fingerprint not found for unique_id: {unique_id}")
-                return jsonify({"error": "Fingerprint not found"}), 404
-            stored_fp = stored_fp_data["fingerprint"]
-        except Exception as e:
-            logger.error(f"Error fetching fingerprint: {str(e)}")
-            return jsonify({"error": "Error fetching fingerprint"}), 500
+            top_k = int(request.values.get('top_k', config['IDENTIFY_TOP_K']))
+        except ValueError:
+            return jsonify({"error": "Invalid top_k"}), 400
+        if not 1 <= top_k <= config['IDENTIFY_MAX_TOP_K']:
+            return jsonify({"error": f"top_k must be between 1 and {config['IDENTIFY_MAX_TOP_K']}"}), 400
 
-        # Generate and match fingerprint
         try:
-            extracted_fp = generate_fingerprint(extracted_audio_file)
-            match_result = match_audio(extracted_fp, stored_fp)
-            logger.info(f"Audio match result: {match_result}")
+            query_fp = worker_pool.run(fingerprint_task, audio_file.read())
+            query_embedding = fingerprint_embedding(query_fp)
+        except WorkerTimeoutError:
+            logger.error("Timed out generating fingerprint")
+            return jsonify({"error": "Processing timed out"}), 504
         except Exception as e:
-            logger.error(f"Error matching fingerprints: {str(e)}")
-            return jsonify({"error": "Error matching fingerprints"}), 500
+            logger.error(f"Error processing audio: {str(e)}")
+            return jsonify({"error": "Error processing audio file"}), 400
 
-        logger.info("Extraction completed successfully")
+        if ann_index is not None:
+            results = ann_index.search(query_embedding, top_k)
+            filenames = db_manager.get_original_filenames([unique_id for unique_id, _ in results])
+            matches = [{
+                "unique_id": unique_id,
+                "similarity": round(score * 100, 2),
+                "original_filename": filenames.get(unique_id),
+            } for unique_id, score in results]
+        else:
+            fingerprint_index.ensure_loaded(db_manager.iter_embeddings)
+            matches = fingerprint_index.search(query_embedding, top_k)
+        logger.info(f"Identified {len(matches)} candidates among {len(identify_index)} fingerprints")
         return jsonify({
-            "message": "Audio extracted and processed successfully",
-            "match_result": match_result,
-            "original_filename": stored_fp_data.get("original_filename", "unknown")
+            "message": "Identification completed successfully",
+            "matches": matches,
+            "searched": len(identify_index)
         }), 200
 
     except Exception as e:
-        logger.error(f"Unexpected error in extract endpoint: {str(e)}")
+        logger.error(f"Unexpected error in identify endpoint: {str(e)}")
         return jsonify({"error": "An unexpected error occurred"}), 500
 
 
+@app.route('/jobs/embed', methods=['POST'])
+def create_embed_job() -> Dict[str, Any]:
+    """
+    Queue an embed request and return immediately.
+    Expected request: same as /embed
+    Returns:
+    - 202 with the job ID and its status URL (poll GET /jobs/<job_id>)
+    """
+    try:
+        params, error = parse_embed_request()
+        if error:
+            return jsonify(error[0]), error[1]
+        return submit_job("embed", process_embed_json, params)
+
+    except Exception as e:
+        logger.error(f"Unexpected error in embed job endpoint: {str(e)}")
+        return jsonify({"error": "An unexpected error occurred"}), 500
+
 
-def convert_to_wav(audio_file, filename):
-    """Convert audio file to WAV format."""
+@app.route('/jobs/extract', methods=['POST'])
+def create_extract_job() -> Dict[str, Any]:
+    """
+    Queue an extract request and return immediately.
+    Expected request: same as /extract
+    Returns:
+    - 202 with the job ID and its status URL (poll GET /jobs/<job_id>)
+    """
     try:
-        # Create a temporary file to store the original audio
-        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as temp_input:
-            audio_file.save(temp_input.name)
-            
-            # Load the audio file using pydub
-            audio = AudioSegment.from_file(temp_input.name)
-            
-            # Create a temporary file for the WAV output
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as temp_output:
-                # Export as WAV
-                audio.export(temp_output.name, format='wav')
-                return temp_output.name
+        params, error = parse_extract_request()
+        if error:
+            return jsonify(error[0]), error[1]
+        return submit_job("extract", process_extract_json, params)
+
     except Exception as e:
-        logger.error(f"Error converting audio to WAV: {str(e)}")
-        raise
-    finally:
-        # Clean up the temporary input file
-        if 'temp_input' in locals():
-            os.unlink(temp_input.name)
+        logger.error(f"Unexpected error in extract job endpoint: {str(e)}")
+        return jsonify({"error": "An unexpected error occurred"}), 500
+
+
+@app.route('/outputs/<key>', methods=['GET'])
+def get_output(key: str) -> Any:
+    """
+    Serve a stored stego image or extracted audio file by its content key.
+    Files are sent with sendfile where the server supports it.
+    """
+    try:
+        stored = output_store.get(key)
+    except ValueError:
+        return jsonify({"error": "Invalid output key"}), 400
+    if stored is None:
+        return jsonify({"error": "Output not found"}), 404
+
+    mimetype = OUTPUT_MIMETYPES.get(key.rsplit('.', 1)[1], 'application/octet-stream')
+    # Content-addressed files never change, so they can be cached indefinitely
+    if isinstance(stored, bytes):
+        response = send_file(BytesIO(stored), mimetype=mimetype, download_name=key, etag=key, max_age=31536000)
+    else:
+        response = send_file(stored, mimetype=mimetype, download_name=key, etag=key, max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats() -> Dict[str, Any]:
+    """
+    Report hit/miss counters and usage of the in-process caches.
+    Returns:
+    - JSON with one entry per cache (extraction results, fingerprints)
+    """
+    return jsonify({
+        "extract": extract_cache.stats(),
+        "fingerprint": fingerprint_cache.stats(),
+    }), 200
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id: str) -> Dict[str, Any]:
+    """
+    Report the status of a queued job.
+    Returns:
+    - JSON with status (queued, running, succeeded or failed) and timings.
+      Finished jobs also include the response body of the synchronous
+      endpoint as "result" and its HTTP status as "http_status".
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job.to_dict()), 200
+
+
 
 @app.route('/compare_audio', methods=['POST', 'OPTIONS'])
 def compare_audio() -> Dict[str, Any]:
+    """
+    Compare the speaker features of two audio files.
+    Expected request:
+    - audio1, audio2: Audio files (wav, mp3, webm, ogg or m4a)
+    - plot: Optional form or query field; "1" includes the spectrum plot as base64
+    Returns:
+    - JSON response with overall and per-feature similarities. The spectrum
+      plot is rendered on demand from spectrum_plot_url unless plot=1.
+    """
     if request.method == 'OPTIONS':
         return '', 200
 
-    temp_path1 = None
-    temp_path2 = None
-    wav_path1 = None
-    wav_path2 = None
-
     try:
         # Validate request
         if 'audio1' not in request.files or 'audio2' not in request.files:
@@ -312,70 +791,29 @@ def compare_audio() -> Dict[str, Any]:
 
         logger.info(f"Processing audio comparison: {audio1_filename}, {audio2_filename}")
 
-        # Convert files to WAV format
         try:
-            wav_path1 = convert_to_wav(audio1_file, audio1_filename)
-            wav_path2 = convert_to_wav(audio2_file, audio2_filename)
-        except Exception as e:
-            logger.error(f"Error converting audio files: {str(e)}")
-            return jsonify({
-                "error": "Error converting audio files",
-                "details": str(e)
-            }), 400
-
-        try:
-            # Load audio files
-            y1, sr1 = librosa.load(wav_path1)
-            y2, sr2 = librosa.load(wav_path2)
+            # Decode the uploads in memory and extract speaker-specific features in worker processes
+            features_futures = [
+                worker_pool.submit(voice_features_task, audio_file.read(), filename)
+                for audio_file, filename in ((audio1_file, audio1_filename), (audio2_file, audio2_filename))
+            ]
+            features1, features2 = [worker_pool.wait(future) for future in features_futures]
 
-            # Extract speaker-specific features
             # Pitch features
-            pitches1, magnitudes1 = librosa.piptrack(y=y1, sr=sr1)
-            pitches2, magnitudes2 = librosa.piptrack(y=y2, sr=sr2)
-            
-            pitch_mean1 = np.mean(pitches1[magnitudes1 > np.median(magnitudes1)])
-            pitch_std1 = np.std(pitches1[magnitudes1 > np.median(magnitudes1)])
-            pitch_range1 = np.ptp(pitches1[magnitudes1 > np.median(magnitudes1)])
-            
-            pitch_mean2 = np.mean(pitches2[magnitudes2 > np.median(magnitudes2)])
-            pitch_std2 = np.std(pitches2[magnitudes2 > np.median(magnitudes2)])
-            pitch_range2 = np.ptp(pitches2[magnitudes2 > np.median(magnitudes2)])
+            pitch_mean1, pitch_std1, pitch_range1 = features1['pitch_mean'], features1['pitch_std'], features1['pitch_range']
+            pitch_mean2, pitch_std2, pitch_range2 = features2['pitch_mean'], features2['pitch_std'], features2['pitch_range']
 
             # Amplitude features
-            amp_mean1 = np.mean(np.abs(y1))
-            amp_std1 = np.std(np.abs(y1))
-            amp_range1 = np.ptp(np.abs(y1))
-            
-            amp_mean2 = np.mean(np.abs(y2))
-            amp_std2 = np.std(np.abs(y2))
-            amp_range2 = np.ptp(np.abs(y2))
-
-            # Spectral features
-            spectral_centroids1 = librosa.feature.spectral_centroid(y=y1, sr=sr1)[0]
-            spectral_rolloff1 = librosa.feature.spectral_rolloff(y=y1, sr=sr1)[0]
-            spectral_bandwidth1 = librosa.feature.spectral_bandwidth(y=y1, sr=sr1)[0]
-            spectral_flatness1 = librosa.feature.spectral_flatness(y=y1)[0]
-            
-            spectral_centroids2 = librosa.feature.spectral_centroid(y=y2, sr=sr2)[0]
-            spectral_rolloff2 = librosa.feature.spectral_rolloff(y=y2, sr=sr2)[0]
-            spectral_bandwidth2 = librosa.feature.spectral_bandwidth(y=y2, sr=sr2)[0]
-            spectral_flatness2 = librosa.feature.spectral_flatness(y=y2)[0]
+            amp_mean1, amp_std1, amp_range1 = features1['amp_mean'], features1['amp_std'], features1['amp_range']
+            amp_mean2, amp_std2, amp_range2 = features2['amp_mean'], features2['amp_std'], features2['amp_range']
 
             # Frequency features
-            freqs1 = librosa.fft_frequencies(sr=sr1)
-            freqs2 = librosa.fft_frequencies(sr=sr2)
-            spectrum1 = np.abs(librosa.stft(y1))
-            spectrum2 = np.abs(librosa.stft(y2))
-            
-            peak_freqs1, _ = find_peaks(np.mean(spectrum1, axis=1), height=np.mean(np.mean(spectrum1, axis=1)))
-            peak_freqs2, _ = find_peaks(np.mean(spectrum2, axis=1), height=np.mean(np.mean(spectrum2, axis=1)))
-            
-            dominant_freq1 = freqs1[peak_freqs1[np.argmax(np.mean(spectrum1, axis=1)[peak_freqs1])]]
-            dominant_freq2 = freqs2[peak_freqs2[np.argmax(np.mean(spectrum2, axis=1)[peak_freqs2])]]
+            dominant_freq1 = features1['dominant_freq']
+            dominant_freq2 = features2['dominant_freq']
 
             # MFCCs
-            mfcc1 = librosa.feature.mfcc(y=y1, sr=sr1, n_mfcc=20)
-            mfcc2 = librosa.feature.mfcc(y=y2, sr=sr2, n_mfcc=20)
+            mfcc1 = features1['mfcc']
+            mfcc2 = features2['mfcc']
 
             # Calculate feature differences
             differences = {}
@@ -402,10 +840,8 @@ def compare_audio() -> Dict[str, Any]:
             # Spectral differences
             spectral_diffs = []
             spectral_features = {
-                'spectral_centroid': (spectral_centroids1, spectral_centroids2),
-                'spectral_rolloff': (spectral_rolloff1, spectral_rolloff2),
-                'spectral_bandwidth': (spectral_bandwidth1, spectral_bandwidth2),
-                'spectral_flatness': (spectral_flatness1, spectral_flatness2)
+                name: (features1[name], features2[name])
+                for name in ('spectral_centroid', 'spectral_rolloff', 'spectral_bandwidth', 'spectral_flatness')
             }
             
             for feature_name, (feature1, feature2) in spectral_features.items():
@@ -436,29 +872,13 @@ def compare_audio() -> Dict[str, Any]:
             }
             overall_similarity = sum(similarities[k] * weights[k] for k in similarities.keys())
 
-            # Create spectrum visualization
-            plt.figure(figsize=(12, 8))
-            
-            plt.subplot(2, 1, 1)
-            librosa.display.specshow(librosa.amplitude_to_db(np.abs(spectrum1), ref=np.max), 
-                                   sr=sr1, x_axis='time', y_axis='log')
-            plt.colorbar(format='%+2.0f dB')
-            plt.title(f'Spectrum of {audio1_filename}')
-            
-            plt.subplot(2, 1, 2)
-            librosa.display.specshow(librosa.amplitude_to_db(np.abs(spectrum2), ref=np.max), 
-                                   sr=sr2, x_axis='time', y_axis='log')
-            plt.colorbar(format='%+2.0f dB')
-            plt.title(f'Spectrum of {audio2_filename}')
-            
-            plt.tight_layout()
-
-            # Save plot to a bytes buffer
-            buf = BytesIO()
-            plt.savefig(buf, format='png', bbox_inches='tight', dpi=100)
-            buf.seek(0)
-            plot_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
-            plt.close()
+            # Keep the reduced spectrograms so the plot is only rendered when asked for
+            comparison_id = uuid.uuid4().hex
+            panels = [
+                (f'Spectrum of {audio1_filename}', features1['spectrum_image']),
+                (f'Spectrum of {audio2_filename}', features2['spectrum_image']),
+            ]
+            comparison_cache.put(comparison_id, panels, sum(image.nbytes for _, image in panels))
 
             # Determine if same speaker
             is_same_speaker = bool(
@@ -472,7 +892,7 @@ def compare_audio() -> Dict[str, Any]:
 
             logger.info(f"Audio comparison completed successfully. Similarity: {overall_similarity:.2f}%")
             
-            return jsonify({
+            response = {
                 "overall_similarity": round(overall_similarity, 2),
                 "is_same_speaker": is_same_speaker,
                 "feature_similarities": {
@@ -490,10 +910,26 @@ def compare_audio() -> Dict[str, Any]:
                     "mfcc": round(differences['mfcc'], 4)
                 },
                 "feature_thresholds": thresholds,
-                "spectrum_plot": plot_base64,
+                "comparison_id": comparison_id,
+                "spectrum_plot_url": url_for('get_spectrum_plot', comparison_id=comparison_id),
                 "message": "Audio comparison completed successfully"
-            }), 200
+            }
+            if request.values.get('plot', '').lower() in ('1', 'true', 'yes'):
+                response["spectrum_plot"] = base64.b64encode(render_spectrum_png(panels)).decode('utf-8')
+            return jsonify(response), 200
 
+        except AudioDecodeError as e:
+            logger.error(f"Error converting audio files: {str(e)}")
+            return jsonify({
+                "error": "Error converting audio files",
+                "details": str(e)
+            }), 400
+        except WorkerTimeoutError:
+            logger.error("Timed out processing audio comparison")
+            return jsonify({
+                "error": "Processing timed out",
+                "details": f"Feature extraction took longer than {worker_pool.timeout} seconds"
+            }), 504
         except Exception as e:
             logger.error(f"Error processing audio comparison: {str(e)}")
             return jsonify({
@@ -508,17 +944,28 @@ def compare_audio() -> Dict[str, Any]:
             "details": str(e)
         }), 500
 
-    finally:
-        # Clean up temporary files
-        for path in [wav_path1, wav_path2]:
-            if path and os.path.exists(path):
-                try:
-                    os.unlink(path)
-                except Exception as e:
-                    logger.error(f"Error cleaning up temporary file {path}: {str(e)}")
+@app.route('/compare/<comparison_id>/spectrum.png', methods=['GET'])
+def get_spectrum_plot(comparison_id: str) -> Any:
+    """
+    Render the spectrum plot of a recent /compare_audio request.
+    The reduced spectrograms are kept for COMPARE_CACHE_TTL seconds.
+    """
+    panels = comparison_cache.get(comparison_id)
+    if panels is None:
+        return jsonify({"error": "Comparison not found or expired"}), 404
+    try:
+        png = render_spectrum_png(panels)
+    except Exception as e:
+        logger.error(f"Error rendering spectrum plot: {str(e)}")
+        return jsonify({"error": "Error rendering spectrum plot"}), 500
+    return Response(png, mimetype='image/png', headers={"Cache-Control": "private, max-age=3600"})
 
 if __name__ == "__main__":
     logger.info("Starting Flask application")
+    worker_pool.start()
+    job_manager.start()
+    if ann_index is None:
+        fingerprint_index.ensure_loaded(db_manager.iter_embeddings)
     app.run(
         debug=config['DEBUG'],
         host=config['HOST'],
@@ -0,0 +1,169 @@
+import os
+import shutil
+import struct
+import tempfile
+import subprocess
+import numpy as np
+from typing import Optional, Tuple
+from pydub import AudioSegment
+from logger import logger
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+FFMPEG_TIMEOUT = 60  # seconds
+
+
+class AudioDecodeError(ValueError):
+    """Raised when an upload cannot be decoded to samples."""
+
+
+def parse_wav(data: bytes) -> Tuple[np.ndarray, int]:
+    """
+    Decode a PCM or IEEE float WAV file held in memory.
+
+    Chunk sizes that run past the end of the data (as written by encoders
+    streaming to a pipe) are truncated to the data available.
+
+    Args:
+        data: The WAV file
+
+    Returns:
+        Tuple of (mono float32 samples in [-1, 1], sample rate); channels are
+        averaged and integers scaled like librosa.load/soundfile do
+
+    Raises:
+        AudioDecodeError: If data is not a WAV file this parser supports
+    """
+    if len(data) < 12 or data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise AudioDecodeError("Not a RIFF/WAVE file")
+
+    fmt = None
+    position = 12
+    while position + 8 <= len(data):
+        chunk_id, chunk_size = struct.unpack_from('<4sI', data, position)
+        body = data[position + 8:position + 8 + chunk_size]
+        if chunk_id == b'fmt ':
+            if len(body) < 16:
+                raise AudioDecodeError("Truncated fmt chunk")
+            format_tag, channels, sample_rate, _, _, bits = struct.unpack_from('<HHIIHH', body)
+            if format_tag == WAVE_FORMAT_EXTENSIBLE and len(body) >= 26:
+                # The sub-format GUID starts with the actual format tag
+                format_tag = struct.unpack_from('<H', body, 24)[0]
+            fmt = (format_tag, channels, sample_rate, bits)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise AudioDecodeError("data chunk before fmt chunk")
+            return _wav_samples(body, *fmt)
+        # Chunks are word aligned
+        position += 8 + chunk_size + (chunk_size & 1)
+    raise AudioDecodeError("No data chunk found")
+
+
+def _wav_samples(body: bytes, format_tag: int, channels: int, sample_rate: int, bits: int) -> Tuple[np.ndarray, int]:
+    if not channels or not sample_rate:
+        raise AudioDecodeError("Invalid WAV format")
+    width = bits // 8
+    frame_bytes = width * channels
+    body = body[:len(body) // frame_bytes * frame_bytes] if frame_bytes else b''
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64):
+        samples = np.frombuffer(body, dtype='<f4' if bits == 32 else '<f8').astype(np.float32)
+    elif format_tag == WAVE_FORMAT_PCM and bits == 8:
+        samples = (np.frombuffer(body, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif format_tag == WAVE_FORMAT_PCM and bits in (16, 32):
+        raw = np.frombuffer(body, dtype='<i2' if bits == 16 else '<i4')
+        samples = raw / np.float32(2 ** (bits - 1))
+    elif format_tag == WAVE_FORMAT_PCM and bits == 24:
+        raw = np.frombuffer(body, dtype=np.uint8).reshape(-1, 3)
+        # Sign-extend the little-endian 24-bit values through the top byte of an int32
+        values = (raw[:, 0].astype(np.int32) << 8 | raw[:, 1].astype(np.int32) << 16
+                  | raw[:, 2].astype(np.int32) << 24) >> 8
+        samples = values / np.float32(2 ** 23)
+    else:
+        raise AudioDecodeError(f"Unsupported WAV encoding (format {format_tag:#x}, {bits} bits)")
+    samples = samples.astype(np.float32, copy=False)
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1)
+    return samples, sample_rate
+
+
+def decode_with_ffmpeg(data: bytes, ffmpeg: Optional[str] = None) -> Tuple[np.ndarray, int]:
+    """
+    Decode a compressed upload by piping it through ffmpeg in memory.
+
+    ffmpeg reads the upload from stdin and writes 16-bit PCM WAV (the same
+    conversion pydub's WAV export does) to stdout; nothing touches the disk.
+
+    Raises:
+        AudioDecodeError: If ffmpeg is missing or cannot decode the data
+            (e.g. MP4 containers with their index at the end need a seekable file)
+    """
+    ffmpeg = ffmpeg or shutil.which('ffmpeg')
+    if not ffmpeg:
+        raise AudioDecodeError("ffmpeg not found")
+    try:
+        result = subprocess.run(
+            [ffmpeg, '-nostdin', '-v', 'error', '-i', 'pipe:0', '-f', 'wav', '-acodec', 'pcm_s16le', 'pipe:1'],
+            input=data, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=FFMPEG_TIMEOUT
+        )
+    except (OSError, subprocess.TimeoutExpired) as e:
+        raise AudioDecodeError(f"ffmpeg failed: {str(e)}")
+    if result.returncode != 0 or not result.stdout:
+        raise AudioDecodeError(f"ffmpeg failed: {result.stderr.decode('utf-8', 'replace').strip()}")
+    return parse_wav(result.stdout)
+
+
+def decode_audio_file(data: bytes, filename: str) -> Tuple[np.ndarray, int]:
+    """
+    Decode an upload through temporary files with pydub (fallback for inputs
+    ffmpeg cannot read from a pipe).
+
+    Raises:
+        AudioDecodeError: If pydub cannot decode the file
+    """
+    temp_path = None
+    try:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(filename)[1]) as temp_input:
+            temp_input.write(data)
+            temp_path = temp_input.name
+        audio = AudioSegment.from_file(temp_path)
+        wav_buffer = audio.export(format='wav')
+        return parse_wav(wav_buffer.read())
+    except AudioDecodeError:
+        raise
+    except Exception as e:
+        raise AudioDecodeError(f"Error converting audio to WAV: {str(e)}")
+    finally:
+        if temp_path is not None:
+            os.unlink(temp_path)
+
+
+def decode_audio(data: bytes, filename: str = '') -> Tuple[np.ndarray, int]:
+    """
+    Decode an uploaded audio file to mono float samples at its own sample rate.
+
+    WAV files are parsed directly, other formats are piped through ffmpeg in
+    memory, and only uploads that both fail to decode fall back to
+    temporary files.
+
+    Args:
+        data: The uploaded file
+        filename: Upload filename (its extension helps the fallback decoder)
+
+    Returns:
+        Tuple of (mono float32 samples, sample rate)
+
+    Raises:
+        AudioDecodeError: If the upload cannot be decoded
+    """
+    if data[:4] == b'RIFF':
+        try:
+            return parse_wav(data)
+        except AudioDecodeError as e:
+            # e.g. ADPCM or other compressed WAV encodings
+            logger.info(f"Decoding {filename or 'upload'} with ffmpeg: {str(e)}")
+    try:
+        return decode_with_ffmpeg(data)
+    except AudioDecodeError as e:
+        logger.warning(f"In-memory decoding of {filename or 'upload'} failed, using a temporary file: {str(e)}")
+    return decode_audio_file(data, filename)
@@ -0,0 +1,275 @@
+import os
+import time
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+from logger import logger
+from config import config
+
+DISK_SUFFIX = '.pkl'
+
+
+class ByteLRUCache:
+    """
+    Thread-safe LRU cache bounded by the total size of its values.
+
+    Each entry may carry a tag (e.g. the unique ID it was derived from) so
+    all entries for that tag can be dropped with invalidate_tag(). With a
+    disk_dir, entries are also pickled to disk: they survive restarts and
+    are promoted back into memory on a hit. The disk tier is only meant for
+    files this process wrote itself. With a ttl, entries (in memory and on
+    disk) expire that many seconds after they were stored.
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: Optional[str] = None,
+                 disk_max_bytes: Optional[int] = None, name: str = "cache",
+                 ttl: Optional[float] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            max_bytes: Memory budget for the cached values
+            disk_dir: Directory for the on-disk tier (None disables it)
+            disk_max_bytes: Disk budget (defaults to max_bytes)
+            name: Name used in log messages
+            ttl: Seconds an entry stays valid (None: until evicted)
+        """
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = max_bytes if disk_max_bytes is None else disk_max_bytes
+        self.name = name
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, size, tag, expires)
+        self._bytes = 0
+        self._disk: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (path, size, tag)
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Return the cached value for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[3] is not None and entry[3] <= time.time():
+                # Expired
+                self._bytes -= self._entries.pop(key)[1]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            disk_entry = self._disk.get(key) if self.disk_dir else None
+
+        if disk_entry is not None:
+            path, size, tag = disk_entry
+            try:
+                stored_at = os.path.getmtime(path)
+                if self.ttl is not None and stored_at + self.ttl <= time.time():
+                    raise LookupError("expired")
+                with open(path, 'rb') as f:
+                    value = pickle.load(f)
+            except LookupError:
+                self._discard_disk(key)
+            except Exception as e:
+                logger.warning(f"Dropping unreadable {self.name} entry {path}: {str(e)}")
+                self._discard_disk(key)
+            else:
+                with self._lock:
+                    self.hits += 1
+                    if key in self._disk:
+                        self._disk.move_to_end(key)
+                    self._store(key, value, size, tag, None if self.ttl is None else stored_at + self.ttl)
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: Hashable, value: Any, size: int, tag: Optional[Any] = None) -> None:
+        """
+        Cache a value.
+
+        Args:
+            key: Cache key (a str when the disk tier is used)
+            value: Value to cache (must be picklable when the disk tier is used)
+            size: Approximate size of the value in bytes
+            tag: Optional tag for invalidate_tag() (compared as str)
+        """
+        if size > self.max_bytes:
+            return
+        tag = None if tag is None else str(tag)
+        with self._lock:
+            self._store(key, value, size, tag)
+        if self.disk_dir:
+            self._write_disk(key, value, size, tag)
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drop a single entry."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+        if self.disk_dir:
+            self._discard_disk(key)
+
+    def invalidate_tag(self, tag: Any) -> int:
+        """
+        Drop every entry stored with the given tag.
+
+        Returns:
+            int: Number of entries removed (memory and disk)
+        """
+        tag = str(tag)
+        removed = 0
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[2] == tag]:
+                self._bytes -= self._entries.pop(key)[1]
+                removed += 1
+            disk_keys = [k for k, entry in self._disk.items() if entry[2] == tag]
+        for key in disk_keys:
+            removed += self._discard_disk(key)
+        if removed:
+            logger.info(f"Invalidated {removed} {self.name} entries for {tag}")
+        return removed
+
+    def clear(self) -> None:
+        """Drop all entries, including the disk tier."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            disk_keys = list(self._disk)
+        for key in disk_keys:
+            self._discard_disk(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current usage."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "disk_entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "hit_rate": round(self.hits / (self.hits + self.misses), 4) if self.hits + self.misses else None,
+            }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries or key in self._disk
+
+    def _store(self, key: Hashable, value: Any, size: int, tag: Optional[Any],
+               expires: Optional[float] = None) -> None:
+        """Insert into the memory tier and evict least recently used entries. Caller holds the lock."""
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        if expires is None and self.ttl is not None:
+            expires = time.time() + self.ttl
+        self._entries[key] = (value, size, tag, expires)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            _, (_, evicted_size, _, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+
+    # On-disk tier. Files are named <key>-<tag><DISK_SUFFIX> so the index
+    # (including tags) can be rebuilt from a directory listing.
+
+    def _disk_path(self, key: str, tag: Optional[Any]) -> str:
+        return os.path.join(self.disk_dir, f"{key}-{'' if tag is None else tag}{DISK_SUFFIX}")
+
+    def _load_disk_index(self) -> None:
+        entries = []
+        with os.scandir(self.disk_dir) as it:
+            for entry in it:
+                if not entry.is_file() or not entry.name.endswith(DISK_SUFFIX) or '-' not in entry.name:
+                    continue
+                key, tag = entry.name[:-len(DISK_SUFFIX)].split('-', 1)
+                stat = entry.stat()
+                entries.append((stat.st_mtime, key, entry.path, stat.st_size, tag or None))
+        # Oldest first, so the least recently written files are evicted first
+        for _, key, path, size, tag in sorted(entries):
+            self._disk[key] = (path, size, tag)
+            self._disk_bytes += size
+        if entries:
+            logger.info(f"Loaded {len(entries)} {self.name} entries from {self.disk_dir}")
+
+    def _write_disk(self, key: str, value: Any, size: int, tag: Optional[Any]) -> None:
+        path = self._disk_path(key, tag)
+        try:
+            fd, temp_path = tempfile.mkstemp(dir=self.disk_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except Exception as e:
+            logger.error(f"Error writing {self.name} entry to disk: {str(e)}")
+            return
+
+        file_size = os.path.getsize(path)
+        evicted = []
+        with self._lock:
+            old = self._disk.pop(key, None)
+            if old is not None:
+                self._disk_bytes -= old[1]
+                if old[0] != path:
+                    evicted.append(old[0])
+            self._disk[key] = (path, file_size, tag)
+            self._disk_bytes += file_size
+            while self._disk_bytes > self.disk_max_bytes and len(self._disk) > 1:
+                _, (evicted_path, evicted_size, _) = self._disk.popitem(last=False)
+                self._disk_bytes -= evicted_size
+                evicted.append(evicted_path)
+        for evicted_path in evicted:
+            self._remove_file(evicted_path)
+
+    def _discard_disk(self, key: Hashable) -> int:
+        with self._lock:
+            entry = self._disk.pop(key, None)
+            if entry is None:
+                return 0
+            self._disk_bytes -= entry[1]
+        self._remove_file(entry[0])
+        return 1
+
+    @staticmethod
+    def _remove_file(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Create a global extraction result cache instance
+extract_cache = ByteLRUCache(
+    config['EXTRACT_CACHE_MAX_BYTES'],
+    disk_dir=config['EXTRACT_CACHE_DIR'],
+    disk_max_bytes=config['EXTRACT_CACHE_DISK_MAX_BYTES'],
+    name="extraction cache"
+)
+
+# Create a global comparison cache instance (reduced spectrograms for the spectrum plot)
+comparison_cache = ByteLRUCache(
+    config['COMPARE_CACHE_MAX_BYTES'],
+    name="comparison cache",
+    ttl=config['COMPARE_CACHE_TTL']
+)
+
+# Create a global fingerprint cache instance (decoded documents keyed by unique ID)
+fingerprint_cache = ByteLRUCache(
+    config['FINGERPRINT_CACHE_MAX_BYTES'],
+    name="fingerprint cache",
+    ttl=config['FINGERPRINT_CACHE_TTL']
+)
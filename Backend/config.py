@@ -25,17 +25,59 @@ class Config:
         "ALLOWED_AUDIO_EXTENSIONS": {"wav"},
         "UPLOAD_FOLDER": "uploads",
         "OUTPUT_FOLDER": "output",
+        "OUTPUT_STORE_MAX_BYTES": 1024 * 1024 * 1024,  # 1GB, oldest outputs are evicted beyond this
+        "OUTPUT_STORE_MAX_AGE": 24 * 60 * 60,  # seconds
+        "OUTPUT_STORE_ASYNC_WRITES": 1,  # write outputs on a background thread
         
         # Database settings
         "MONGODB_URI": "mongodb://localhost:27017/",
         "DB_NAME": "steganography_db",
         "COLLECTION_NAME": "audio_fingerprints",
+        "FINGERPRINT_STORAGE_DTYPE": "float16",  # "float16", "int8" (quantized) or "float32"
+        "IDENTIFY_TOP_K": 5,  # matches returned by /identify by default
+        "IDENTIFY_MAX_TOP_K": 100,
+        "ANN_INDEX_PATH": None,  # IVF index file for /identify (None: exact in-memory search)
+        "ANN_N_LISTS": 0,  # lists built by "python ann_index.py build" (0: sqrt of the fingerprint count)
+        "ANN_NPROBE": 8,  # lists scanned per query
+        "ANN_SAVE_EVERY": 1000,  # save the index after this many adds/removes
         
         # Audio settings
         "MIN_FRAME_RATE": 8000,
         "MAX_FRAME_RATE": 48000,
         "MAX_AUDIO_DURATION": 300,  # seconds
         
+        # Payload settings
+        "PAYLOAD_COMPRESSION": None,  # None, "zlib" or "lzma"
+        "PAYLOAD_COMPRESSION_LEVEL": 6,
+        "PAYLOAD_DENSITY": 3,  # bits per pixel: 1, 3 (legacy layout), 6 or 9
+        "PAYLOAD_MODE": "scaled",  # "scaled" (normalized 16-bit mono) or "pcm" (native WAV frames, bit-exact)
+        "PAYLOAD_LEGACY_LAYOUT": 0,  # 1: write uncompressed default-density payloads in the pre-header layout
+        "PNG_COMPRESS_LEVEL": 6,  # zlib level for the stego PNG (0: fastest, 9: smallest)
+        
+        # Worker pool settings
+        "WORKER_PROCESSES": None,  # None: one per CPU, 0: run CPU-bound stages on the request thread
+        "WORKER_TIMEOUT": 120,  # seconds to wait for a worker result
+        "WORKER_START_METHOD": "spawn",
+        
+        # Extraction cache settings
+        "EXTRACT_CACHE_MAX_BYTES": 256 * 1024 * 1024,  # in-memory results, keyed by image digest
+        "EXTRACT_CACHE_DIR": None,  # directory for the on-disk tier (None: memory only)
+        "EXTRACT_CACHE_DISK_MAX_BYTES": 1024 * 1024 * 1024,
+        
+        # Fingerprint cache settings (decoded fingerprints in front of MongoDB)
+        "FINGERPRINT_CACHE_MAX_BYTES": 64 * 1024 * 1024,
+        "FINGERPRINT_CACHE_TTL": 300,  # seconds
+        
+        # Comparison cache settings (spectrograms for GET /compare/<id>/spectrum.png)
+        "COMPARE_CACHE_MAX_BYTES": 64 * 1024 * 1024,
+        "COMPARE_CACHE_TTL": 3600,  # seconds
+        
+        # Job queue settings
+        "JOB_WORKERS": 2,  # embed/extract jobs processed concurrently
+        "JOB_QUEUE_SIZE": 64,  # jobs waiting to run before /jobs/* returns 503
+        "JOB_RESULT_TTL": 3600,  # seconds a finished job stays available
+        "JOB_MAX_ENTRIES": 1000,
+        
         # Logging settings
         "LOG_LEVEL": "INFO",
         "LOG_DIR": "logs",
@@ -104,7 +146,18 @@ class Config:
                 # Convert string values to appropriate types
                 if key in {"DEBUG", "MAX_FILE_SIZE", "MIN_FRAME_RATE", 
                           "MAX_FRAME_RATE", "MAX_AUDIO_DURATION", "PORT",
-                          "LOG_MAX_BYTES", "LOG_BACKUP_COUNT"}:
+                          "LOG_MAX_BYTES", "LOG_BACKUP_COUNT",
+                          "PAYLOAD_COMPRESSION_LEVEL", "PAYLOAD_DENSITY",
+                          "PAYLOAD_LEGACY_LAYOUT", "PNG_COMPRESS_LEVEL", "OUTPUT_STORE_MAX_BYTES",
+                          "OUTPUT_STORE_MAX_AGE", "OUTPUT_STORE_ASYNC_WRITES",
+                          "WORKER_PROCESSES", "WORKER_TIMEOUT",
+                          "JOB_WORKERS", "JOB_QUEUE_SIZE", "JOB_RESULT_TTL",
+                          "JOB_MAX_ENTRIES", "EXTRACT_CACHE_MAX_BYTES",
+                          "EXTRACT_CACHE_DISK_MAX_BYTES", "FINGERPRINT_CACHE_MAX_BYTES",
+                          "FINGERPRINT_CACHE_TTL", "COMPARE_CACHE_MAX_BYTES",
+                          "COMPARE_CACHE_TTL",
+                          "IDENTIFY_TOP_K", "IDENTIFY_MAX_TOP_K", "ANN_N_LISTS",
+                          "ANN_NPROBE", "ANN_SAVE_EVERY"}:
                     value = int(value)
                 elif key in {"ALLOWED_IMAGE_EXTENSIONS", "ALLOWED_AUDIO_EXTENSIONS"}:
                     value = set(value.split(","))
@@ -1,20 +1,35 @@
 from pymongo import MongoClient
-from typing import Dict, Any, Optional
+from pymongo.errors import DuplicateKeyError
+from bson.binary import Binary
+from typing import Dict, Any, Optional, Callable, Iterator, List, Tuple
 from logger import logger
 from config import config
+from fingerprint_index import fingerprint_embedding
+from cache import fingerprint_cache
 from datetime import datetime
 import numpy as np
 
+# Storage encodings for fingerprint arrays (config FINGERPRINT_STORAGE_DTYPE)
+FINGERPRINT_DTYPES = ("float16", "int8", "float32")
+# Attempts to reserve a unique ID before giving up (each loses a race to a concurrent embed)
+RESERVE_ATTEMPTS = 10
+
 class DatabaseManager:
     """
     Manages database operations for storing and retrieving audio fingerprints.
+
+    Other components (caches, indexes) can register listeners for the
+    "store" and "delete" events to keep derived data in sync.
     """
     
+    EVENTS = ("store", "delete")
+
     def __init__(self):
         """Initialize the database connection."""
         self.client = None
         self.db = None
         self.collection = None
+        self._listeners: Dict[str, List[Callable]] = {event: [] for event in self.EVENTS}
         self.connect()
 
     def connect(self) -> None:
@@ -26,6 +41,11 @@ class DatabaseManager:
             self.db = self.client[config['DB_NAME']]
             self.collection = self.db[config['COLLECTION_NAME']]
             logger.info(f"Connected to MongoDB database: {config['DB_NAME']}")
+            # reserve_unique_id relies on the index to reject concurrent reservations of the same ID
+            try:
+                self.collection.create_index("unique_id", unique=True)
+            except Exception as e:
+                logger.error(f"Failed to create the unique_id index: {str(e)}")
         except Exception as e:
             logger.error(f"Failed to connect to MongoDB: {str(e)}")
             # Don't raise the exception, just log it
@@ -38,6 +58,27 @@ class DatabaseManager:
         """Check if database is connected."""
         return self.client is not None and self.db is not None and self.collection is not None
 
+    def add_listener(self, event: str, callback: Callable) -> None:
+        """
+        Register a callback for a fingerprint event.
+        
+        Args:
+            event: "store" (called with unique_id, fingerprint, original_filename)
+                or "delete" (called with unique_id)
+            callback: Function called after the database operation succeeded
+        """
+        if event not in self._listeners:
+            raise ValueError(f"Unknown event: {event}. Must be one of {self.EVENTS}")
+        self._listeners[event].append(callback)
+
+    def _notify(self, event: str, *args) -> None:
+        """Call the listeners of an event, logging (not raising) their errors."""
+        for callback in self._listeners[event]:
+            try:
+                callback(*args)
+            except Exception as e:
+                logger.error(f"Error in {event} listener {getattr(callback, '__name__', callback)}: {str(e)}")
+
     def _convert_to_serializable(self, data: Any) -> Any:
         """
         Convert data to a MongoDB-serializable format.
@@ -56,9 +97,104 @@ class DatabaseManager:
             return [self._convert_to_serializable(item) for item in data]
         return data
 
+    def _encode_fingerprint(self, fingerprint: np.ndarray) -> Dict[str, Any]:
+        """
+        Encode a fingerprint array as compact BSON binary.
+        
+        float16 keeps the normalized MFCC values to ~3 significant digits;
+        int8 quantizes them linearly with a per-fingerprint scale.
+        
+        Args:
+            fingerprint: Fingerprint array
+            
+        Returns:
+            Dict with the raw bytes ("data") and the dtype, shape and scale needed to decode them
+        """
+        dtype = config['FINGERPRINT_STORAGE_DTYPE']
+        if dtype not in FINGERPRINT_DTYPES:
+            raise ValueError(f"Unsupported fingerprint storage dtype: {dtype}. Must be one of {FINGERPRINT_DTYPES}")
+        array = np.asarray(fingerprint, dtype=np.float32)
+        scale = 1.0
+        if dtype == "int8":
+            peak = float(np.max(np.abs(array))) if array.size else 0.0
+            scale = peak / 127 if peak > 0 else 1.0
+            encoded = np.clip(np.rint(array / scale), -127, 127).astype(np.int8)
+        else:
+            encoded = array.astype(dtype)
+        return {
+            "data": Binary(encoded.astype(encoded.dtype.newbyteorder('<')).tobytes()),
+            "dtype": dtype,
+            "shape": list(array.shape),
+            "scale": scale,
+        }
+
+    @staticmethod
+    def _decode_fingerprint(stored: Any) -> Any:
+        """
+        Rebuild a fingerprint array from its stored form.
+        
+        Args:
+            stored: Encoded dict from _encode_fingerprint, or a legacy list of floats
+            
+        Returns:
+            np.ndarray (float32 for encoded fingerprints), or stored unchanged if it is neither
+        """
+        if isinstance(stored, list):
+            return np.array(stored)
+        if isinstance(stored, dict) and "data" in stored:
+            dtype = np.dtype(stored["dtype"]).newbyteorder('<')
+            array = np.frombuffer(stored["data"], dtype=dtype).astype(np.float32)
+            if stored["dtype"] == "int8":
+                array *= np.float32(stored.get("scale", 1.0))
+            return array.reshape(stored["shape"])
+        return stored
+
+    def reserve_unique_id(self, original_filename: Optional[str] = None) -> Optional[int]:
+        """
+        Reserve the next unique ID by inserting a placeholder document for it.
+        
+        The unique index on unique_id makes the insert fail for an ID that a
+        concurrent embed reserved first; the next ID is tried then. The
+        placeholder is filled in by store_fingerprint, or removed with
+        delete_fingerprint if the embed fails.
+        
+        Args:
+            original_filename: Original filename of the audio
+            
+        Returns:
+            int: The reserved ID, or None if no ID could be reserved
+        """
+        if not self.is_connected():
+            logger.error("Database connection not available")
+            return None
+
+        try:
+            for _ in range(RESERVE_ATTEMPTS):
+                # Find the document with the highest ID (IDs start from 1)
+                last_doc = self.collection.find_one({}, {"unique_id": 1}, sort=[("unique_id", -1)])
+                unique_id = last_doc["unique_id"] + 1 if last_doc else 1
+                try:
+                    self.collection.insert_one({
+                        "unique_id": unique_id,
+                        "original_filename": original_filename,
+                        "timestamp": datetime.now(),
+                        "reserved": True
+                    })
+                except DuplicateKeyError:
+                    logger.debug(f"unique_id {unique_id} was reserved concurrently, retrying")
+                    continue
+                logger.info(f"Reserved unique_id: {unique_id}")
+                return unique_id
+            logger.error(f"Failed to reserve a unique_id after {RESERVE_ATTEMPTS} attempts")
+            return None
+        except Exception as e:
+            logger.error(f"Error reserving unique_id: {str(e)}")
+            return None
+
     def store_fingerprint(self, unique_id: int, fingerprint: Dict[str, Any], original_filename: str) -> bool:
         """
-        Store a fingerprint in the database.
+        Store a fingerprint in the database, filling in the placeholder of a
+        reserved ID (see reserve_unique_id) if there is one.
         
         Args:
             unique_id: Unique identifier for the fingerprint
@@ -74,12 +210,16 @@ class DatabaseManager:
 
         try:
             # Check if fingerprint already exists
-            if self.collection.find_one({"unique_id": unique_id}) is not None:
+            existing = self.collection.find_one({"unique_id": unique_id}, {"reserved": 1})
+            if existing is not None and not existing.get("reserved"):
                 logger.warning(f"Fingerprint with unique_id {unique_id} already exists")
                 return False
             
-            # Convert fingerprint to serializable format
-            serializable_fingerprint = self._convert_to_serializable(fingerprint)
+            # Convert fingerprint to serializable format (arrays as compact binary)
+            if isinstance(fingerprint, np.ndarray):
+                serializable_fingerprint = self._encode_fingerprint(fingerprint)
+            else:
+                serializable_fingerprint = self._convert_to_serializable(fingerprint)
             
             # Store the fingerprint
             document = {
@@ -88,10 +228,24 @@ class DatabaseManager:
                 "original_filename": original_filename,
                 "timestamp": datetime.now()
             }
-            result = self.collection.insert_one(document)
+            # Fixed-length summary used for identification, so the index can
+            # be loaded without reading the full fingerprints
+            try:
+                document["embedding"] = Binary(fingerprint_embedding(fingerprint).astype('<f4').tobytes())
+            except ValueError as e:
+                logger.warning(f"Not storing an embedding for unique_id {unique_id}: {str(e)}")
+            if existing is not None:
+                result = self.collection.update_one({"unique_id": unique_id, "reserved": True},
+                                                    {"$set": document, "$unset": {"reserved": ""}})
+                stored = result.matched_count > 0
+            else:
+                stored = self.collection.insert_one(document).inserted_id is not None
             
-            if result.inserted_id is not None:
+            if stored:
                 logger.info(f"Fingerprint stored successfully with unique_id: {unique_id}")
+                # Cache what get_fingerprint would read back
+                self._cache_document(dict(document, fingerprint=self._decode_fingerprint(serializable_fingerprint)))
+                self._notify("store", unique_id, fingerprint, original_filename)
                 return True
             else:
                 logger.error("Failed to store fingerprint")
@@ -101,9 +255,21 @@ class DatabaseManager:
             logger.error(f"Error storing fingerprint: {str(e)}")
             return False
 
+    def _cache_document(self, document: Dict[str, Any]) -> None:
+        """Put a decoded fingerprint document into the fingerprint cache."""
+        fingerprint = document.get('fingerprint')
+        if isinstance(fingerprint, np.ndarray):
+            # Shared by every cache hit
+            fingerprint.flags.writeable = False
+        size = getattr(fingerprint, 'nbytes', 0) + 512
+        fingerprint_cache.put(document["unique_id"], dict(document), size)
+
     def get_fingerprint(self, unique_id: int) -> Optional[Dict[str, Any]]:
         """
-        Retrieve a fingerprint from the database.
+        Retrieve a fingerprint, from the fingerprint cache or the database.
+        
+        Documents read from the database are cached (decoded) for
+        FINGERPRINT_CACHE_TTL seconds, so repeated lookups skip MongoDB.
         
         Args:
             unique_id: Unique identifier of the fingerprint to retrieve
@@ -111,16 +277,23 @@ class DatabaseManager:
         Returns:
             Dict containing fingerprint data or None if not found
         """
+        cached = fingerprint_cache.get(unique_id)
+        if cached is not None:
+            logger.debug(f"Fingerprint cache hit for unique_id: {unique_id}")
+            # Shallow copy so callers cannot change the cached document
+            return dict(cached)
+
         if not self.is_connected():
             logger.error("Database connection not available")
             return None
 
         try:
-            result = self.collection.find_one({"unique_id": unique_id})
+            result = self.collection.find_one({"unique_id": unique_id, "reserved": {"$ne": True}})
             if result is not None:
-                # Convert list back to numpy array if needed
-                if isinstance(result.get('fingerprint'), list):
-                    result['fingerprint'] = np.array(result['fingerprint'])
+                # Convert the stored binary (or legacy list) back to a numpy array
+                if 'fingerprint' in result:
+                    result['fingerprint'] = self._decode_fingerprint(result['fingerprint'])
+                self._cache_document(result)
                 logger.info(f"Fingerprint retrieved successfully for unique_id: {unique_id}")
                 return result
             else:
@@ -130,6 +303,58 @@ class DatabaseManager:
             logger.error(f"Error retrieving fingerprint: {str(e)}")
             return None
 
+    def iter_embeddings(self) -> Iterator[Tuple[int, np.ndarray, Optional[str]]]:
+        """
+        Yield (unique_id, embedding, original_filename) for every stored fingerprint.
+        
+        Only the stored embeddings are read. Documents written before
+        embeddings were stored have theirs computed from the fingerprint.
+        """
+        if not self.is_connected():
+            logger.error("Database connection not available")
+            return
+
+        # Placeholders of reserved IDs have no fingerprint yet
+        cursor = self.collection.find({"reserved": {"$ne": True}},
+                                      {"unique_id": 1, "embedding": 1, "original_filename": 1, "_id": 0})
+        for document in cursor:
+            unique_id = document.get("unique_id")
+            if unique_id is None:
+                continue
+            if document.get("embedding") is not None:
+                embedding = np.frombuffer(document["embedding"], dtype='<f4').astype(np.float32)
+            else:
+                stored = self.collection.find_one({"unique_id": unique_id}, {"fingerprint": 1})
+                if stored is None or stored.get("fingerprint") is None:
+                    continue
+                try:
+                    embedding = fingerprint_embedding(self._decode_fingerprint(stored["fingerprint"]))
+                except ValueError as e:
+                    logger.warning(f"Skipping fingerprint {unique_id}: {str(e)}")
+                    continue
+            yield unique_id, embedding, document.get("original_filename")
+
+    def get_original_filenames(self, unique_ids: List[int]) -> Dict[int, Optional[str]]:
+        """
+        Look up the original filenames of several fingerprints with one query.
+        
+        Args:
+            unique_ids: Unique identifiers to look up
+            
+        Returns:
+            Dict mapping each found unique_id to its original filename
+        """
+        if not self.is_connected() or not unique_ids:
+            return {}
+
+        try:
+            cursor = self.collection.find({"unique_id": {"$in": list(unique_ids)}},
+                                          {"unique_id": 1, "original_filename": 1, "_id": 0})
+            return {document["unique_id"]: document.get("original_filename") for document in cursor}
+        except Exception as e:
+            logger.error(f"Error retrieving original filenames: {str(e)}")
+            return {}
+
     def delete_fingerprint(self, unique_id: int) -> bool:
         """
         Delete a fingerprint from the database.
@@ -140,6 +365,9 @@ class DatabaseManager:
         Returns:
             bool: True if successful, False otherwise
         """
+        # Drop the cached copy even if the delete fails half way
+        fingerprint_cache.invalidate(unique_id)
+
         if not self.is_connected():
             logger.error("Database connection not available")
             return False
@@ -148,6 +376,7 @@ class DatabaseManager:
             result = self.collection.delete_one({"unique_id": unique_id})
             if result.deleted_count > 0:
                 logger.info(f"Fingerprint deleted successfully for unique_id: {unique_id}")
+                self._notify("delete", unique_id)
                 return True
             else:
                 logger.warning(f"No fingerprint found to delete for unique_id: {unique_id}")
@@ -155,6 +384,10 @@ class DatabaseManager:
         except Exception as e:
             logger.error(f"Error deleting fingerprint: {str(e)}")
             return False
+        finally:
+            # A concurrent get_fingerprint may have re-cached the document
+            # between the first invalidation and the delete
+            fingerprint_cache.invalidate(unique_id)
 
     def close(self) -> None:
         """Close the database connection."""
@@ -0,0 +1,106 @@
+import time
+import numpy as np
+import librosa
+from scipy.signal import find_peaks
+from typing import Any, Dict
+
+# STFT parameters (librosa's defaults, which every feature used when it ran its own STFT)
+N_FFT = 2048
+HOP_LENGTH = 512
+N_MFCC = 20
+
+
+def extract_voice_features(y: np.ndarray, sr: int, n_fft: int = N_FFT, hop_length: int = HOP_LENGTH,
+                           n_mfcc: int = N_MFCC) -> Dict[str, Any]:
+    """
+    Compute the speaker features compared by /compare_audio from one STFT.
+
+    The magnitude spectrogram is computed once and every spectral feature is
+    derived from it (the MFCCs from a mel spectrogram of its power). The
+    values are the same as calling each librosa feature on y separately,
+    which would run the STFT once per feature.
+
+    Args:
+        y: Mono float samples
+        sr: Sample rate
+        n_fft: FFT window size
+        hop_length: Samples between frames
+        n_mfcc: Number of MFCC coefficients
+
+    Returns:
+        Dict of pitch, amplitude, spectral, dominant frequency and MFCC
+        features, plus the magnitude spectrogram under "spectrum"
+    """
+    spectrum = np.abs(librosa.stft(y, n_fft=n_fft, hop_length=hop_length))
+
+    # Pitch features
+    pitches, magnitudes = librosa.piptrack(S=spectrum, sr=sr, n_fft=n_fft, hop_length=hop_length)
+    voiced_pitches = pitches[magnitudes > np.median(magnitudes)]
+
+    # Frequency features
+    freqs = librosa.fft_frequencies(sr=sr, n_fft=n_fft)
+    mean_spectrum = np.mean(spectrum, axis=1)
+    peak_freqs, _ = find_peaks(mean_spectrum, height=np.mean(mean_spectrum))
+
+    # MFCCs from the power spectrogram
+    mel = librosa.feature.melspectrogram(S=spectrum ** 2, sr=sr, n_fft=n_fft, hop_length=hop_length)
+    mfcc = librosa.feature.mfcc(S=librosa.power_to_db(mel), n_mfcc=n_mfcc)
+
+    abs_y = np.abs(y)
+    return {
+        "sr": sr,
+        "pitch_mean": np.mean(voiced_pitches),
+        "pitch_std": np.std(voiced_pitches),
+        "pitch_range": np.ptp(voiced_pitches),
+        # Amplitude features
+        "amp_mean": np.mean(abs_y),
+        "amp_std": np.std(abs_y),
+        "amp_range": np.ptp(abs_y),
+        # Spectral features
+        "spectral_centroid": librosa.feature.spectral_centroid(S=spectrum, sr=sr, n_fft=n_fft, hop_length=hop_length)[0],
+        "spectral_rolloff": librosa.feature.spectral_rolloff(S=spectrum, sr=sr, n_fft=n_fft, hop_length=hop_length)[0],
+        "spectral_bandwidth": librosa.feature.spectral_bandwidth(S=spectrum, sr=sr, n_fft=n_fft, hop_length=hop_length)[0],
+        "spectral_flatness": librosa.feature.spectral_flatness(S=spectrum, n_fft=n_fft, hop_length=hop_length)[0],
+        "dominant_freq": freqs[peak_freqs[np.argmax(mean_spectrum[peak_freqs])]],
+        "spectrum": spectrum,
+        # MFCCs
+        "mfcc": mfcc,
+    }
+
+
+def _separate_stft_features(y: np.ndarray, sr: int) -> Dict[str, Any]:
+    """Features computed the previous way, one STFT per feature (benchmark baseline)."""
+    pitches, magnitudes = librosa.piptrack(y=y, sr=sr)
+    voiced_pitches = pitches[magnitudes > np.median(magnitudes)]
+    spectrum = np.abs(librosa.stft(y))
+    return {
+        "pitch_mean": np.mean(voiced_pitches),
+        "spectral_centroid": librosa.feature.spectral_centroid(y=y, sr=sr)[0],
+        "spectral_rolloff": librosa.feature.spectral_rolloff(y=y, sr=sr)[0],
+        "spectral_bandwidth": librosa.feature.spectral_bandwidth(y=y, sr=sr)[0],
+        "spectral_flatness": librosa.feature.spectral_flatness(y=y)[0],
+        "spectrum": spectrum,
+        "mfcc": librosa.feature.mfcc(y=y, sr=sr, n_mfcc=N_MFCC),
+    }
+
+
+if __name__ == "__main__":
+    # Benchmark against one STFT per feature on a synthetic voiced clip
+    sample_rate, seconds = 22050, 30
+    t = np.arange(sample_rate * seconds) / sample_rate
+    rng = np.random.default_rng(0)
+    clip = (0.5 * np.sin(2 * np.pi * 180 * t) + 0.2 * np.sin(2 * np.pi * 360 * t)
+            + 0.05 * rng.normal(size=t.size)).astype(np.float32)
+
+    started = time.perf_counter()
+    separate = _separate_stft_features(clip, sample_rate)
+    separate_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    shared = extract_voice_features(clip, sample_rate)
+    shared_seconds = time.perf_counter() - started
+
+    for name in ("spectral_centroid", "spectral_rolloff", "spectral_bandwidth", "spectral_flatness",
+                 "spectrum", "mfcc"):
+        assert np.allclose(separate[name], shared[name], rtol=1e-4, atol=1e-5), name
+    print(f"one STFT per feature: {separate_seconds * 1000:.0f} ms")
+    print(f"shared STFT:          {shared_seconds * 1000:.0f} ms ({separate_seconds / shared_seconds:.1f}x)")
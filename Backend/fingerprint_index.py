@@ -0,0 +1,207 @@
+import threading
+import numpy as np
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+from logger import logger
+
+# MFCC coefficients per frame in fingetprint.generate_fingerprint
+N_MFCC = 20
+# Per-coefficient mean and standard deviation
+EMBEDDING_DIM = 2 * N_MFCC
+
+
+def fingerprint_embedding(fingerprint: Any, n_mfcc: int = N_MFCC) -> np.ndarray:
+    """
+    Fixed-length summary embedding of a variable-length MFCC fingerprint.
+
+    generate_fingerprint flattens an (n_mfcc, frames) matrix. The embedding
+    is the mean and standard deviation of each coefficient over all frames,
+    L2-normalized, so clips of any length are compared with a dot product.
+
+    Args:
+        fingerprint: Flattened MFCC fingerprint
+        n_mfcc: Number of MFCC coefficients per frame
+
+    Returns:
+        np.ndarray: float32 vector of length 2 * n_mfcc with unit norm
+
+    Raises:
+        ValueError: If the fingerprint holds less than one frame
+    """
+    values = np.asarray(fingerprint, dtype=np.float32).ravel()
+    frames = values.size // n_mfcc
+    if not frames:
+        raise ValueError("Fingerprint is too short to embed")
+    mfcc = values[:frames * n_mfcc].reshape(n_mfcc, frames)
+    embedding = np.concatenate([mfcc.mean(axis=1), mfcc.std(axis=1)]).astype(np.float32)
+    norm = np.linalg.norm(embedding)
+    return embedding / norm if norm > 0 else embedding
+
+
+class FingerprintIndex:
+    """
+    In-memory float32 matrix of the embeddings of all stored fingerprints.
+
+    A query is scored against every row with one matrix-vector product
+    (cosine similarity, as the rows and the query have unit norm), so
+    identifying a clip never touches the database. The matrix is loaded once
+    from the database and kept in sync through the DatabaseManager "store"
+    and "delete" events.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, initial_capacity: int = 1024):
+        """
+        Initialize an empty index.
+
+        Args:
+            dim: Embedding dimension
+            initial_capacity: Rows allocated up front (the matrix doubles when full)
+        """
+        self.dim = dim
+        self._matrix = np.zeros((initial_capacity, dim), dtype=np.float32)
+        self._ids = np.zeros(initial_capacity, dtype=np.int64)
+        self._rows: Dict[int, int] = {}
+        self._names: Dict[int, Optional[str]] = {}
+        self._size = 0
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self._loading = False
+        self._removed_while_loading: Set[int] = set()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, unique_id: int) -> bool:
+        return unique_id in self._rows
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the index has been loaded from the database."""
+        return self._loaded
+
+    def add(self, unique_id: int, embedding: np.ndarray, original_filename: Optional[str] = None) -> None:
+        """
+        Insert or replace the embedding of a fingerprint.
+
+        Args:
+            unique_id: Unique ID of the fingerprint
+            embedding: Unit-norm embedding (see fingerprint_embedding)
+            original_filename: Filename reported with matches
+        """
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        if embedding.size != self.dim:
+            raise ValueError(f"Embedding has {embedding.size} values, expected {self.dim}")
+        with self._lock:
+            row = self._rows.get(unique_id)
+            if row is None:
+                if self._size == len(self._ids):
+                    self._grow()
+                row = self._size
+                self._size += 1
+                self._rows[unique_id] = row
+                self._ids[row] = unique_id
+            self._matrix[row] = embedding
+            self._names[unique_id] = original_filename
+
+    def add_fingerprint(self, unique_id: int, fingerprint: Any, original_filename: Optional[str] = None) -> None:
+        """Embed a fingerprint and add it (signature of the "store" database event)."""
+        self.add(unique_id, fingerprint_embedding(fingerprint), original_filename)
+
+    def remove(self, unique_id: int) -> bool:
+        """
+        Remove a fingerprint (signature of the "delete" database event).
+
+        Returns:
+            bool: True if it was indexed
+        """
+        with self._lock:
+            if self._loading:
+                self._removed_while_loading.add(unique_id)
+            row = self._rows.pop(unique_id, None)
+            if row is None:
+                return False
+            self._names.pop(unique_id, None)
+            # Move the last row into the hole
+            last = self._size - 1
+            if row != last:
+                moved_id = int(self._ids[last])
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = moved_id
+                self._rows[moved_id] = row
+            self._size = last
+            return True
+
+    def load(self, items: Iterable[Tuple[int, np.ndarray, Optional[str]]]) -> int:
+        """
+        Add (unique_id, embedding, original_filename) items, e.g. from
+        DatabaseManager.iter_embeddings(). Fingerprints deleted while loading
+        are skipped.
+
+        Returns:
+            int: Number of fingerprints indexed afterwards
+        """
+        with self._lock:
+            self._loading = True
+            self._removed_while_loading.clear()
+        try:
+            for unique_id, embedding, original_filename in items:
+                with self._lock:
+                    if unique_id not in self._removed_while_loading:
+                        self.add(unique_id, embedding, original_filename)
+        finally:
+            with self._lock:
+                self._loading = False
+                self._removed_while_loading.clear()
+        self._loaded = True
+        logger.info(f"Loaded {self._size} fingerprints into the identification index")
+        return self._size
+
+    def ensure_loaded(self, loader: Callable[[], Iterable[Tuple[int, np.ndarray, Optional[str]]]]) -> None:
+        """Load the index from loader() unless it was loaded already."""
+        if self._loaded:
+            return
+        # Concurrent callers wait for the first load instead of starting their own
+        with self._load_lock:
+            if not self._loaded:
+                self.load(loader())
+
+    def search(self, embedding: np.ndarray, k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Find the stored fingerprints most similar to an embedding.
+
+        Args:
+            embedding: Query embedding (see fingerprint_embedding)
+            k: Number of matches to return
+
+        Returns:
+            List of {"unique_id", "similarity", "original_filename"} dicts, best
+            first. similarity is the cosine similarity as a percentage, like
+            match_audio.
+        """
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+        with self._lock:
+            n = self._size
+            k = min(k, n)
+            if k <= 0:
+                return []
+            scores = self._matrix[:n] @ query
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [{
+                "unique_id": int(self._ids[row]),
+                "similarity": round(float(scores[row]) * 100, 2),
+                "original_filename": self._names.get(int(self._ids[row])),
+            } for row in top]
+
+    def _grow(self) -> None:
+        """Double the allocated rows. Caller holds the lock."""
+        capacity = max(1, len(self._ids)) * 2
+        matrix = np.zeros((capacity, self.dim), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        ids = np.zeros(capacity, dtype=np.int64)
+        ids[:self._size] = self._ids[:self._size]
+        self._matrix, self._ids = matrix, ids
+
+
+# Create a global fingerprint index instance
+fingerprint_index = FingerprintIndex()
@@ -3,9 +3,18 @@ from scipy.spatial.distance import cosine
 import numpy as np
 
 def generate_fingerprint(audio_file):
-    # Load audio and extract MFCC features
-    y, sr = librosa.load(audio_file, sr=None)
-    mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=20)
+    # audio_file is a path, a file object, or an already decoded (samples, sample_rate) pair
+    if isinstance(audio_file, tuple):
+        y, sr = audio_file
+    else:
+        # Load audio and extract MFCC features
+        y, sr = librosa.load(audio_file, sr=None)
+    return fingerprint_from_samples(y, sr)
+
+
+def fingerprint_from_samples(y, sr):
+    # Float samples in [-1, 1] as returned by librosa.load (int16 PCM / 32768)
+    mfcc = librosa.feature.mfcc(y=np.asarray(y, dtype=np.float32), sr=sr, n_mfcc=20)
 
     # Normalize the MFCCs to avoid large value differences
     mfcc = librosa.util.normalize(mfcc, axis=1)
@@ -0,0 +1,167 @@
+import time
+import uuid
+import queue
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from logger import logger
+from config import config
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+
+class Job:
+    """A queued embed/extract request and its outcome."""
+
+    def __init__(self, kind: str, fn: Callable[..., Tuple[Dict[str, Any], int]], args: tuple, kwargs: dict):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = JOB_QUEUED
+        self.result: Optional[Dict[str, Any]] = None
+        self.http_status: Optional[int] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in (JOB_SUCCEEDED, JOB_FAILED)
+
+    def timings(self) -> Dict[str, Optional[float]]:
+        """Seconds spent waiting in the queue and running."""
+        now = time.time()
+        queued = (self.started_at or now) - self.created_at
+        running = None
+        if self.started_at is not None:
+            running = (self.finished_at or now) - self.started_at
+        return {
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queued_seconds": round(queued, 3),
+            "run_seconds": None if running is None else round(running, 3),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the job for GET /jobs/<id>."""
+        job = {
+            "job_id": self.id,
+            "type": self.kind,
+            "status": self.status,
+            "timings": self.timings(),
+        }
+        if self.done:
+            job["http_status"] = self.http_status
+            job["result"] = self.result
+        return job
+
+
+class JobManager:
+    """
+    In-process job queue for long running requests.
+
+    Jobs are held in memory and executed by a bounded number of daemon
+    threads. The threads only orchestrate a request; the CPU-bound stages
+    still run in the worker pool, so JOB_WORKERS bounds how many requests
+    are in flight at once. Finished jobs are kept for JOB_RESULT_TTL seconds
+    (and at most JOB_MAX_ENTRIES jobs are remembered) so clients can poll
+    for their results.
+    """
+
+    def __init__(self, workers: Optional[int] = None, queue_size: Optional[int] = None,
+                 result_ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        """
+        Initialize the job manager (threads are started on the first submit).
+
+        Args:
+            workers: Number of job threads
+            queue_size: Maximum number of jobs waiting to run
+            result_ttl: Seconds a finished job is kept
+            max_entries: Maximum number of jobs remembered
+        """
+        self.workers = config['JOB_WORKERS'] if workers is None else workers
+        self.result_ttl = config['JOB_RESULT_TTL'] if result_ttl is None else result_ttl
+        self.max_entries = config['JOB_MAX_ENTRIES'] if max_entries is None else max_entries
+        self._queue = queue.Queue(maxsize=config['JOB_QUEUE_SIZE'] if queue_size is None else queue_size)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def start(self) -> None:
+        """Start the job threads if they are not running yet."""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        logger.info(f"Started {self.workers} job workers")
+
+    def submit(self, kind: str, fn: Callable[..., Tuple[Dict[str, Any], int]], *args, **kwargs) -> Job:
+        """
+        Queue a job. fn must return a (response body, HTTP status) tuple.
+
+        Returns:
+            Job: The queued job
+
+        Raises:
+            queue.Full: If the queue is at capacity
+        """
+        self.start()
+        job = Job(kind, fn, args, kwargs)
+        self._queue.put_nowait(job)
+        with self._lock:
+            self._purge()
+            self._jobs[job.id] = job
+        logger.info(f"Queued {kind} job {job.id}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """Look up a job by ID."""
+        with self._lock:
+            self._purge()
+            return self._jobs.get(job_id)
+
+    def _purge(self) -> None:
+        """Forget expired finished jobs and trim the oldest finished ones beyond max_entries."""
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.done and now - job.finished_at > self.result_ttl:
+                del self._jobs[job_id]
+        excess = len(self._jobs) - self.max_entries
+        for job_id, job in list(self._jobs.items()):
+            if excess <= 0:
+                break
+            if job.done:
+                del self._jobs[job_id]
+                excess -= 1
+
+    def _run(self) -> None:
+        while True:
+            job = self._queue.get()
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+            try:
+                result, http_status = job.fn(*job.args, **job.kwargs)
+            except Exception as e:
+                logger.error(f"Unexpected error in {job.kind} job {job.id}: {str(e)}")
+                result, http_status = {"error": "An unexpected error occurred"}, 500
+            # Drop the request payload so finished jobs only hold their result
+            job.args, job.kwargs = (), {}
+            job.result = result
+            job.http_status = http_status
+            job.finished_at = time.time()
+            job.status = JOB_SUCCEEDED if http_status < 400 else JOB_FAILED
+            logger.info(f"{job.kind} job {job.id} {job.status} in {job.finished_at - job.started_at:.2f}s")
+            self._queue.task_done()
+
+
+# Create a global job manager instance
+job_manager = JobManager()
@@ -0,0 +1,198 @@
+import os
+import re
+import time
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Union
+from logger import logger
+from config import config
+
+# Keys are the SHA-256 of the content plus the file extension
+KEY_PATTERN = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]{1,8}$')
+TEMP_PREFIX = '.tmp-'
+
+
+class OutputStore:
+    """
+    Content-addressed store for generated files (stego images, extracted audio).
+
+    Every file is named after the SHA-256 of its content, so concurrent
+    requests never overwrite each other and storing the same output twice is
+    a no-op. Files are written to a temporary file and renamed into place, so
+    readers never see a partial file. With async_writes the write happens on a
+    background thread and the bytes are served from memory until it lands.
+    The oldest files are evicted once the store exceeds max_bytes, and files
+    older than max_age seconds are removed.
+    """
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None,
+                 max_age: Optional[float] = None, async_writes: Optional[bool] = None):
+        """
+        Initialize the store.
+
+        Args:
+            root: Directory holding the files (relative paths are resolved against the working directory)
+            max_bytes: Total size above which the oldest files are evicted
+            max_age: Seconds after which files are evicted
+            async_writes: Write files on a background thread
+        """
+        # Absolute, so paths handed to send_file do not depend on the working directory
+        self.root = os.path.abspath(root or config['OUTPUT_FOLDER'])
+        self.max_bytes = config['OUTPUT_STORE_MAX_BYTES'] if max_bytes is None else max_bytes
+        self.max_age = config['OUTPUT_STORE_MAX_AGE'] if max_age is None else max_age
+        self.async_writes = bool(config['OUTPUT_STORE_ASYNC_WRITES'] if async_writes is None else async_writes)
+        self._pending: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='output-store') if self.async_writes else None
+        self._size = None
+        self._last_eviction = 0.0
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def make_key(data: bytes, extension: str) -> str:
+        """Content key for data stored with the given extension."""
+        return f"{hashlib.sha256(data).hexdigest()}.{extension.lstrip('.').lower()}"
+
+    def path(self, key: str) -> str:
+        """
+        Filesystem path of a key.
+
+        Raises:
+            ValueError: If the key is not a valid store key
+        """
+        if not KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid output key: {key}")
+        return os.path.join(self.root, key)
+
+    def put(self, data: bytes, extension: str) -> str:
+        """
+        Store data and return its key.
+
+        Args:
+            data: File content
+            extension: File extension (e.g. "png")
+
+        Returns:
+            str: Content key, usable with get()/path() and GET /outputs/<key>
+        """
+        key = self.make_key(data, extension)
+        path = self.path(key)
+        with self._lock:
+            if key in self._pending:
+                return key
+            if os.path.exists(path):
+                # Refresh the age of an existing file
+                os.utime(path)
+                return key
+            if self._executor is not None:
+                self._pending[key] = data
+        if self._executor is not None:
+            self._executor.submit(self._write, key, data)
+        else:
+            self._write(key, data)
+        return key
+
+    def get(self, key: str) -> Optional[Union[str, bytes]]:
+        """
+        Look up a key.
+
+        Returns:
+            The bytes if the file is still being written, its path if it is on
+            disk, or None if the key is unknown or was evicted
+        """
+        path = self.path(key)
+        with self._lock:
+            data = self._pending.get(key)
+        if data is not None:
+            return data
+        return path if os.path.exists(path) else None
+
+    def flush(self) -> None:
+        """Wait for pending background writes to finish."""
+        if self._executor is not None:
+            self._executor.submit(lambda: None).result()
+
+    def _write(self, key: str, data: bytes) -> None:
+        path = self.path(key)
+        try:
+            fd, temp_path = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self.root)
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+            logger.debug(f"Stored output {key} ({len(data)} bytes)")
+        except Exception as e:
+            logger.error(f"Error writing output {key}: {str(e)}")
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+                if self._size is not None:
+                    self._size += len(data)
+        self._maybe_evict()
+
+    def _maybe_evict(self) -> None:
+        """Run eviction when over the size limit, or once a minute for the age limit."""
+        now = time.time()
+        if self._size is None or self._size > self.max_bytes or now - self._last_eviction > 60:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Remove expired files, then the oldest files until the store fits max_bytes.
+
+        Returns:
+            int: Number of files removed
+        """
+        now = time.time()
+        entries = []
+        removed = 0
+        with os.scandir(self.root) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if entry.name.startswith(TEMP_PREFIX):
+                    # Leftover from an interrupted write
+                    if now - stat.st_mtime > 3600:
+                        self._remove(entry.path)
+                    continue
+                if not KEY_PATTERN.match(entry.name):
+                    continue
+                if now - stat.st_mtime > self.max_age:
+                    removed += self._remove(entry.path)
+                else:
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if self._remove(path):
+                    removed += 1
+                    total -= size
+
+        with self._lock:
+            self._size = total
+            self._last_eviction = now
+        if removed:
+            logger.info(f"Evicted {removed} files from output store")
+        return removed
+
+    @staticmethod
+    def _remove(path: str) -> int:
+        try:
+            os.remove(path)
+            return 1
+        except FileNotFoundError:
+            return 0
+
+
+# Create a global output store instance
+output_store = OutputStore()
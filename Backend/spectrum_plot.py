@@ -0,0 +1,97 @@
+from io import BytesIO
+from typing import List, Tuple
+import numpy as np
+from PIL import Image, ImageDraw
+
+# Anchor colours of the 'magma' colormap (librosa.display's default for dB data)
+MAGMA_ANCHORS = np.array([
+    (0, 0, 4), (28, 16, 68), (79, 18, 123), (129, 37, 129), (181, 54, 122),
+    (229, 80, 100), (251, 135, 97), (254, 194, 135), (252, 253, 191),
+], dtype=np.float32)
+# Colormap levels; the two remaining palette entries are the title band colours
+COLORMAP_LEVELS = 254
+WHITE_INDEX, BLACK_INDEX = 254, 255
+# Lookup table: level -> RGB
+MAGMA_LUT = np.stack([
+    np.interp(np.linspace(0, 1, COLORMAP_LEVELS), np.linspace(0, 1, len(MAGMA_ANCHORS)), MAGMA_ANCHORS[:, channel])
+    for channel in range(3)
+], axis=1).round().astype(np.uint8)
+# Palette of the rendered PNG and the map from 8-bit dB values to colormap levels
+PALETTE = np.concatenate([MAGMA_LUT, [(255, 255, 255), (0, 0, 0)]]).astype(np.uint8)
+DB_TO_LEVEL = (np.arange(256) * (COLORMAP_LEVELS - 1) // 255).astype(np.uint8)
+
+PANEL_HEIGHT = 256
+MAX_PANEL_WIDTH = 1024
+MIN_FREQUENCY = 32.0  # lowest frequency shown on the log axis
+TOP_DB = 80.0
+TITLE_HEIGHT = 16
+
+
+def spectrogram_to_db_image(spectrum: np.ndarray, sr: int, height: int = PANEL_HEIGHT,
+                            max_width: int = MAX_PANEL_WIDTH, top_db: float = TOP_DB) -> np.ndarray:
+    """
+    Reduce a magnitude spectrogram to an 8-bit dB image on a log frequency axis.
+
+    Equivalent to librosa.amplitude_to_db(spectrum, ref=np.max) shown with
+    y_axis='log': rows are picked from log-spaced frequencies (low
+    frequencies at the bottom) and columns are max-pooled down to max_width.
+    The result is small enough to cache and render on demand.
+
+    Args:
+        spectrum: (1 + n_fft // 2, frames) magnitude spectrogram
+        sr: Sample rate
+        height: Output rows
+        max_width: Maximum output columns
+        top_db: Dynamic range below the peak that is shown
+
+    Returns:
+        np.ndarray: (height, width) uint8, 0 = peak - top_db, 255 = peak
+    """
+    spectrum = np.asarray(spectrum, dtype=np.float32)
+    n_bins, frames = spectrum.shape
+    if frames > max_width:
+        # Max-pool columns so short transients stay visible
+        edges = np.linspace(0, frames, max_width + 1).astype(np.int64)
+        spectrum = np.maximum.reduceat(spectrum, edges[:-1], axis=1)
+
+    # Nearest FFT bin for log-spaced frequencies, highest first (top row)
+    nyquist = sr / 2
+    frequencies = np.geomspace(min(MIN_FREQUENCY, nyquist / 2), nyquist, height)[::-1]
+    rows = np.clip(np.rint(frequencies / nyquist * (n_bins - 1)).astype(np.int64), 0, n_bins - 1)
+    spectrum = spectrum[rows]
+
+    peak = float(spectrum.max()) if spectrum.size else 0.0
+    db = 20 * np.log10(np.maximum(spectrum, 1e-5) / max(peak, 1e-5))
+    db = np.clip(db, -top_db, 0)
+    return np.rint((db + top_db) * (255 / top_db)).astype(np.uint8)
+
+
+def render_spectrum_png(panels: List[Tuple[str, np.ndarray]], compress_level: int = 1) -> bytes:
+    """
+    Render dB images from spectrogram_to_db_image as one PNG, one titled panel per image.
+
+    The image is a palette PNG whose palette is the colormap: each pixel is
+    its dB level after a single table lookup, so this takes milliseconds
+    instead of a matplotlib figure round trip, and the PNG stays small.
+
+    Args:
+        panels: (title, uint8 dB image) pairs, drawn top to bottom
+        compress_level: zlib level of the PNG
+
+    Returns:
+        bytes: The PNG
+    """
+    width = max(image.shape[1] for _, image in panels)
+    height = sum(image.shape[0] + TITLE_HEIGHT for _, image in panels)
+    canvas = Image.new('P', (width, height), WHITE_INDEX)
+    canvas.putpalette(PALETTE.tobytes())
+    draw = ImageDraw.Draw(canvas)
+    top = 0
+    for title, image in panels:
+        draw.text((4, top + 2), title, fill=BLACK_INDEX)
+        top += TITLE_HEIGHT
+        canvas.paste(Image.fromarray(DB_TO_LEVEL[image]), (0, top))
+        top += image.shape[0]
+    buffer = BytesIO()
+    canvas.save(buffer, format='PNG', compress_level=compress_level)
+    return buffer.getvalue()
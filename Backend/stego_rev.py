@@ -7,10 +7,12 @@ from fingetprint import generate_fingerprint,match_audio
 from unique_id import unique_id_generator
 from pymongo import MongoClient
 import uuid
-from typing import Union, Optional, Tuple, BinaryIO
+from typing import Union, Optional, Tuple, BinaryIO, Iterator
 import logging
 from io import BytesIO
 import struct
+import zlib
+import lzma
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -24,22 +26,692 @@ SUPPORTED_SAMPLE_WIDTHS = {1: np.uint8, 2: np.int16, 4: np.int32}
 MIN_FRAME_RATE = 8000  # Minimum supported frame rate
 MAX_FRAME_RATE = 48000  # Maximum supported frame rate
 MAX_AUDIO_DURATION = 300  # Maximum audio duration in seconds
+# Upper bound on the scaled (16 bits per frame) audio bits a header may declare
+MAX_AUDIO_BITS = MAX_AUDIO_DURATION * MAX_FRAME_RATE * 16
+
+# Cyclic LSB pattern: bit i of the stream goes to flat component i, at bit position i % 3
+# (R-1st LSB, G-2nd LSB, B-3rd LSB)
+CYCLIC_BIT_SHIFTS = np.array([0, 1, 2], dtype=np.uint8)
+CYCLIC_CLEAR_MASKS = np.array([0xFE, 0xFD, 0xFB], dtype=np.uint8)
+KERNEL_CHUNK_BYTES = 3 * 128 * 1024  # Payload bytes unpacked per kernel pass (bits stay a multiple of 3)
+AUDIO_BLOCK_FRAMES = 65536  # Frames read per block when streaming WAV input
+
+# Versioned payload header, written by default.
+# Legacy images start with the 32-bit overall length instead; a legacy length equal to the
+# magic (~1.4G bits) would need a ~467M pixel carrier, so the two cannot be confused.
+PAYLOAD_MAGIC = b'STGA'
+PAYLOAD_FORMAT_VERSION = 3
+# magic, version, codec, compression level, density, unique id, frame rate, audio bits, stored bytes
+PAYLOAD_HEADER = struct.Struct('>4sBBBBIIII')
+# Version 3 adds the sample format of the audio: channels, sample width in bytes.
+# (0, 0) is the min/max scaled 16-bit mono audio of audio_to_binary (the only format before version 3).
+PAYLOAD_SAMPLE_FORMAT = struct.Struct('>BB')
+SAMPLE_FORMAT_SCALED = (0, 0)
+# Version 2+ ends the header with a CRC-32 of the preceding header bytes (version 1 images have none)
+PAYLOAD_HEADER_CRC = struct.Struct('>I')
+# Payload modes: 'scaled' (normalized 16-bit mono) or 'pcm' (native WAV frames, bit-exact)
+PAYLOAD_MODES = ('scaled', 'pcm')
+CODEC_RAW = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+COMPRESSION_CODECS = {'zlib': CODEC_ZLIB, 'lzma': CODEC_LZMA}
+DEFAULT_COMPRESSION_LEVEL = 6
+
+# Density modes: bits per pixel -> (components used per pixel, LSBs used per component).
+# Mode 3 is the legacy cyclic layout (R-1st, G-2nd, B-3rd LSB) and has its own kernel;
+# the other modes store k-bit groups (MSB first) in the k LSBs of each component.
+# The payload header itself is always written in the cyclic layout.
+DENSITY_MODES = {1: (1, 1), 3: (3, 1), 6: (3, 2), 9: (3, 3)}
+DEFAULT_DENSITY = 3
+
+
+
+class InsufficientCapacityError(ValueError):
+    """Raised when a payload does not fit into the carrier image."""
+
+    def __init__(self, required_bits: int, available_bits: int, message: Optional[str] = None):
+        """
+        Args:
+            required_bits: Body bits the payload needs (after compression)
+            available_bits: Body bits the image can hold at the requested density
+            message: Error message (defaults to one stating both sizes)
+        """
+        super().__init__(message or f"Insufficient space in the image. Required: {required_bits} bits, "
+                                    f"Available: {available_bits} bits")
+        self.required_bits = required_bits
+        self.available_bits = available_bits
+
+    def __reduce__(self):
+        # Keep the sizes when the error is sent back from a worker process
+        return self.__class__, (self.required_bits, self.available_bits, str(self))
+
+
+class BitPayload:
+    """
+    Bit string stored as packed uint8 bytes (most significant bit first).
+
+    This replaces the strings of '0'/'1' characters that used to be passed
+    between the stego stages. ``len()`` still reports the number of bits and
+    ``str()`` returns the old '0'/'1' representation for compatibility.
+    """
+
+    def __init__(self, data: Union[bytes, bytearray, np.ndarray], n_bits: Optional[int] = None):
+        """
+        Args:
+            data: Packed bytes holding the bits
+            n_bits: Number of valid bits in data (defaults to all of them)
+        """
+        if isinstance(data, np.ndarray):
+            self.data = data.astype(np.uint8, copy=False).reshape(-1)
+        else:
+            self.data = np.frombuffer(bytes(data), dtype=np.uint8)
+
+        capacity = self.data.size * 8
+        self.n_bits = capacity if n_bits is None else int(n_bits)
+        if not 0 <= self.n_bits <= capacity:
+            raise ValueError(f"Bit count {self.n_bits} does not fit in {self.data.size} bytes")
+
+    @classmethod
+    def from_bits(cls, bits: np.ndarray) -> 'BitPayload':
+        """Build a payload from an array of 0/1 values."""
+        bits = np.asarray(bits, dtype=np.uint8).reshape(-1)
+        return cls(np.packbits(bits), bits.size)
+
+    @classmethod
+    def from_string(cls, binary_string: str) -> 'BitPayload':
+        """Build a payload from a string of '0'/'1' characters."""
+        try:
+            chars = np.frombuffer(binary_string.encode('ascii'), dtype=np.uint8)
+        except (AttributeError, UnicodeEncodeError):
+            raise ValueError("Binary data must be a string of 0s and 1s")
+        bits = chars - ord('0')
+        if bits.size and bits.max() > 1:
+            raise ValueError("Binary data must be a string of 0s and 1s")
+        return cls.from_bits(bits)
+
+    def iter_chunks(self, chunk_bytes: int = KERNEL_CHUNK_BYTES) -> Iterator[np.ndarray]:
+        """Yield the packed bytes in consecutive chunks of at most chunk_bytes."""
+        for offset in range(0, (self.n_bits + 7) // 8, chunk_bytes):
+            yield self.data[offset:offset + chunk_bytes]
+
+    def unpack(self) -> np.ndarray:
+        """Return the payload as an array of 0/1 values (one uint8 per bit)."""
+        return np.unpackbits(self.data, count=self.n_bits)
+
+    def to_bytes(self) -> bytes:
+        """Return the packed bytes; a partial last byte is zero padded."""
+        return self.data[:(self.n_bits + 7) // 8].tobytes()
+
+    def to_string(self) -> str:
+        """Return the payload as a string of '0'/'1' characters."""
+        return (self.unpack() + ord('0')).tobytes().decode('ascii')
+
+    def __len__(self) -> int:
+        return self.n_bits
+
+    def __str__(self) -> str:
+        return self.to_string()
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, BitPayload):
+            return NotImplemented
+        return self.n_bits == other.n_bits and np.array_equal(self.unpack(), other.unpack())
+
+
+class PcmPayload(BitPayload):
+    """
+    Native PCM frames exactly as stored in a WAV data chunk (little-endian,
+    channels interleaved), embedded without any normalization.
+    """
+
+    def __init__(self, data: Union[bytes, bytearray, np.ndarray], channels: int, sample_width: int,
+                 n_bits: Optional[int] = None):
+        """
+        Args:
+            data: Packed frame bytes
+            channels: Number of interleaved channels
+            sample_width: Bytes per sample
+            n_bits: Number of valid bits in data (defaults to all of them)
+        """
+        super().__init__(data, n_bits)
+        self.channels = channels
+        self.sample_width = sample_width
+
+    @property
+    def frame_bits(self) -> int:
+        """Bits per frame (all channels)."""
+        return self.channels * self.sample_width * 8
+
+
+class StreamingPcmPayload(PcmPayload):
+    """PCM payload read from a WAV source one block of frames at a time."""
+
+    def __init__(self, audio_file: Union[str, BinaryIO], n_frames: int, channels: int, sample_width: int,
+                 block_frames: int = AUDIO_BLOCK_FRAMES):
+        """
+        Args:
+            audio_file: Path to the WAV file or a seekable file-like object
+            n_frames: Number of frames declared by the WAV header
+            channels: Number of channels
+            sample_width: Bytes per sample
+            block_frames: Frames read per block
+        """
+        self.audio_file = audio_file
+        self.channels = channels
+        self.sample_width = sample_width
+        self.n_bits = n_frames * channels * sample_width * 8
+        self.block_frames = block_frames
+        self._data = None
+
+    @property
+    def data(self) -> np.ndarray:
+        if self._data is None:
+            self._data = np.concatenate([np.zeros(0, dtype=np.uint8), *self.iter_chunks()])
+        return self._data
+
+    def iter_chunks(self, chunk_bytes: int = KERNEL_CHUNK_BYTES) -> Iterator[np.ndarray]:
+        """Yield the frame bytes one WAV block at a time (chunk_bytes is ignored while streaming)."""
+        if self._data is not None:
+            yield from super().iter_chunks(chunk_bytes)
+            return
+        if hasattr(self.audio_file, 'seek'):
+            self.audio_file.seek(0)
+        read_bytes = 0
+        with wave.open(self.audio_file, 'rb') as wav:
+            while True:
+                audio_frames = wav.readframes(self.block_frames)
+                if not audio_frames:
+                    break
+                read_bytes += len(audio_frames)
+                yield np.frombuffer(audio_frames, dtype=np.uint8)
+        if read_bytes * 8 < self.n_bits:
+            raise ValueError("WAV data is shorter than its header declares")
+
+
+def as_bit_payload(binary_data: Union[str, bytes, BitPayload]) -> BitPayload:
+    """
+    Normalize the accepted payload representations to a BitPayload.
+
+    Args:
+        binary_data: BitPayload, packed bytes, or a legacy '0'/'1' string
+
+    Returns:
+        BitPayload: The payload in packed form
+
+    Raises:
+        ValueError: If the data is not a valid payload
+    """
+    if isinstance(binary_data, BitPayload):
+        return binary_data
+    if isinstance(binary_data, str):
+        return BitPayload.from_string(binary_data)
+    if isinstance(binary_data, (bytes, bytearray)):
+        return BitPayload(binary_data)
+    raise ValueError("Binary data must be a BitPayload, bytes or a string of 0s and 1s")
+
+
+class StreamingAudioPayload(BitPayload):
+    """
+    Audio payload produced block by block from a WAV source or PCM payload.
+
+    The normalization range is found by a first pass over the source. The
+    packed 16-bit samples are then generated one block at a time whenever the
+    payload is iterated, so the whole clip is only held in memory if ``data``
+    is used.
+    """
+
+    def __init__(self, audio_file: Union[str, BinaryIO, PcmPayload], n_samples: int, sample_min: np.float32,
+                 sample_max: np.float32, block_frames: int = AUDIO_BLOCK_FRAMES):
+        """
+        Args:
+            audio_file: Path to the WAV file, a seekable file-like object, or a
+                        PcmPayload holding (or streaming) the frames
+            n_samples: Number of (mono) samples the file yields
+            sample_min: Minimum sample value used for normalization
+            sample_max: Maximum sample value used for normalization
+            block_frames: Frames read per block
+        """
+        self.audio_file = audio_file
+        self.n_bits = n_samples * 16
+        self.sample_min = sample_min
+        self.sample_max = sample_max
+        self.block_frames = block_frames
+        self._data = None
+
+    @property
+    def data(self) -> np.ndarray:
+        if self._data is None:
+            self._data = np.concatenate([np.zeros(0, dtype=np.uint8), *self.iter_chunks()])
+        return self._data
+
+    def iter_chunks(self, chunk_bytes: int = KERNEL_CHUNK_BYTES) -> Iterator[np.ndarray]:
+        """Yield packed samples one WAV block at a time (chunk_bytes is ignored while streaming)."""
+        if self._data is not None:
+            yield from super().iter_chunks(chunk_bytes)
+            return
+        if isinstance(self.audio_file, PcmPayload):
+            blocks = _iter_pcm_blocks(self.audio_file, self.block_frames)
+        else:
+            blocks = _iter_wav_blocks(self.audio_file, self.block_frames)
+        for block in blocks:
+            yield _scale_samples(block, self.sample_min, self.sample_max)
+
+
+def compress_payload(payload: BitPayload, codec: int, level: int = DEFAULT_COMPRESSION_LEVEL) -> bytes:
+    """
+    Losslessly compress a payload of 16-bit samples (delta coding + zlib/lzma).
+    
+    The payload is consumed through iter_chunks(), so streaming payloads are
+    compressed without being materialized.
+    
+    Args:
+        payload: Payload of big-endian 16-bit samples (a partial last sample is zero padded)
+        codec: CODEC_ZLIB or CODEC_LZMA
+        level: Compression level (0-9)
+        
+    Returns:
+        bytes: The compressed stream
+    """
+    if codec == CODEC_ZLIB:
+        compressor = zlib.compressobj(level)
+    elif codec == CODEC_LZMA:
+        compressor = lzma.LZMACompressor(preset=level)
+    else:
+        raise ValueError(f"Unsupported compression codec: {codec}")
+
+    n_bytes = (len(payload) + 7) // 8
+    n_bytes += n_bytes % 2
+    compressed = []
+    previous = np.zeros(1, dtype=np.uint16)
+    carry = b''
+    consumed = 0
+    for chunk in payload.iter_chunks():
+        data = carry + chunk.tobytes()
+        usable = len(data) // 2 * 2
+        carry = data[usable:]
+        consumed += usable
+        samples = np.frombuffer(data, dtype='>u2', count=usable // 2).astype(np.uint16)
+        if samples.size:
+            # uint16 arithmetic wraps, so the deltas are exactly invertible with cumsum
+            delta = np.diff(samples, prepend=previous)
+            previous = samples[-1:]
+            compressed.append(compressor.compress(delta.astype('>u2').tobytes()))
+    if consumed < n_bytes:
+        last = np.frombuffer((carry + b'\x00')[:2], dtype='>u2').astype(np.uint16)
+        compressed.append(compressor.compress((last - previous).astype('>u2').tobytes()))
+    compressed.append(compressor.flush())
+    return b''.join(compressed)
+
+
+def decompress_payload(data: bytes, codec: int, n_bits: int) -> BitPayload:
+    """
+    Inverse of compress_payload.
+    
+    Args:
+        data: Compressed stream
+        codec: CODEC_ZLIB or CODEC_LZMA
+        n_bits: Number of payload bits before compression
+        
+    The output is capped at the size the header declares (one 16-bit delta
+    per 16 payload bits), so a crafted stream cannot inflate beyond it.
+    
+    Returns:
+        BitPayload: The original payload
+        
+    Raises:
+        ValueError: If the stream is invalid, shorter than n_bits or
+            decompresses to more than n_bits
+    """
+    max_length = -(-n_bits // 16) * 2
+    try:
+        if codec == CODEC_ZLIB:
+            decompressor = zlib.decompressobj()
+            raw = decompressor.decompress(data, max_length)
+            if not decompressor.eof and decompressor.decompress(decompressor.unconsumed_tail, 1):
+                raise ValueError("Compressed payload is longer than the embedded audio length")
+            leftover = decompressor.unconsumed_tail or decompressor.unused_data
+        elif codec == CODEC_LZMA:
+            decompressor = lzma.LZMADecompressor()
+            raw = decompressor.decompress(data, max_length)
+            if not decompressor.eof and decompressor.decompress(b'', 1):
+                raise ValueError("Compressed payload is longer than the embedded audio length")
+            leftover = decompressor.unused_data
+        else:
+            raise ValueError(f"Unsupported compression codec: {codec}")
+    except (zlib.error, lzma.LZMAError) as e:
+        raise ValueError(f"Corrupted compressed payload: {str(e)}")
+    if not decompressor.eof or leftover:
+        raise ValueError("Corrupted compressed payload: truncated stream or trailing data")
+
+    delta = np.frombuffer(raw, dtype='>u2', count=len(raw) // 2)
+    if delta.size * 16 < n_bits:
+        raise ValueError("Compressed payload is shorter than the embedded audio length")
+    samples = np.cumsum(delta, dtype=np.uint16).astype('>u2')
+    return BitPayload(samples.view(np.uint8), n_bits)
+
+
+def _write_cyclic_bits(flat_pixels: np.ndarray, bits: np.ndarray, start: int = 0) -> None:
+    """Write 0/1 bits into the cyclic LSB positions of flat_pixels[start:], in place."""
+    end = start + bits.size
+    head = min(-start % 3, bits.size)
+    for offset in range(head):
+        index = start + offset
+        shift = index % 3
+        flat_pixels[index] = (flat_pixels[index] & CYCLIC_CLEAR_MASKS[shift]) | (bits[offset] << shift)
+
+    body_start = start + head
+    body_length = (end - body_start) // 3 * 3
+    if body_length:
+        block = flat_pixels[body_start:body_start + body_length].reshape(-1, 3)
+        block &= CYCLIC_CLEAR_MASKS
+        block |= bits[head:head + body_length].reshape(-1, 3) << CYCLIC_BIT_SHIFTS
+
+    for index in range(body_start + body_length, end):
+        shift = index % 3
+        flat_pixels[index] = (flat_pixels[index] & CYCLIC_CLEAR_MASKS[shift]) | (bits[index - start] << shift)
+
+
+def _read_cyclic_bits(flat_pixels: np.ndarray, start: int, count: int) -> np.ndarray:
+    """Read count bits from the cyclic LSB positions of flat_pixels[start:]."""
+    head = min(-start % 3, count)
+    bits = np.empty(count, dtype=np.uint8)
+    for offset in range(head):
+        bits[offset] = (flat_pixels[start + offset] >> ((start + offset) % 3)) & 1
+
+    body_start = start + head
+    body_length = (count - head) // 3 * 3
+    if body_length:
+        block = flat_pixels[body_start:body_start + body_length].reshape(-1, 3)
+        bits[head:head + body_length] = ((block >> CYCLIC_BIT_SHIFTS) & 1).reshape(-1)
+
+    for offset in range(head + body_length, count):
+        bits[offset] = (flat_pixels[start + offset] >> ((start + offset) % 3)) & 1
+    return bits
+
+
+def embed_payload_bits(flat_pixels: np.ndarray, payload: BitPayload, start_bit: int = 0) -> None:
+    """
+    Embed a payload into the cyclic LSB positions of a flat pixel buffer, in place.
+    
+    Only the components holding the payload are touched, and the payload is
+    unpacked a chunk at a time so the working set stays small.
+    
+    Args:
+        flat_pixels: Writable 1-D uint8 view of the RGB pixel data
+        payload: Bits to embed
+        start_bit: Bit offset (= flat component index) where the payload starts
+    """
+    bit_offset = 0
+    for chunk in payload.iter_chunks(KERNEL_CHUNK_BYTES):
+        count = min(chunk.size * 8, len(payload) - bit_offset)
+        if count <= 0:
+            break
+        _write_cyclic_bits(flat_pixels, np.unpackbits(chunk, count=count), start_bit + bit_offset)
+        bit_offset += count
+
+
+def extract_payload_bits(flat_pixels: np.ndarray, start_bit: int, n_bits: int) -> BitPayload:
+    """
+    Extract n_bits from the cyclic LSB positions of a flat pixel buffer.
+    
+    Args:
+        flat_pixels: 1-D uint8 view of the RGB pixel data
+        start_bit: Bit offset (= flat component index) of the first bit
+        n_bits: Number of bits to read
+        
+    Returns:
+        BitPayload: The extracted bits
+    """
+    packed = np.empty((n_bits + 7) // 8, dtype=np.uint8)
+    chunk_bits = KERNEL_CHUNK_BYTES * 8
+    for bit_offset in range(0, n_bits, chunk_bits):
+        bits = _read_cyclic_bits(flat_pixels, start_bit + bit_offset, min(chunk_bits, n_bits - bit_offset))
+        packed[bit_offset // 8:bit_offset // 8 + (bits.size + 7) // 8] = np.packbits(bits)
+    return BitPayload(packed, n_bits)
+
+
+def payload_header_bits(version: int = PAYLOAD_FORMAT_VERSION) -> int:
+    """Size in bits of the versioned payload header of the given format version."""
+    size = PAYLOAD_HEADER.size
+    if version >= 3:
+        size += PAYLOAD_SAMPLE_FORMAT.size
+    if version >= 2:
+        size += PAYLOAD_HEADER_CRC.size
+    return size * 8
+
+
+def available_body_bits(pixels: int, density: int = DEFAULT_DENSITY, versioned: bool = False) -> int:
+    """
+    Largest number of body bits that fits in an image of the given pixel count.
+    
+    Args:
+        pixels: Pixels in the image
+        density: Bits per pixel of the body (key of DENSITY_MODES)
+        versioned: Whether the current versioned header is used (otherwise the legacy layout)
+        
+    Returns:
+        int: Available body bits
+    """
+    if not versioned:
+        # Legacy layout: overall length + unique id + audio length + frame rate, then the audio
+        return max(0, pixels * 3 - (HEADER_BIT_LENGTH + 32 + 32 + 16))
+    header_pixels = payload_pixels_needed(0, density, versioned=True)
+    # Versioned bodies are stored as whole bytes
+    return max(0, (pixels - header_pixels) * density // 8 * 8)
+
+
+def payload_pixels_needed(body_bits: int, density: int = DEFAULT_DENSITY, versioned: bool = False) -> int:
+    """
+    Number of pixels an embedded payload occupies, header included.
+    
+    Args:
+        body_bits: Bits stored after the header (audio bits, or compressed bytes * 8)
+        density: Bits per pixel of the body (key of DENSITY_MODES)
+        versioned: Whether the current versioned header is used (otherwise the legacy layout)
+        
+    Returns:
+        int: Pixels needed, counted from the first pixel
+    """
+    if not versioned:
+        return -(-(HEADER_BIT_LENGTH + 32 + 32 + 16 + body_bits) // 3)
+    return -(-payload_header_bits() // 3) + -(-body_bits // density)
+
+
+def _group_bits(bits: np.ndarray, lsbs: int) -> np.ndarray:
+    """Combine consecutive groups of lsbs bits (MSB first) into uint8 values."""
+    grouped = bits.reshape(-1, lsbs)
+    values = np.zeros(grouped.shape[0], dtype=np.uint8)
+    for j in range(lsbs):
+        values |= grouped[:, j] << np.uint8(lsbs - 1 - j)
+    return values
+
+
+def embed_payload_dense(flat_pixels: np.ndarray, payload: BitPayload, start_pixel: int, density: int) -> None:
+    """
+    Embed a payload using one of the DENSITY_MODES, in place.
+    
+    Args:
+        flat_pixels: Writable 1-D uint8 view of the RGB pixel data
+        payload: Bits to embed
+        start_pixel: Index of the first pixel holding the payload
+        density: Bits per pixel (key of DENSITY_MODES)
+    """
+    if density == 3:
+        embed_payload_bits(flat_pixels, payload, start_pixel * 3)
+        return
+
+    components, lsbs = DENSITY_MODES[density]
+    pixels = flat_pixels.reshape(-1, 3)
+    clear_mask = np.uint8(0xFF ^ ((1 << lsbs) - 1))
+
+    def write(bits: np.ndarray, pixel: int) -> int:
+        n_pixels = bits.size // density
+        region = pixels[pixel:pixel + n_pixels, :components]
+        region &= clear_mask
+        region |= _group_bits(bits, lsbs).reshape(n_pixels, components)
+        return pixel + n_pixels
+
+    pixel = start_pixel
+    carry = np.zeros(0, dtype=np.uint8)
+    remaining = len(payload)
+    for chunk in payload.iter_chunks(KERNEL_CHUNK_BYTES):
+        count = min(chunk.size * 8, remaining)
+        if count <= 0:
+            break
+        remaining -= count
+        bits = np.concatenate((carry, np.unpackbits(chunk, count=count)))
+        usable = bits.size // density * density
+        pixel = write(bits[:usable], pixel)
+        carry = bits[usable:]
+
+    if carry.size:
+        # Zero pad the last, partially used pixel
+        write(np.concatenate((carry, np.zeros(density - carry.size, dtype=np.uint8))), pixel)
+
+
+def extract_payload_dense(flat_pixels: np.ndarray, start_pixel: int, n_bits: int, density: int) -> BitPayload:
+    """
+    Extract n_bits written by embed_payload_dense.
+    
+    Args:
+        flat_pixels: 1-D uint8 view of the RGB pixel data
+        start_pixel: Index of the first pixel holding the payload
+        n_bits: Number of bits to read
+        density: Bits per pixel (key of DENSITY_MODES)
+        
+    Returns:
+        BitPayload: The extracted bits
+    """
+    if density == 3:
+        return extract_payload_bits(flat_pixels, start_pixel * 3, n_bits)
+
+    components, lsbs = DENSITY_MODES[density]
+    pixels = flat_pixels.reshape(-1, 3)
+    shifts = np.arange(lsbs - 1, -1, -1, dtype=np.uint8)
+    n_pixels = -(-n_bits // density)
+    # A multiple of 8 pixels per pass keeps every pass byte aligned
+    chunk_pixels = max(8, KERNEL_CHUNK_BYTES * 8 // density // 8 * 8)
+
+    packed = np.empty((n_bits + 7) // 8, dtype=np.uint8)
+    for offset in range(0, n_pixels, chunk_pixels):
+        stop = min(offset + chunk_pixels, n_pixels)
+        values = pixels[start_pixel + offset:start_pixel + stop, :components].reshape(-1)
+        bits = ((values[:, None] >> shifts) & 1).reshape(-1)[:n_bits - offset * density]
+        packed[offset * density // 8:offset * density // 8 + (bits.size + 7) // 8] = np.packbits(bits)
+    return BitPayload(packed, n_bits)
+
 
 # client = MongoClient("mongodb://localhost:27017/")
 # db = client["steganography_db"]
 # collection = db["audio_fingerprints"]
 
 
-def audio_to_binary(audio_file: Union[str, BinaryIO]) -> Tuple[str, int]:
+def _validate_wav_params(wav: wave.Wave_read) -> Tuple[int, int, int, int]:
+    """
+    Validate and log the parameters of an open WAV file.
+    
+    Returns:
+        Tuple of (n_channels, sample_width, frame_rate, n_frames)
+        
+    Raises:
+        ValueError: If the audio parameters are unsupported
+    """
+    # Extract audio parameters
+    n_channels = wav.getnchannels()
+    sample_width = wav.getsampwidth()
+    frame_rate = wav.getframerate()
+    n_frames = wav.getnframes()
+    duration = n_frames / frame_rate
+
+    # Validate audio parameters
+    if n_channels not in (1, 2):
+        raise ValueError(f"Unsupported number of channels: {n_channels}. Only mono and stereo are supported.")
+    
+    if sample_width not in SUPPORTED_SAMPLE_WIDTHS:
+        raise ValueError(f"Unsupported sample width: {sample_width} bytes")
+    
+    if not MIN_FRAME_RATE <= frame_rate <= MAX_FRAME_RATE:
+        raise ValueError(f"Frame rate {frame_rate} Hz is not supported. Must be between {MIN_FRAME_RATE} and {MAX_FRAME_RATE} Hz")
+    
+    if duration > MAX_AUDIO_DURATION:
+        raise ValueError(f"Audio duration {duration:.1f} seconds exceeds maximum allowed duration of {MAX_AUDIO_DURATION} seconds")
+
+    # Log audio details
+    logger.info(f"Processing audio file:")
+    logger.info(f"  Channels: {n_channels}")
+    logger.info(f"  Sample Width: {sample_width} bytes")
+    logger.info(f"  Frame Rate: {frame_rate} Hz")
+    logger.info(f"  Total Frames: {n_frames}")
+    logger.info(f"  Duration: {duration:.2f} seconds")
+
+    return n_channels, sample_width, frame_rate, n_frames
+
+
+def _iter_wav_blocks(audio_file: Union[str, BinaryIO], block_frames: int) -> Iterator[np.ndarray]:
+    """Yield blocks of mono samples (stereo channels averaged) in the file's native dtype."""
+    if hasattr(audio_file, 'seek'):
+        audio_file.seek(0)
+    with wave.open(audio_file, 'rb') as wav:
+        n_channels = wav.getnchannels()
+        dtype = SUPPORTED_SAMPLE_WIDTHS[wav.getsampwidth()]
+        while True:
+            audio_frames = wav.readframes(block_frames)
+            if not audio_frames:
+                break
+            block = np.frombuffer(audio_frames, dtype=dtype)
+            # Handle stereo audio by averaging channels
+            if n_channels == 2:
+                block = block.reshape(-1, 2).mean(axis=1).astype(dtype)
+            yield block
+
+
+def _iter_pcm_frames(payload: PcmPayload, block_frames: int) -> Iterator[np.ndarray]:
+    """Yield the complete frames of a PCM payload as uint8 blocks of at most block_frames frames."""
+    frame_bytes = payload.frame_bits // 8
+    remaining = len(payload) // payload.frame_bits * frame_bytes
+    for chunk in payload.iter_chunks(block_frames * frame_bytes):
+        if remaining <= 0:
+            break
+        chunk = chunk[:remaining // frame_bytes * frame_bytes]
+        remaining -= chunk.size
+        # Streaming payloads yield whole WAV blocks, which may hold more than block_frames frames
+        for offset in range(0, chunk.size, block_frames * frame_bytes):
+            yield chunk[offset:offset + block_frames * frame_bytes]
+
+
+def _iter_pcm_blocks(payload: PcmPayload, block_frames: int) -> Iterator[np.ndarray]:
+    """Yield blocks of mono samples (stereo channels averaged) in the native dtype, like _iter_wav_blocks."""
+    dtype = SUPPORTED_SAMPLE_WIDTHS[payload.sample_width]
+    for frames in _iter_pcm_frames(payload, block_frames):
+        block = frames.view(dtype)
+        # Handle stereo audio by averaging channels
+        if payload.channels == 2:
+            block = block.reshape(-1, 2).mean(axis=1).astype(dtype)
+        yield block
+
+
+def _scale_samples(samples: np.ndarray, sample_min: np.float32, sample_max: np.float32) -> np.ndarray:
+    """Normalize samples to 0-1, scale to 16 bits and return them as big-endian packed bytes."""
+    audio_array = (samples.astype(np.float32) - sample_min) / (sample_max - sample_min)
+    # (scaled in float64, matching the previous per-sample int(sample * 65535))
+    scaled = np.multiply(audio_array, 65535, dtype=np.float64).astype('>u2')
+    return scaled.view(np.uint8)
+
+
+def audio_to_binary(audio_file: Union[str, BinaryIO], stream: bool = False,
+                    block_frames: int = AUDIO_BLOCK_FRAMES) -> Tuple[BitPayload, int]:
     """
-    Convert audio file to binary string and extract frame rate.
+    Convert audio file to a packed bit payload and extract frame rate.
     
     Args:
         audio_file: Path to audio file or file-like object
+        stream: If True, return a StreamingAudioPayload that reads the file in
+                blocks of block_frames instead of decoding it all at once
+        block_frames: Frames read per block
         
     Returns:
         Tuple containing:
-        - binary_data: Binary string representation of audio
+        - binary_data: Packed 16-bit-per-sample representation of audio
         - frame_rate: Audio frame rate
         
     Raises:
@@ -52,59 +724,78 @@ def audio_to_binary(audio_file: Union[str, BinaryIO]) -> Tuple[str, int]:
             audio_file.seek(0)
             
         with wave.open(audio_file, 'rb') as wav:
-            # Extract audio parameters
-            n_channels = wav.getnchannels()
-            sample_width = wav.getsampwidth()
-            frame_rate = wav.getframerate()
-            n_frames = wav.getnframes()
-            duration = n_frames / frame_rate
-
-            # Validate audio parameters
-            if n_channels not in (1, 2):
-                raise ValueError(f"Unsupported number of channels: {n_channels}. Only mono and stereo are supported.")
-            
-            if sample_width not in SUPPORTED_SAMPLE_WIDTHS:
-                raise ValueError(f"Unsupported sample width: {sample_width} bytes")
-            
-            if not MIN_FRAME_RATE <= frame_rate <= MAX_FRAME_RATE:
-                raise ValueError(f"Frame rate {frame_rate} Hz is not supported. Must be between {MIN_FRAME_RATE} and {MAX_FRAME_RATE} Hz")
-            
-            if duration > MAX_AUDIO_DURATION:
-                raise ValueError(f"Audio duration {duration:.1f} seconds exceeds maximum allowed duration of {MAX_AUDIO_DURATION} seconds")
-
-            # Log audio details
-            logger.info(f"Processing audio file:")
-            logger.info(f"  Channels: {n_channels}")
-            logger.info(f"  Sample Width: {sample_width} bytes")
-            logger.info(f"  Frame Rate: {frame_rate} Hz")
-            logger.info(f"  Total Frames: {n_frames}")
-            logger.info(f"  Duration: {duration:.2f} seconds")
-
-            # Read audio frames
-            audio_frames = wav.readframes(n_frames)
-            if not audio_frames:
-                raise ValueError("No audio data found in file")
+            _, _, frame_rate, _ = _validate_wav_params(wav)
+
+        # First pass: normalization range and sample count, one block at a time
+        n_samples = 0
+        sample_min = sample_max = None
+        blocks = []
+        for block in _iter_wav_blocks(audio_file, block_frames):
+            if not block.size:
+                continue
+            n_samples += block.size
+            block_min, block_max = block.min(), block.max()
+            sample_min = block_min if sample_min is None else min(sample_min, block_min)
+            sample_max = block_max if sample_max is None else max(sample_max, block_max)
+            if not stream:
+                blocks.append(block)
+
+        if not n_samples:
+            raise ValueError("No audio data found in file")
+        if sample_max == sample_min:
+            raise ValueError("Audio contains no signal variation")
+        sample_min, sample_max = np.float32(sample_min), np.float32(sample_max)
+
+        if stream:
+            binary_data = StreamingAudioPayload(audio_file, n_samples, sample_min, sample_max, block_frames)
+        else:
+            binary_data = BitPayload(np.concatenate([_scale_samples(block, sample_min, sample_max) for block in blocks]))
+        
+        return binary_data, frame_rate
 
-            # Convert to numpy array
-            dtype = SUPPORTED_SAMPLE_WIDTHS[sample_width]
-            audio_array = np.frombuffer(audio_frames, dtype=dtype)
+    except wave.Error as e:
+        error_msg = f"Wave file error: {str(e)}"
+        logger.error(error_msg)
+        raise ValueError(error_msg)
+    except Exception as e:
+        error_msg = f"Error processing audio file: {str(e)}"
+        logger.error(error_msg)
+        raise IOError(error_msg)
 
-            # Handle stereo audio by averaging channels
-            if n_channels == 2:
-                audio_array = audio_array.reshape(-1, 2).mean(axis=1).astype(dtype)
 
-            # Normalize audio data to 0-1 range
-            audio_array = audio_array.astype(np.float32)
-            audio_array = (audio_array - audio_array.min()) / (audio_array.max() - audio_array.min())
-            
-            # Convert to binary string with proper scaling
-            binary_data = ''
-            for sample in audio_array:
-                # Scale to 16-bit range and convert to binary
-                scaled_value = int(sample * 65535)
-                binary_data += format(scaled_value, '016b')
-            
-            return binary_data, frame_rate
+def audio_to_pcm(audio_file: Union[str, BinaryIO], stream: bool = False,
+                 block_frames: int = AUDIO_BLOCK_FRAMES) -> Tuple[PcmPayload, int]:
+    """
+    Read the native PCM frames of a WAV file as a payload, without any conversion.
+    
+    Args:
+        audio_file: Path to audio file or file-like object
+        stream: If True, return a StreamingPcmPayload that reads the file in
+                blocks of block_frames when embedded
+        block_frames: Frames read per block
+        
+    Returns:
+        Tuple containing:
+        - binary_data: The frames, tagged with their channel count and sample width
+        - frame_rate: Audio frame rate
+        
+    Raises:
+        ValueError: If audio file is invalid or unsupported
+        IOError: If there are issues reading the audio file
+    """
+    try:
+        if hasattr(audio_file, 'seek'):
+            audio_file.seek(0)
+
+        with wave.open(audio_file, 'rb') as wav:
+            n_channels, sample_width, frame_rate, n_frames = _validate_wav_params(wav)
+            if not n_frames:
+                raise ValueError("No audio data found in file")
+            if stream:
+                return StreamingPcmPayload(audio_file, n_frames, n_channels, sample_width, block_frames), frame_rate
+            frames = wav.readframes(n_frames)
+
+        return PcmPayload(np.frombuffer(frames, dtype=np.uint8), n_channels, sample_width), frame_rate
 
     except wave.Error as e:
         error_msg = f"Wave file error: {str(e)}"
@@ -116,14 +807,145 @@ def audio_to_binary(audio_file: Union[str, BinaryIO]) -> Tuple[str, int]:
         raise IOError(error_msg)
 
 
-def binary_to_audio(binary_data: str, frame_rate: int, output_file: str) -> None:
+def pcm_to_binary(payload: PcmPayload, block_frames: int = AUDIO_BLOCK_FRAMES) -> StreamingAudioPayload:
+    """
+    Convert PCM frames (e.g. from audio_to_pcm, streaming or not) to the
+    scaled 16-bit mono payload of audio_to_binary, without parsing the WAV
+    file again.
+    
+    The normalization range is found with one pass over the frames in blocks
+    of block_frames; the packed samples are then produced block by block as
+    the payload is embedded, so no full-length copy of the clip is made.
+    
+    Args:
+        payload: PCM payload
+        block_frames: Frames converted per block
+        
+    Returns:
+        StreamingAudioPayload: Same bits audio_to_binary produces for the WAV file
+        
+    Raises:
+        ValueError: If the audio is empty or silent
+    """
+    n_samples = 0
+    sample_min = sample_max = None
+    for block in _iter_pcm_blocks(payload, block_frames):
+        if not block.size:
+            continue
+        n_samples += block.size
+        block_min, block_max = block.min(), block.max()
+        sample_min = block_min if sample_min is None else min(sample_min, block_min)
+        sample_max = block_max if sample_max is None else max(sample_max, block_max)
+    if not n_samples:
+        raise ValueError("No audio data found in file")
+    if sample_max == sample_min:
+        raise ValueError("Audio contains no signal variation")
+    return StreamingAudioPayload(payload, n_samples, np.float32(sample_min), np.float32(sample_max), block_frames)
+
+
+def pcm_to_float(payload: PcmPayload, block_frames: int = AUDIO_BLOCK_FRAMES) -> np.ndarray:
+    """
+    Convert PCM frames to mono float32 samples in [-1, 1], as librosa.load does.
+    
+    The frames are converted block by block into the output array, so the
+    only full-length copy is the result itself.
+    
+    Args:
+        payload: PCM payload (streaming or in memory)
+        block_frames: Frames converted per block
+        
+    Returns:
+        np.ndarray: Mono float32 samples (channels averaged)
+    """
+    frame_bytes = payload.frame_bits // 8
+    samples = np.empty(len(payload) // payload.frame_bits, dtype=np.float32)
+    if payload.sample_width != 1:
+        dtype = np.dtype(SUPPORTED_SAMPLE_WIDTHS[payload.sample_width]).newbyteorder('<')
+    position = 0
+    for frames in _iter_pcm_frames(payload, block_frames):
+        if payload.sample_width == 1:
+            block = (frames.astype(np.float32) - 128) / 128
+        else:
+            block = frames.view(dtype) / np.float32(2 ** (8 * payload.sample_width - 1))
+        if payload.channels > 1:
+            block = block.reshape(-1, payload.channels).mean(axis=1)
+        samples[position:position + frames.size // frame_bytes] = block
+        position += frames.size // frame_bytes
+    # Streaming sources may end early
+    return samples[:position]
+
+
+def write_pcm_wav(payload: PcmPayload, frame_rate: int, output_file: Union[str, BinaryIO]) -> None:
+    """
+    Write PCM frames back as a WAV file with their original sample format.
+    
+    Args:
+        payload: PCM payload
+        frame_rate: Audio frame rate
+        output_file: Path or writable file-like object
+    """
+    frame_bytes = payload.frame_bits // 8
+    n_frames = len(payload) // payload.frame_bits
+    with wave.open(output_file, 'wb') as wav:
+        wav.setnchannels(payload.channels)
+        wav.setsampwidth(payload.sample_width)
+        wav.setframerate(frame_rate)
+        wav.setnframes(n_frames)
+        wav.writeframes(payload.data[:n_frames * frame_bytes].tobytes())
+
+
+def payload_to_samples(binary_data: Union[str, BitPayload]) -> np.ndarray:
+    """
+    Decode a payload of 16-bit values (as written by audio_to_binary) into PCM samples.
+    
+    Args:
+        binary_data: Packed payload (or legacy binary string) of 16-bit samples
+        
+    Returns:
+        np.ndarray: Mono int16 samples
+    """
+    payload = as_bit_payload(binary_data)
+
+    # Pad to whole 16-bit samples (missing trailing bits read as 0)
+    n_samples = (len(payload) + 15) // 16
+    packed = np.zeros(n_samples * 2, dtype=np.uint8)
+    n_bytes = (len(payload) + 7) // 8
+    packed[:n_bytes] = payload.data[:n_bytes]
+    if len(payload) % 8:
+        packed[n_bytes - 1] &= 0xFF << (8 - len(payload) % 8) & 0xFF
+
+    # Convert 16-bit values to floats in 0-1 range
+    audio_array = (packed.view('>u2') / 65535.0).astype(np.float32)
+
+    # Convert to 16-bit audio data
+    return (audio_array * 32767).astype(np.int16)
+
+
+def write_wav(samples: np.ndarray, frame_rate: int, output_file: Union[str, BinaryIO]) -> None:
+    """
+    Write mono 16-bit samples as a WAV file.
+    
+    Args:
+        samples: Mono int16 samples
+        frame_rate: Audio frame rate
+        output_file: Path or writable file-like object
+    """
+    with wave.open(output_file, 'wb') as wav:
+        wav.setnchannels(1)  # Mono audio
+        wav.setsampwidth(2)  # 16-bit audio
+        wav.setframerate(frame_rate)
+        wav.setnframes(len(samples))
+        wav.writeframes(samples.astype('<i2', copy=False).tobytes())
+
+
+def binary_to_audio(binary_data: Union[str, BitPayload], frame_rate: int, output_file: Union[str, BinaryIO]) -> None:
     """
-    Convert binary string to audio file.
+    Convert a bit payload to audio file.
     
     Args:
-        binary_data: Binary string representation of audio
+        binary_data: Packed payload (or legacy binary string) of 16-bit samples, or a PcmPayload
         frame_rate: Audio frame rate
-        output_file: Path to save the output WAV file
+        output_file: Path or writable file-like object for the output WAV file
         
     Raises:
         ValueError: If input parameters are invalid
@@ -131,35 +953,19 @@ def binary_to_audio(binary_data: str, frame_rate: int, output_file: str) -> None
     """
     try:
         # Validate input parameters
-        if not isinstance(binary_data, str) or not all(c in '01' for c in binary_data):
-            raise ValueError("Binary data must be a string of 0s and 1s")
-        
         if not isinstance(frame_rate, int) or not MIN_FRAME_RATE <= frame_rate <= MAX_FRAME_RATE:
             raise ValueError(f"Frame rate must be between {MIN_FRAME_RATE} and {MAX_FRAME_RATE} Hz")
 
-        # Ensure binary data length is a multiple of 16 (for 16-bit audio)
-        if len(binary_data) % 16 != 0:
-            binary_data = binary_data.ljust(len(binary_data) + (16 - len(binary_data) % 16), '0')
-
-        # Convert binary to numpy array
-        audio_array = np.zeros(len(binary_data) // 16, dtype=np.float32)
-        for i in range(0, len(binary_data), 16):
-            # Convert 16 bits to float in 0-1 range
-            value = int(binary_data[i:i+16], 2)
-            audio_array[i//16] = value / 65535.0
-
-        # Convert to 16-bit audio data
-        audio_array = (audio_array * 32767).astype(np.int16)
+        if isinstance(binary_data, PcmPayload):
+            # Native frames are written back unchanged
+            n_frames = len(binary_data) // binary_data.frame_bits
+            write_pcm_wav(binary_data, frame_rate, output_file)
+        else:
+            audio_array = payload_to_samples(binary_data)
+            n_frames = len(audio_array)
 
-        n_frames = len(audio_array)
-
-        # Write to WAV file with proper parameters
-        with wave.open(output_file, 'wb') as wav:
-            wav.setnchannels(1)  # Mono audio
-            wav.setsampwidth(2)  # 16-bit audio
-            wav.setframerate(frame_rate)
-            wav.setnframes(n_frames)
-            wav.writeframes(audio_array.tobytes())
+            # Write to WAV file with proper parameters
+            write_wav(audio_array, frame_rate, output_file)
 
         logger.info(f"Audio file saved successfully: {output_file}")
         logger.info(f"  Frame Rate: {frame_rate} Hz")
@@ -172,153 +978,356 @@ def binary_to_audio(binary_data: str, frame_rate: int, output_file: str) -> None
 
 
 
-def embed_data_rgb(image_path: Union[str, BytesIO], frame_rate: int, unique_id: str, binary_data: str, output_image_path: Optional[str] = None) -> Image.Image:
+def embed_data_rgb(image_path: Union[str, BytesIO], frame_rate: int, unique_id: str, binary_data: Union[str, BitPayload], output_image_path: Optional[str] = None,
+                   compression: Optional[str] = None, compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+                   density: int = DEFAULT_DENSITY, legacy_layout: bool = False) -> Image.Image:
     """
     Embeds binary data (audio_binary_data) along with unique_id, its length, and frame_rate 
     into an RGB image using cyclic LSB steganography (R-1st LSB, G-2nd LSB, B-3rd LSB).
     
+    The audio (delta + zlib/lzma coded if requested) is described by a versioned,
+    CRC-protected PAYLOAD_HEADER and stored at the requested density from the next
+    whole pixel on. With legacy_layout the original headerless layout is written
+    instead (uncompressed, default density only) for older decoders.
+    
     Args:
         image_path: Path to the input image or BytesIO object
         frame_rate: Audio frame rate
         unique_id: Unique identifier for the embedded data (expected as 32-bit binary string)
-        binary_data: Audio binary data to embed (string of 0s and 1s)
+        binary_data: Audio payload to embed (BitPayload from audio_to_binary, PcmPayload from
+                     audio_to_pcm, or a legacy string of 0s and 1s)
         output_image_path: Optional path to save the stego image
+        compression: Optional compression codec name ('zlib' or 'lzma')
+        compression_level: Compression level (0-9)
+        density: Bits stored per pixel (key of DENSITY_MODES)
+        legacy_layout: Write the legacy layout instead of the versioned header
         
     Returns:
         PIL.Image.Image: The stego image with embedded data
         
     Raises:
-        ValueError: If the image doesn't have enough capacity for the data or input is invalid
-        IOError: If there are issues reading/writing the image
+        InsufficientCapacityError: If the image doesn't have enough capacity for the data
+        IOError: If the input is invalid or there are issues reading/writing the image
     """
     try:
-        image = Image.open(image_path).convert('RGB')
-        image_array = np.array(image)
+        image = Image.open(image_path)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
 
         # Validate input parameters
         if not isinstance(frame_rate, int) or frame_rate <= 0:
             raise ValueError("Frame rate must be a positive integer")
         if not isinstance(unique_id, str) or len(unique_id) != 32 or not all(c in '01' for c in unique_id):
             raise ValueError("Unique ID must be a 32-bit binary string")
-        if not isinstance(binary_data, str) or not all(c in '01' for c in binary_data):
-            raise ValueError("Binary data must be a string of 0s and 1s")
-
-        # Prepare the full payload: Unique ID + Audio Length + Frame Rate + Audio Binary Data
-        audio_data_length_binary = format(len(binary_data), '032b') # Length of audio binary data itself
-        frame_rate_binary = format(frame_rate, '016b')
-
-        # This is the full payload *without* the initial overall length header
-        payload_without_overall_length_header = unique_id + audio_data_length_binary + frame_rate_binary + binary_data
-        
-        # Calculate the total length of this payload in bits
-        total_payload_length_bits = len(payload_without_overall_length_header)
-
-        # Create the overall length header itself
-        if total_payload_length_bits >= (1 << HEADER_BIT_LENGTH): 
-            raise ValueError(f"Payload too large to store its length in {HEADER_BIT_LENGTH} bits.")
-        overall_length_header = format(total_payload_length_bits, f'0{HEADER_BIT_LENGTH}b')
-
-        # The final binary string to embed (overall_length_header + actual payload)
-        final_binary_to_embed = overall_length_header + payload_without_overall_length_header
-        total_bits_to_embed = len(final_binary_to_embed)
+        payload = as_bit_payload(binary_data)
+        if compression is not None and compression not in COMPRESSION_CODECS:
+            raise ValueError(f"Unsupported compression: {compression}. Choose from {sorted(COMPRESSION_CODECS)}")
+        if not 0 <= compression_level <= 9:
+            raise ValueError("Compression level must be between 0 and 9")
+        if density not in DENSITY_MODES:
+            raise ValueError(f"Unsupported density: {density}. Choose from {sorted(DENSITY_MODES)}")
+
+        sample_format = SAMPLE_FORMAT_SCALED
+        if isinstance(payload, PcmPayload):
+            sample_format = (payload.channels, payload.sample_width)
+        if legacy_layout and (compression is not None or density != DEFAULT_DENSITY or sample_format != SAMPLE_FORMAT_SCALED):
+            raise ValueError("The legacy layout supports neither compression, density modes nor PCM payloads")
+
+        if legacy_layout:
+            # Payload layout: overall length header + Unique ID + Audio Length + Frame Rate + Audio Data
+            # The 112 header bits are byte aligned, so the audio bits follow directly.
+            total_payload_length_bits = 32 + 32 + 16 + len(payload)
+
+            # Create the overall length header itself
+            if total_payload_length_bits >= (1 << HEADER_BIT_LENGTH): 
+                raise ValueError(f"Payload too large to store its length in {HEADER_BIT_LENGTH} bits.")
+            header = BitPayload(struct.pack('>IIIH', total_payload_length_bits, int(unique_id, 2), len(payload), frame_rate))
+            body_start_pixel = None
+        else:
+            # Versioned layout: PAYLOAD_HEADER + (optionally compressed) audio at the chosen density
+            codec = CODEC_RAW
+            audio_bits = len(payload)
+            if compression is not None:
+                codec = COMPRESSION_CODECS[compression]
+                compressed = compress_payload(payload, codec, compression_level)
+                logger.info(f"Compressed payload with {compression}: {audio_bits} -> {len(compressed) * 8} bits")
+                payload = BitPayload(compressed)
+            header_bytes = PAYLOAD_HEADER.pack(
+                PAYLOAD_MAGIC, PAYLOAD_FORMAT_VERSION, codec, compression_level, density,
+                int(unique_id, 2), frame_rate, audio_bits, (len(payload) + 7) // 8
+            ) + PAYLOAD_SAMPLE_FORMAT.pack(*sample_format)
+            header = BitPayload(header_bytes + PAYLOAD_HEADER_CRC.pack(zlib.crc32(header_bytes)))
+            body_start_pixel = -(-len(header) // 3)
+        total_bits_to_embed = len(header) + len(payload)
 
         # Check capacity
-        rows, cols, _ = image_array.shape
-        max_capacity_bits = rows * cols * 3 # Max bits can be hidden
-        if total_bits_to_embed > max_capacity_bits:
-            raise ValueError(f"Insufficient space in the image. Required: {total_bits_to_embed}, Available: {max_capacity_bits}")
-
-        flat_pixels = image_array.flatten()
-
-        # Embed using cyclic LSB pattern (R-1st, G-2nd, B-3rd)
-        for i_bit in range(total_bits_to_embed):
-            if i_bit >= len(flat_pixels): # Safety break if bits exceed pixel capacity (should be caught by check above)
-                break
-
-            # Calculate which pixel component (R, G, B) and its corresponding index in flat_pixels
-            pixel_component_index = i_bit // 3 * 3 + (i_bit % 3)
-            
-            current_pixel_value = flat_pixels[pixel_component_index]
-            bit_to_embed = int(final_binary_to_embed[i_bit])
-
-            if i_bit % 3 == 0: # 1st bit of the 3-bit group (R channel's 1st LSB)
-                flat_pixels[pixel_component_index] = (current_pixel_value & ~1) | bit_to_embed
-            elif i_bit % 3 == 1: # 2nd bit of the 3-bit group (G channel's 2nd LSB)
-                flat_pixels[pixel_component_index] = (current_pixel_value & ~2) | (bit_to_embed << 1) 
-            else: # 3rd bit of the 3-bit group (B channel's 3rd LSB)
-                flat_pixels[pixel_component_index] = (current_pixel_value & ~4) | (bit_to_embed << 2) 
+        cols, rows = image.size
+        pixels_needed = payload_pixels_needed(len(payload), density, versioned=body_start_pixel is not None)
+        if pixels_needed > rows * cols:
+            versioned = body_start_pixel is not None
+            raise InsufficientCapacityError(
+                -(-len(payload) // 8) * 8 if versioned else len(payload),
+                available_body_bits(rows * cols, density, versioned),
+                f"Insufficient space in the image. Required: {pixels_needed} pixels ({total_bits_to_embed} bits), Available: {rows * cols} pixels"
+            )
+
+        # Work on one writable buffer holding only the rows the payload touches
+        payload_rows = -(-pixels_needed // cols)
+        pixel_buffer = np.array(image.crop((0, 0, cols, payload_rows)))
+        flat_pixels = pixel_buffer.reshape(-1)
+
+        # Embed the header using cyclic LSB pattern (R-1st, G-2nd, B-3rd)
+        embed_payload_bits(flat_pixels, header)
+        if body_start_pixel is None:
+            embed_payload_bits(flat_pixels, payload, len(header))
+        else:
+            embed_payload_dense(flat_pixels, payload, body_start_pixel, density)
         
-        stego_image = Image.fromarray(flat_pixels.reshape(image_array.shape).astype(np.uint8))
+        # Write the modified rows back; the untouched rows are never copied
+        image.paste(Image.fromarray(pixel_buffer), (0, 0))
+        stego_image = image
 
         if output_image_path:
             stego_image.save(output_image_path)
 
         return stego_image
 
+    except InsufficientCapacityError as e:
+        logger.error(str(e))
+        raise
     except Exception as e:
         logger.error(f"Error processing image during embedding: {str(e)}")
         raise IOError(f"Error processing image during embedding: {str(e)}")
 
-def extract_bits_from_image(image_path: Union[str, BytesIO], expected_bits_to_read: Optional[int] = None) -> str:
+def read_pixel_prefix(image: Image.Image, n_pixels: int) -> np.ndarray:
+    """
+    Return the first n_pixels pixels of an opened image as flat RGB components.
+    
+    Only the rows holding those pixels are cropped and converted (RGB images
+    skip the conversion), so repeated calls on the same (already decoded)
+    image stay proportional to n_pixels.
+    
+    Args:
+        image: Opened PIL image
+        n_pixels: Number of pixels (row-major) to return
+        
+    Returns:
+        np.ndarray: Read-only 1-D uint8 view of 3 * n_pixels components
+    """
+    width, height = image.size
+    n_pixels = min(n_pixels, width * height)
+    rows = min(height, -(-n_pixels // width))
+    region = image.crop((0, 0, width, rows)) if rows < height else image
+    if region.mode != 'RGB':
+        region = region.convert('RGB')
+    # Read-only view over the pixel data; reshape(-1) and slicing do not copy
+    return np.asarray(region).reshape(-1)[:n_pixels * 3]
+
+def read_pixel_range(image: Image.Image, start_pixel: int, end_pixel: int) -> Tuple[np.ndarray, int]:
+    """
+    Return the rows of an opened image that hold pixels [start_pixel, end_pixel).
+    
+    Args:
+        image: Opened PIL image
+        start_pixel: Index (row-major) of the first pixel needed
+        end_pixel: Index one past the last pixel needed
+        
+    Returns:
+        Tuple of (read-only 1-D uint8 view of the RGB components of the
+        cropped rows, index of the first pixel in that view)
+    """
+    width, height = image.size
+    end_pixel = min(end_pixel, width * height)
+    first_row = start_pixel // width
+    last_row = min(height, -(-end_pixel // width))
+    if first_row == 0 and last_row == height:
+        region = image
+    else:
+        region = image.crop((0, first_row, width, last_row))
+    if region.mode != 'RGB':
+        region = region.convert('RGB')
+    return np.asarray(region).reshape(-1), first_row * width
+
+def _read_body_bits(image: Image.Image, body_start_bit: int, density: int, bit_offset: int, n_bits: int) -> BitPayload:
+    """
+    Read n_bits of an embedded body, starting bit_offset bits into it.
+    
+    Only the rows holding the requested bits are read, so the cost follows
+    n_bits rather than the size of the body.
+    
+    Args:
+        image: Opened PIL image
+        body_start_bit: Flat component index where the body starts (pixel aligned unless density is 3)
+        density: Bits per pixel of the body (key of DENSITY_MODES)
+        bit_offset: First body bit to read
+        n_bits: Number of bits to read
+    """
+    if density == 3:
+        # Cyclic layout: body bit b is stored in flat component body_start_bit + b
+        start = body_start_bit + bit_offset
+        flat_pixels, first_pixel = read_pixel_range(image, start // 3, -(-(start + n_bits) // 3))
+        return extract_payload_bits(flat_pixels, start - first_pixel * 3, n_bits)
+
+    body_start_pixel = body_start_bit // 3
+    start_pixel = body_start_pixel + bit_offset // density
+    skip = bit_offset % density
+    end_pixel = body_start_pixel + -(-(bit_offset + n_bits) // density)
+    flat_pixels, first_pixel = read_pixel_range(image, start_pixel, end_pixel)
+    bits = extract_payload_dense(flat_pixels, start_pixel - first_pixel, skip + n_bits, density)
+    if skip:
+        bits = BitPayload.from_bits(bits.unpack()[skip:])
+    return bits
+
+def sample_window(n_samples: int, frame_rate: int, start: Optional[float] = None, end: Optional[float] = None,
+                  unit: str = 'seconds') -> Tuple[int, int]:
+    """
+    Convert a requested start/end into a [first, last) sample range of the clip.
+    
+    Args:
+        n_samples: Number of samples in the clip
+        frame_rate: Clip frame rate
+        start: Window start (None: start of the clip)
+        end: Window end (None: end of the clip)
+        unit: 'seconds' or 'samples'
+        
+    Returns:
+        Tuple of (first sample, sample after the last), clipped to the clip
+        
+    Raises:
+        ValueError: If the unit or the window is invalid
+    """
+    if unit not in ('seconds', 'samples'):
+        raise ValueError("Unit must be 'seconds' or 'samples'")
+    scale = frame_rate if unit == 'seconds' else 1
+    first = 0 if start is None else int(np.floor(start * scale))
+    last = n_samples if end is None else int(np.ceil(end * scale))
+    if first < 0 or last < 0:
+        raise ValueError("Window start and end must not be negative")
+    first, last = min(first, n_samples), min(last, n_samples)
+    if last <= first:
+        raise ValueError("Window end must be after its start and within the clip")
+    return first, last
+
+def extract_bits_from_image(image_path: Union[str, BytesIO, Image.Image], expected_bits_to_read: Optional[int] = None) -> BitPayload:
     """
     Extracts bits from an RGB image using the cyclic pattern (R-1st LSB, G-2nd LSB, B-3rd LSB).
     
     Args:
-        image_path: Path to the input image or BytesIO object.
+        image_path: Path to the input image, BytesIO object, or an already opened image.
         expected_bits_to_read: Optional. The total number of bits expected to be extracted.
                                If None, extracts all possible bits.
     Returns:
-        str: A binary string of extracted bits.
+        BitPayload: The extracted bits (``str()`` gives the legacy binary string).
     """
-    img = Image.open(image_path).convert('RGB')
-    data = np.array(img)
-    flat_pixels = data.flatten()
-
-    bit_stream = []
-    # Iterate through R, G, B components, extracting 3 bits per pixel
-    for i in range(0, len(flat_pixels), 3):
-        if i + 2 >= len(flat_pixels): # Ensure we have R, G, and B components
-            break
-
-        r_val = flat_pixels[i]
-        g_val = flat_pixels[i+1]
-        b_val = flat_pixels[i+2]
+    img = image_path if isinstance(image_path, Image.Image) else Image.open(image_path)
+    width, height = img.size
 
-        # Extract 1st LSB from R
-        bit_stream.append(str(r_val & 1))
-        # Extract 2nd LSB from G
-        bit_stream.append(str((g_val >> 1) & 1))
-        # Extract 3rd LSB from B
-        bit_stream.append(str((b_val >> 2) & 1))
-        
-        if expected_bits_to_read and len(bit_stream) >= expected_bits_to_read:
-            break
+    available_bits = width * height * 3
+    n_bits = min(expected_bits_to_read, available_bits) if expected_bits_to_read else available_bits
 
-    return ''.join(bit_stream)[:expected_bits_to_read] if expected_bits_to_read else ''.join(bit_stream)
+    # Extract 1st LSB from R, 2nd LSB from G and 3rd LSB from B of the needed pixels only
+    flat_pixels = read_pixel_prefix(img, -(-n_bits // 3))
+    return extract_payload_bits(flat_pixels, 0, n_bits)
 
 def binary_string_to_bytes(binary_data_string: str) -> bytes:
     """
     Converts a binary string to a bytes object.
+    Compatibility wrapper around BitPayload; an incomplete last byte is dropped.
     """
-    byte_data = bytearray()
-    for i in range(0, len(binary_data_string), 8):
-        byte_str = binary_data_string[i:i+8]
-        if len(byte_str) < 8: # Handle incomplete last byte if any
-            break
-        byte_data.append(int(byte_str, 2))
-    return bytes(byte_data)
+    payload = BitPayload.from_string(binary_data_string)
+    return payload.data[:len(payload) // 8].tobytes()
+
+def _extract_versioned_payload(image: Image.Image, available_bits: int, start: Optional[float] = None,
+                               end: Optional[float] = None, unit: str = 'seconds') -> Tuple[BitPayload, int, int]:
+    """
+    Extract a payload written with PAYLOAD_HEADER (see embed_data_rgb).
 
-def extract_data_from_image(image_path: Union[str, BytesIO]) -> Tuple[str, int, int]:
+    The header is validated (CRC, field ranges, capacity) before any body
+    pixels are read. Uncompressed bodies are read only for the requested
+    window; compressed bodies are decoded in full and then cut.
+    """
+    if payload_header_bits(1) > available_bits:
+        raise ValueError("Image too small to hold the payload header")
+    version = extract_bits_from_image(image, expected_bits_to_read=40).to_bytes()[4]
+    if not 1 <= version <= PAYLOAD_FORMAT_VERSION:
+        raise ValueError(f"Unsupported payload format version: {version}")
+    header_bits = payload_header_bits(version)
+    if header_bits > available_bits:
+        raise ValueError("Image too small to hold the payload header")
+    header = extract_bits_from_image(image, expected_bits_to_read=header_bits).to_bytes()
+    if version >= 2:
+        (crc,) = PAYLOAD_HEADER_CRC.unpack_from(header, len(header) - PAYLOAD_HEADER_CRC.size)
+        if zlib.crc32(header[:-PAYLOAD_HEADER_CRC.size]) != crc:
+            raise ValueError("Payload header checksum mismatch. Image might be corrupted.")
+    _, _, codec, _, density, unique_id, frame_rate, audio_bits, stored_bytes = PAYLOAD_HEADER.unpack_from(header)
+    sample_format = SAMPLE_FORMAT_SCALED
+    if version >= 3:
+        sample_format = PAYLOAD_SAMPLE_FORMAT.unpack_from(header, PAYLOAD_HEADER.size)
+    pcm = sample_format != SAMPLE_FORMAT_SCALED
+    if pcm and (sample_format[0] not in (1, 2) or sample_format[1] not in SUPPORTED_SAMPLE_WIDTHS):
+        raise ValueError(f"Unsupported payload sample format: {sample_format}")
+    frame_bits = sample_format[0] * sample_format[1] * 8 if pcm else 16
+
+    # Density 0 was written by images predating density modes and means the cyclic layout
+    density = density or DEFAULT_DENSITY
+    if density not in DENSITY_MODES:
+        raise ValueError(f"Unsupported payload density: {density}")
+    if codec not in (CODEC_RAW, CODEC_ZLIB, CODEC_LZMA):
+        raise ValueError(f"Unsupported payload codec: {codec}")
+    if not MIN_FRAME_RATE <= frame_rate <= MAX_FRAME_RATE:
+        raise ValueError(f"Invalid frame rate in payload header: {frame_rate}")
+    max_audio_bits = MAX_AUDIO_DURATION * MAX_FRAME_RATE * frame_bits
+    if audio_bits > max_audio_bits:
+        raise ValueError(f"Payload header declares {audio_bits} audio bits, more than the maximum of {max_audio_bits}")
+    if pcm and audio_bits % frame_bits:
+        raise ValueError("Payload length is not a whole number of PCM frames")
+    if codec == CODEC_RAW and audio_bits > stored_bytes * 8:
+        raise ValueError("Stored payload is shorter than the embedded audio length")
+
+    body_start_pixel = -(-header_bits // 3)
+    pixels_needed = body_start_pixel + -(-stored_bytes * 8 // density)
+    if pixels_needed * 3 > available_bits:
+        raise ValueError("Extracted bit stream is shorter than expected payload length. Image might be corrupted.")
+
+    ranged = start is not None or end is not None
+    if codec == CODEC_RAW:
+        bit_offset, n_bits = 0, audio_bits
+        if ranged:
+            first, last = sample_window(audio_bits // frame_bits, frame_rate, start, end, unit)
+            bit_offset, n_bits = first * frame_bits, (last - first) * frame_bits
+        extracted_audio_binary = _read_body_bits(image, body_start_pixel * 3, density, bit_offset, n_bits)
+    else:
+        flat_pixels = read_pixel_prefix(image, pixels_needed)
+        stored = extract_payload_dense(flat_pixels, body_start_pixel, stored_bytes * 8, density)
+        extracted_audio_binary = decompress_payload(stored.to_bytes(), codec, audio_bits)
+        if ranged:
+            first, last = sample_window(audio_bits // frame_bits, frame_rate, start, end, unit)
+            frame_bytes = frame_bits // 8
+            extracted_audio_binary = BitPayload(extracted_audio_binary.data[first * frame_bytes:last * frame_bytes])
+
+    if pcm:
+        extracted_audio_binary = PcmPayload(extracted_audio_binary.data, *sample_format, len(extracted_audio_binary))
+    return extracted_audio_binary, frame_rate, unique_id
+
+def extract_data_from_image(image_path: Union[str, BytesIO], start: Optional[float] = None,
+                            end: Optional[float] = None, unit: str = 'seconds') -> Tuple[BitPayload, int, int]:
     """
     Extracts unique ID, audio binary data, and frame rate from a stego image.
     Uses the cyclic LSB extraction pattern (R-1st LSB, G-2nd LSB, B-3rd LSB).
     
+    With start and/or end only that window of the clip is returned. For
+    uncompressed payloads only the pixels holding the window are decoded.
+    
     Args:
         image_path: Path to the stego image or BytesIO object
+        start: Optional window start (in unit)
+        end: Optional window end (in unit)
+        unit: 'seconds' or 'samples' (frames of the embedded clip)
         
     Returns:
         Tuple containing:
-        - extracted_audio_binary: Binary string representation of extracted audio
+        - extracted_audio_binary: Packed bit payload of the extracted audio (window);
+          a PcmPayload for audio embedded in the 'pcm' payload mode
         - frame_rate: Extracted audio frame rate
         - unique_id: Extracted unique ID (as integer)
         
@@ -327,43 +1336,41 @@ def extract_data_from_image(image_path: Union[str, BytesIO]) -> Tuple[str, int,
         IOError: If there are issues reading the image
     """
     try:
-        # First, extract enough bits to read the overall length header
-        # We need at least HEADER_BIT_LENGTH bits from the start
-        initial_bit_stream = extract_bits_from_image(image_path, expected_bits_to_read=HEADER_BIT_LENGTH)
+        # Decode the image once; both reads below only slice the pixel prefix they need
+        image = Image.open(image_path)
+        width, height = image.size
+        available_bits = width * height * 3
 
-        if len(initial_bit_stream) < HEADER_BIT_LENGTH:
+        # Read the overall length header from the first 11 pixels (32 bits)
+        if available_bits < HEADER_BIT_LENGTH:
             raise ValueError("Not enough bits to extract overall length header. Image might be too small or corrupted.")
-        
-        overall_length_header_binary = initial_bit_stream
-        total_payload_length_bits = int(overall_length_header_binary, 2)
-
-        # Now extract the full payload based on the total length
-        full_bit_stream = extract_bits_from_image(image_path, expected_bits_to_read=HEADER_BIT_LENGTH + total_payload_length_bits)
-
-        if len(full_bit_stream) < HEADER_BIT_LENGTH + total_payload_length_bits:
+        initial_bit_stream = extract_bits_from_image(image, expected_bits_to_read=HEADER_BIT_LENGTH)
+
+        if initial_bit_stream.to_bytes() == PAYLOAD_MAGIC:
+            return _extract_versioned_payload(image, available_bits, start, end, unit)
+
+        # Legacy layout: overall length + Unique ID (32 bits) + Audio Length (32 bits) + Frame Rate (16 bits) + Audio Data.
+        # Check the 112 header bits (38 pixels) for consistency before reading the body,
+        # so ordinary images are rejected without walking their pixels.
+        legacy_header_bits = HEADER_BIT_LENGTH + 32 + 32 + 16
+        if available_bits < legacy_header_bits:
+            raise ValueError("Image too small to hold the payload header")
+        legacy_header = extract_bits_from_image(image, expected_bits_to_read=legacy_header_bits).to_bytes()
+        total_payload_length_bits, extracted_unique_id, extracted_audio_length, extracted_frame_rate = struct.unpack('>IIIH', legacy_header)
+
+        if total_payload_length_bits < (32 + 32 + 16) or extracted_audio_length != total_payload_length_bits - 80:
+            raise ValueError("Image does not contain an embedded payload")
+        if not MIN_FRAME_RATE <= extracted_frame_rate <= MAX_FRAME_RATE:
+            raise ValueError("Image does not contain an embedded payload")
+        if HEADER_BIT_LENGTH + total_payload_length_bits > available_bits:
             raise ValueError("Extracted bit stream is shorter than expected payload length. Image might be corrupted.")
 
-        # Separate the overall length header from the actual payload
-        actual_payload_bits = full_bit_stream[HEADER_BIT_LENGTH : HEADER_BIT_LENGTH + total_payload_length_bits]
-
-        # Parse the components from the actual payload
-        # Unique ID (32 bits) + Audio Length (32 bits) + Frame Rate (16 bits) + Audio Data
-        if len(actual_payload_bits) < (32 + 32 + 16): # Minimum header size
-            raise ValueError("Actual payload too short to contain header information.")
-
-        unique_id_binary_str = actual_payload_bits[:32]
-        audio_length_binary_str = actual_payload_bits[32:64]
-        frame_rate_binary_str = actual_payload_bits[64:80]
-        extracted_audio_binary = actual_payload_bits[80:]
-
-        # Convert to appropriate types
-        extracted_unique_id = int(unique_id_binary_str, 2)
-        extracted_audio_length = int(audio_length_binary_str, 2)
-        extracted_frame_rate = int(frame_rate_binary_str, 2)
-
-        # Validate extracted audio length (optional, but good for sanity check)
-        if len(extracted_audio_binary) != extracted_audio_length:
-            logger.warning(f"Extracted audio binary length ({len(extracted_audio_binary)}) does not match embedded length ({extracted_audio_length}). Data might be truncated.")
+        # Read the audio (or the requested window of it) that follows the 112 header bits
+        bit_offset, n_bits = 0, extracted_audio_length
+        if start is not None or end is not None:
+            first, last = sample_window(extracted_audio_length // 16, extracted_frame_rate, start, end, unit)
+            bit_offset, n_bits = first * 16, (last - first) * 16
+        extracted_audio_binary = _read_body_bits(image, legacy_header_bits, DEFAULT_DENSITY, bit_offset, n_bits)
         
         return extracted_audio_binary, extracted_frame_rate, extracted_unique_id
 
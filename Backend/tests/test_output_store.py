@@ -0,0 +1,30 @@
+import os
+import pytest
+from output_store import OutputStore
+
+
+def test_relative_root_is_resolved_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = OutputStore(root="output", async_writes=False)
+    key = store.put(b"stego image", "png")
+
+    # A later change of working directory must not break the stored paths
+    monkeypatch.chdir(tmp_path.parent)
+    path = store.get(key)
+    assert os.path.isabs(path)
+    with open(path, "rb") as f:
+        assert f.read() == b"stego image"
+
+
+def test_get_output_from_another_working_directory(tmp_path, monkeypatch):
+    app_module = pytest.importorskip("app")
+    # send_file resolves relative paths against app.root_path (Backend/), not the working directory
+    monkeypatch.chdir(tmp_path)
+    store = OutputStore(root="output", async_writes=False)
+    key = store.put(b"stego image", "png")
+    monkeypatch.setattr(app_module, "output_store", store)
+
+    response = app_module.app.test_client().get(f"/outputs/{key}")
+    assert response.status_code == 200
+    assert response.data == b"stego image"
+    assert response.mimetype == "image/png"
@@ -0,0 +1,72 @@
+import lzma
+import zlib
+from io import BytesIO
+import numpy as np
+import pytest
+from PIL import Image
+
+stego_rev = pytest.importorskip("stego_rev")
+
+UNIQUE_ID = format(7, '032b')
+
+
+def make_payload(n_samples, seed=0):
+    samples = np.random.default_rng(seed).integers(0, 1 << 16, n_samples, dtype=np.uint16)
+    return stego_rev.BitPayload(samples.astype('>u2').view(np.uint8))
+
+
+@pytest.mark.parametrize("codec", [stego_rev.CODEC_ZLIB, stego_rev.CODEC_LZMA])
+@pytest.mark.parametrize("n_bits", [16, 8, 1000 * 16, 1000 * 16 - 8])
+def test_compressed_payload_round_trip(codec, n_bits):
+    payload = stego_rev.BitPayload(make_payload(1000).data[:-(-n_bits // 8)], n_bits)
+    restored = stego_rev.decompress_payload(stego_rev.compress_payload(payload, codec), codec, n_bits)
+    assert restored.to_bytes() == payload.to_bytes()
+
+
+@pytest.mark.parametrize("codec, compress", [
+    (stego_rev.CODEC_ZLIB, zlib.compress),
+    (stego_rev.CODEC_LZMA, lzma.compress),
+])
+def test_oversized_compressed_payload_is_rejected(codec, compress):
+    # 64 MB of zeros compress to a few KB; the header declares 1000 samples
+    bomb = compress(bytes(64 << 20))
+    with pytest.raises(ValueError, match="longer than the embedded audio length"):
+        stego_rev.decompress_payload(bomb, codec, 1000 * 16)
+
+
+def test_truncated_or_padded_compressed_payload_is_rejected():
+    data = stego_rev.compress_payload(make_payload(1000), stego_rev.CODEC_ZLIB)
+    with pytest.raises(ValueError):
+        stego_rev.decompress_payload(data[:-4], stego_rev.CODEC_ZLIB, 1000 * 16)
+    with pytest.raises(ValueError):
+        stego_rev.decompress_payload(data + b'\0', stego_rev.CODEC_ZLIB, 1000 * 16)
+
+
+def test_extract_rejects_compression_bomb(monkeypatch):
+    # A valid header declaring 1000 samples, followed by a zlib bomb as the body
+    bomb = zlib.compress(bytes(64 << 20), 9)
+    monkeypatch.setattr(stego_rev, "compress_payload", lambda payload, codec, level: bomb)
+    carrier = BytesIO()
+    Image.new('RGB', (500, 500)).save(carrier, format='PNG')
+    stego_image = stego_rev.embed_data_rgb(carrier, 16000, UNIQUE_ID, make_payload(1000), compression='zlib')
+    stego_png = BytesIO()
+    stego_image.save(stego_png, format='PNG')
+    stego_png.seek(0)
+
+    with pytest.raises(IOError, match="longer than the embedded audio length"):
+        stego_rev.extract_data_from_image(stego_png)
+
+
+@pytest.mark.parametrize("start", [0, 1, 2])
+@pytest.mark.parametrize("count", [1, 2, 7, 30])
+def test_cyclic_bits_round_trip(start, count):
+    # Unaligned heads and tails go through the per-component path of the kernel
+    pixels = np.random.default_rng(start).integers(0, 256, 64, dtype=np.uint8)
+    original = pixels.copy()
+    bits = np.random.default_rng(count).integers(0, 2, count, dtype=np.uint8)
+    stego_rev._write_cyclic_bits(pixels, bits, start)
+    assert np.array_equal(stego_rev._read_cyclic_bits(pixels, start, count), bits)
+    # Only the cyclic LSB of each touched component may change
+    assert not np.any((pixels ^ original) & stego_rev.CYCLIC_CLEAR_MASKS[np.arange(pixels.size) % 3])
+    untouched = np.r_[0:start, start + count:pixels.size]
+    assert np.array_equal(pixels[untouched], original[untouched])
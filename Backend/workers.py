@@ -0,0 +1,258 @@
+import os
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+import threading
+import numpy as np
+import librosa
+from fingetprint import generate_fingerprint
+from features import extract_voice_features
+from spectrum_plot import spectrogram_to_db_image
+from audio_io import decode_audio
+from stego_rev import (PcmPayload, audio_to_pcm, embed_data_rgb, extract_data_from_image, payload_to_samples,
+                       pcm_to_binary, pcm_to_float, write_pcm_wav, write_wav)
+from logger import logger
+from config import config
+
+
+def _init_worker() -> None:
+    """Load librosa's lazily imported submodules once per worker so the first task does not pay for it."""
+    librosa.feature.mfcc
+    librosa.filters.mel
+
+
+def _warm_up() -> int:
+    """No-op task used to start the worker processes ahead of the first request."""
+    return os.getpid()
+
+
+class WorkerPool:
+    """
+    Managed process pool for the CPU-bound stego and audio stages.
+
+    Work submitted here runs outside the Flask request threads, so concurrent
+    requests are not serialized by the GIL. With WORKER_PROCESSES set to 0 the
+    tasks run inline on the calling thread instead.
+    """
+
+    def __init__(self, processes: Optional[int] = None, timeout: Optional[float] = None,
+                 start_method: Optional[str] = None):
+        """
+        Initialize the pool (worker processes are started lazily or by start()).
+
+        Args:
+            processes: Number of worker processes (None: CPU count, 0: run inline)
+            timeout: Default seconds to wait for a task result
+            start_method: multiprocessing start method for the workers
+        """
+        self.processes = config['WORKER_PROCESSES'] if processes is None else processes
+        if self.processes is None:
+            self.processes = os.cpu_count() or 1
+        self.timeout = config['WORKER_TIMEOUT'] if timeout is None else timeout
+        self.start_method = start_method or config['WORKER_START_METHOD']
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def inline(self) -> bool:
+        """Whether tasks run on the calling thread."""
+        return self.processes == 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context(self.start_method),
+                    initializer=_init_worker
+                )
+                logger.info(f"Started worker pool with {self.processes} processes ({self.start_method})")
+            return self._executor
+
+    def start(self) -> None:
+        """Start all worker processes and wait until each has imported the audio stack."""
+        if self.inline:
+            return
+        executor = self._get_executor()
+        futures = [executor.submit(_warm_up) for _ in range(self.processes)]
+        for future in futures:
+            future.result(timeout=self.timeout)
+        logger.info("Worker pool warmed up")
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """
+        Submit a task. fn and its arguments must be picklable (module-level functions).
+
+        Returns:
+            Future: The pending task (already completed when running inline)
+        """
+        if self.inline:
+            future = Future()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        try:
+            return self._get_executor().submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            self.restart()
+            return self._get_executor().submit(fn, *args, **kwargs)
+
+    def wait(self, future: Future, timeout: Optional[float] = None) -> Any:
+        """
+        Wait for a submitted task.
+
+        Raises:
+            concurrent.futures.TimeoutError: If the task does not finish in time
+            Exception: Whatever the task raised
+        """
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except BrokenProcessPool:
+            logger.error("Worker process died, restarting pool")
+            self.restart()
+            raise
+
+    def run(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """Submit a task and wait for its result."""
+        return self.wait(self.submit(fn, *args, **kwargs), timeout)
+
+    def restart(self) -> None:
+        """Replace a broken executor with a fresh one."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        """Stop the worker processes."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+            logger.info("Worker pool shut down")
+
+
+# Tasks. These run inside the worker processes, so they take and return plain
+# picklable values (bytes, paths, arrays) rather than request objects.
+
+def fingerprint_task(audio: Union[bytes, str, Tuple[np.ndarray, int]]) -> np.ndarray:
+    """Generate the MFCC fingerprint of WAV bytes, a file path or decoded (samples, sample_rate)."""
+    return generate_fingerprint(BytesIO(audio) if isinstance(audio, bytes) else audio)
+
+
+def embed_task(image_bytes: bytes, audio_bytes: bytes, unique_id: str, compression: Optional[str],
+               compression_level: int, density: int, png_compress_level: Optional[int] = None,
+               legacy_layout: bool = False, payload_mode: str = 'scaled') -> Tuple[bytes, np.ndarray]:
+    """
+    Fingerprint the audio, embed it into the image and encode the stego image as PNG.
+
+    The WAV header is parsed once: the fingerprint and the payload are both
+    derived from the same frames, which are read from the upload in blocks
+    (the only full-length copy is the float samples fingerprinted). The PNG
+    is encoded once; the caller stores and sends the same bytes. In the 'pcm' payload mode the WAV frames are embedded
+    unchanged, so extraction returns the original audio bit for bit.
+
+    Returns:
+        Tuple of (PNG bytes, fingerprint)
+
+    Raises:
+        ValueError: If the audio could not be converted
+        InsufficientCapacityError: If the (compressed) payload does not fit into the image
+        IOError: If embedding or encoding failed
+    """
+    try:
+        pcm, frame_rate = audio_to_pcm(BytesIO(audio_bytes), stream=True)
+        binary_data = pcm if payload_mode == 'pcm' else pcm_to_binary(pcm)
+        # Same samples librosa.load returns for the WAV
+        samples = pcm_to_float(pcm)
+    except (ValueError, IOError) as e:
+        raise ValueError(str(e))
+
+    fingerprint = generate_fingerprint((samples, frame_rate))
+
+    stego_image = embed_data_rgb(
+        BytesIO(image_bytes),
+        frame_rate,
+        unique_id,
+        binary_data,
+        compression=compression,
+        compression_level=compression_level,
+        density=density,
+        legacy_layout=legacy_layout
+    )
+    if png_compress_level is None:
+        png_compress_level = config['PNG_COMPRESS_LEVEL']
+    image_buffer = BytesIO()
+    stego_image.save(image_buffer, format="PNG", compress_level=png_compress_level)
+    return image_buffer.getvalue(), fingerprint
+
+
+def extract_audio_task(image_bytes: bytes, start: Optional[float] = None, end: Optional[float] = None,
+                       unit: str = 'seconds', with_fingerprint: bool = False
+                       ) -> Tuple[int, int, bytes, Optional[np.ndarray]]:
+    """
+    Extract the embedded audio (or a start/end window of it) from a stego image.
+
+    The samples stay in memory: the WAV is encoded into a buffer and, with
+    with_fingerprint, the fingerprint is computed from the decoded samples
+    instead of parsing the WAV again.
+
+    Returns:
+        Tuple of (unique_id, frame_rate, WAV bytes, fingerprint or None)
+    """
+    extracted_binary, frame_rate, unique_id = extract_data_from_image(BytesIO(image_bytes), start, end, unit)
+    audio_buffer = BytesIO()
+    if isinstance(extracted_binary, PcmPayload):
+        # Native frames go back out with their original channels and sample width
+        write_pcm_wav(extracted_binary, frame_rate, audio_buffer)
+        samples = pcm_to_float(extracted_binary) if with_fingerprint else None
+    else:
+        samples = payload_to_samples(extracted_binary)
+        write_wav(samples, frame_rate, audio_buffer)
+        # Same scaling librosa.load applies to 16-bit PCM
+        samples = samples / np.float32(32768)
+
+    fingerprint = None
+    if with_fingerprint:
+        # Matches fingerprinting the WAV with librosa.load
+        fingerprint = generate_fingerprint((samples, frame_rate))
+    return unique_id, frame_rate, audio_buffer.getvalue(), fingerprint
+
+
+# Sample rate the /compare_audio features are computed at (librosa.load's default)
+COMPARE_SAMPLE_RATE = 22050
+
+
+def voice_features_task(audio: Union[bytes, str], filename: str = '') -> Dict[str, Any]:
+    """
+    Decode an audio upload (or load a file path) and compute the speaker
+    features compared by /compare_audio.
+
+    Uploads are decoded in memory (see audio_io.decode_audio) and resampled
+    to COMPARE_SAMPLE_RATE, as librosa.load did for the converted WAV.
+    The spectrogram is returned reduced to an 8-bit dB image
+    ("spectrum_image") for the spectrum plot, which keeps the result small
+    to send back from the worker and to cache.
+
+    Raises:
+        AudioDecodeError: If the upload cannot be decoded
+    """
+    if isinstance(audio, bytes):
+        y, sr = decode_audio(audio, filename)
+        if sr != COMPARE_SAMPLE_RATE:
+            y = librosa.resample(y, orig_sr=sr, target_sr=COMPARE_SAMPLE_RATE)
+            sr = COMPARE_SAMPLE_RATE
+    else:
+        # Load audio file
+        y, sr = librosa.load(audio)
+    features = extract_voice_features(y, sr)
+    features["spectrum_image"] = spectrogram_to_db_image(features.pop("spectrum"), sr)
+    return features
+
+
+# Create a global worker pool instance
+worker_pool = WorkerPool()
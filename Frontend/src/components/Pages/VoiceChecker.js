@@ -92,7 +92,8 @@ const VoiceChecker = () => {
                 feature_thresholds: response.data.feature_thresholds || {},
                 overall_similarity: response.data.overall_similarity || 0,
                 is_same_speaker: response.data.is_same_speaker || false,
-                spectrum_plot: response.data.spectrum_plot || null
+                spectrum_plot: response.data.spectrum_plot || null,
+                spectrum_plot_url: response.data.spectrum_plot_url || null
             };
 
             console.log('Processed Data:', processedData); // Debug log
@@ -321,12 +322,14 @@ const VoiceChecker = () => {
                     </Paper>
 
                     {/* Spectrum Visualization */}
-                    {result.spectrum_plot && (
+                    {(result.spectrum_plot || result.spectrum_plot_url) && (
                         <Paper className="spectrum-section" sx={{ mt: 4 }}>
                             <Typography variant="h6" gutterBottom>Spectrum Comparison</Typography>
                             <Box className="spectrum-plot">
                                 <img 
-                                    src={`data:image/png;base64,${result.spectrum_plot}`}
+                                    src={result.spectrum_plot
+                                        ? `data:image/png;base64,${result.spectrum_plot}`
+                                        : `http://localhost:5000${result.spectrum_plot_url}`}
                                     alt="Audio Spectrum Comparison"
                                     onError={(e) => {
                                         console.error('Error loading spectrum plot:', e); // Debug log